@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MiniInstaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mini_insta'
+
+    def ready(self):
+        '''Connects the profile counter, timeline, image pipeline, media reference, search index and relationship cache receivers.'''
+        from . import counters, timeline, images, blobs, fts, relationships #counters first, the timeline receivers read the updated follower counts
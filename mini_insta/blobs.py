@@ -0,0 +1,94 @@
+## mini_insta/blobs.py
+## Author: William Fugate wfugate@bu.edu
+## description: reference counting and garbage collection for the content-addressed photo files
+import os
+import time
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import MediaBlob, Photo
+from .storage import BLOB_DIRECTORY, blob_storage
+
+#files touched more recently than this are never collected, so an upload that has just been
+#deduplicated onto a file can't lose it before its photo is saved
+GRACE_SECONDS = 60 * 60
+
+def acquire(names):
+    '''Adds one reference to each of the named files.'''
+    for name in names:
+        if not MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1):
+            MediaBlob.objects.bulk_create([MediaBlob(name=name)], ignore_conflicts=True) #someone else may create it first
+            MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1)
+
+def release(names):
+    '''Removes one reference from each of the named files, and deletes those nobody uses any more.'''
+    names = list(names)
+    for name in names:
+        MediaBlob.objects.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    transaction.on_commit(lambda: collect_garbage(names))
+
+def disown(names):
+    '''Records files that were written but never referenced, so garbage collection deletes them once their grace period is over.'''
+    names = list(names)
+    MediaBlob.objects.bulk_create([MediaBlob(name=name) for name in names], ignore_conflicts=True) #with no reference, if it is not used already
+    transaction.on_commit(lambda: collect_garbage(names))
+
+def is_recent(name):
+    '''Returns whether a stored file was written or reused within the grace period.'''
+    try:
+        return time.time() - os.path.getmtime(blob_storage.path(name)) < GRACE_SECONDS
+    except FileNotFoundError:
+        return False
+
+def collect_garbage(names=None):
+    '''Deletes the files with no references (among names, or all of them), unless they are in their grace period.
+
+    With names=None, files in the blob directory that never got a MediaBlob row (an upload whose
+    photo was never saved) are collected too. Returns the number of files deleted.
+    '''
+    unused = MediaBlob.objects.filter(ref_count=0)
+    if names is not None:
+        unused = unused.filter(name__in=names)
+    candidates = set(unused.values_list('name', flat=True))
+    if names is None:
+        candidates.update(find_untracked_files())
+
+    deleted = 0
+    for name in candidates:
+        if is_recent(name):
+            continue
+        with transaction.atomic():
+            #only if it is still unused; a new reference may have been added since
+            if MediaBlob.objects.filter(name=name, ref_count__gt=0).exists():
+                continue
+            MediaBlob.objects.filter(name=name).delete()
+            if blob_storage.exists(name):
+                blob_storage.delete(name)
+                deleted += 1
+    return deleted
+
+def find_untracked_files():
+    '''Returns the names of the stored files that have no MediaBlob row.'''
+    names = set()
+    root = blob_storage.path(BLOB_DIRECTORY)
+    for directory, _, files in os.walk(root):
+        for file_name in files:
+            if not file_name.startswith('.'): #skips uploads still being written
+                names.add(os.path.relpath(os.path.join(directory, file_name), blob_storage.location).replace(os.sep, '/'))
+    tracked = set()
+    names = sorted(names)
+    for i in range(0, len(names), 500): #stay under SQLite's variable limit
+        tracked.update(MediaBlob.objects.filter(name__in=names[i:i + 500]).values_list('name', flat=True))
+    return set(names) - tracked
+
+@receiver(post_save, sender=Photo)
+def reference_uploaded_file(instance, created, **kwargs):
+    '''Counts a new photo's reference to its uploaded file.'''
+    if created and instance.image_file:
+        acquire([instance.image_file.name])
+
+@receiver(post_delete, sender=Photo)
+def release_photo_files(instance, **kwargs):
+    '''Releases a deleted photo's upload and renditions, deleting the files if no other photo uses them.'''
+    release(instance.get_file_names())
@@ -0,0 +1,61 @@
+## mini_insta/counters.py
+## Author: William Fugate wfugate@bu.edu
+## description: keeps the denormalized follower/following/post counts on Profile up to date
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Follow, Post, Profile, count_related
+
+def get_actual_counts():
+    '''Returns the counts each Profile counter should hold, as update()/annotate() keyword arguments.'''
+    return {
+        'follower_count': count_related(Follow, 'profile'),
+        'following_count': count_related(Follow, 'follower_profile'),
+        'post_count': count_related(Post, 'profile'),
+    }
+
+def reconcile_profile_counters(pks=None):
+    '''Recounts the counters of the given profile pks (or every profile) and fixes any that drifted.
+
+    Returns the number of profiles that had a wrong count.
+    '''
+    queryset = Profile.objects.all() if pks is None else Profile.objects.filter(pk__in=pks)
+    actual = {f'actual_{field}': expression for field, expression in get_actual_counts().items()}
+    drifted = Q()
+    for field in get_actual_counts():
+        drifted |= ~Q(**{field: F(f'actual_{field}')})
+    drifted_pks = list(queryset.annotate(**actual).filter(drifted).values_list('pk', flat=True))
+    if drifted_pks:
+        Profile.objects.filter(pk__in=drifted_pks).update(**get_actual_counts()) #recounted in the same statement that writes them
+    return len(drifted_pks)
+
+def adjust(pk, field, delta):
+    '''Adds delta to one counter of one profile in the database, without reading it first.'''
+    profiles = Profile.objects.filter(pk=pk)
+    if delta < 0:
+        profiles = profiles.filter(**{f'{field}__gte': -delta}) #a drifted count stays at 0 rather than failing the unsigned check
+    profiles.update(**{field: F(field) + delta})
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(instance, created, **kwargs):
+    '''Counts a new follow for both profiles.'''
+    if created:
+        adjust(instance.profile_id, 'follower_count', 1)
+        adjust(instance.follower_profile_id, 'following_count', 1)
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(instance, **kwargs):
+    '''Uncounts an unfollow for both profiles.'''
+    adjust(instance.profile_id, 'follower_count', -1)
+    adjust(instance.follower_profile_id, 'following_count', -1)
+
+@receiver(post_save, sender=Post)
+def count_new_post(instance, created, **kwargs):
+    '''Counts a new post for its profile.'''
+    if created:
+        adjust(instance.profile_id, 'post_count', 1)
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(instance, **kwargs):
+    '''Uncounts a deleted post for its profile.'''
+    adjust(instance.profile_id, 'post_count', -1)
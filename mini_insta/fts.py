@@ -0,0 +1,151 @@
+## mini_insta/fts.py
+## Author: William Fugate wfugate@bu.edu
+## description: SQLite FTS5 search index over post captions and profiles
+import re
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Post, Profile, with_post_details
+from .pagination import PAGE_SIZE, PostPage, decode_key, encode_key
+
+POST_TABLE = 'mini_insta_post_fts'
+PROFILE_TABLE = 'mini_insta_profile_fts'
+
+#matching posts are ranked this many at a time, newest first, which keeps a page of a search
+#on a common word as cheap as one on a rare word however many posts there are
+POST_CANDIDATES = 1000
+#a post this many days newer outranks an equally relevant one by one bm25 point
+RECENCY_DAYS_PER_POINT = 30
+#how many profiles are shown above the posts
+PROFILE_RESULTS = 10
+#bm25 weights of username, display_name and bio_text
+PROFILE_WEIGHTS = (10.0, 5.0, 1.0)
+
+CREATE_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {POST_TABLE} USING fts5("
+    "caption, created UNINDEXED, prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {PROFILE_TABLE} USING fts5("
+    "username, display_name, bio_text, prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+]
+
+DROP_SQL = [f"DROP TABLE IF EXISTS {POST_TABLE}", f"DROP TABLE IF EXISTS {PROFILE_TABLE}"]
+
+def is_supported():
+    '''Returns whether the database can hold the index (FTS5 is SQLite only).'''
+    return connection.vendor == 'sqlite'
+
+def index_rows(cursor, table, where, params):
+    '''Copies the selected posts or profiles (table is POST_TABLE or PROFILE_TABLE) into the index.'''
+    if table == POST_TABLE:
+        cursor.execute(
+            f"INSERT INTO {POST_TABLE} (rowid, caption, created) "
+            f"SELECT id, caption, CAST(strftime('%%s', timestamp) AS REAL) FROM mini_insta_post {where}", params)
+    else:
+        cursor.execute(
+            f"INSERT INTO {PROFILE_TABLE} (rowid, username, display_name, bio_text) "
+            f"SELECT id, username, display_name, bio_text FROM mini_insta_profile {where}", params)
+
+def reindex(table, pk):
+    '''Brings one post's or profile's row in the index up to date (removing it if it was deleted).'''
+    if not is_supported():
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE rowid = %s", [pk])
+        index_rows(cursor, table, "WHERE id = %s", [pk])
+
+def get_match(query):
+    '''Turns a search string into an FTS5 query: every word must match, the last one as a prefix.
+
+    Only the last word is a prefix, for search-as-you-type; prefix matching every word costs
+    several times more on a large index.
+    '''
+    terms = re.findall(r'\w+', query.lower()) #drops FTS5 syntax characters
+    if not terms:
+        return None
+    return ' '.join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+
+def get_post_candidates(db_cursor, match, before):
+    '''Returns (rowid, score) of the newest POST_CANDIDATES matching posts with rowids below before, newest first.'''
+    db_cursor.execute(
+        f"SELECT rowid, -bm25({POST_TABLE}) + created / %s FROM {POST_TABLE} "
+        f"WHERE {POST_TABLE} MATCH %s AND rowid < %s ORDER BY rowid DESC LIMIT %s", #FTS5 walks rowids down from before and stops
+        [RECENCY_DAYS_PER_POINT * 24 * 60 * 60, match, before, POST_CANDIDATES])
+    return db_cursor.fetchall()
+
+def decode_search_cursor(cursor):
+    '''Decodes a search cursor into (before, rank, pk): the rowid bound of the window, and the position and pk of the last post shown in it.
+
+    Returns (None, 0, None) for the first page or an invalid cursor.
+    '''
+    key = decode_key(cursor)
+    try:
+        return int(key[0]), int(key[1]), int(key[2])
+    except (ValueError, TypeError, IndexError, KeyError):
+        return None, 0, None
+
+def search_posts(query, cursor=None, page_size=PAGE_SIZE):
+    '''Returns a PostPage of the posts matching the query, ranked by relevance and recency.
+
+    The score is the bm25 relevance plus a point for every RECENCY_DAYS_PER_POINT days of
+    timestamp. Matches are ranked in windows of POST_CANDIDATES, newest first: the pages go
+    through the newest window in score order, then the next older window, and so on, so every
+    match is reachable while a page costs one window however common the words are.
+
+    The cursor holds the window's rowid bound, fixed on the first page so newer posts don't
+    shift it, and the rank and pk of the last post shown. bm25 depends on the whole index, so
+    the scores themselves change as posts are added; the next page starts after wherever that
+    post ranks now (or at its old rank if it was deleted), which only repeats or skips a post
+    if an edit reorders the window.
+    '''
+    match = get_match(query)
+    if not match:
+        return PostPage([], None)
+    before, rank, last_pk = decode_search_cursor(cursor)
+    pks = []
+    with connection.cursor() as db_cursor:
+        while True:
+            candidates = get_post_candidates(db_cursor, match, 2 ** 63 - 1 if before is None else before)
+            if before is None:
+                before = candidates[0][0] + 1 if candidates else 0
+            ranked = [pk for pk, _ in sorted(candidates, key=lambda row: (-row[1], -row[0]))] #best score first, then newest
+            if last_pk in ranked:
+                rank = ranked.index(last_pk) + 1
+            for pk in ranked[rank:]:
+                if len(pks) == page_size: #one more post, so there is a next page
+                    return load_ranked_posts(pks, encode_key([before, rank, pks[-1]]))
+                pks.append(pk)
+                rank += 1
+            if len(candidates) < POST_CANDIDATES:
+                return load_ranked_posts(pks, None)
+            before, rank, last_pk = candidates[-1][0], 0, None #on to the next older window
+
+def load_ranked_posts(pks, next_cursor):
+    '''Returns a PostPage of the posts with these pks, in this order.'''
+    posts = with_post_details(Post.objects.all()).in_bulk(pks)
+    return PostPage([posts[pk] for pk in pks if pk in posts], next_cursor)
+
+def search_profiles(query, limit=PROFILE_RESULTS):
+    '''Returns the profiles best matching the query, ranked by relevance (username and name count the most).'''
+    match = get_match(query)
+    if not match:
+        return []
+    weights = ', '.join(str(weight) for weight in PROFILE_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {PROFILE_TABLE} WHERE {PROFILE_TABLE} MATCH %s "
+            f"ORDER BY bm25({PROFILE_TABLE}, {weights}) LIMIT %s", [match, limit])
+        pks = [row[0] for row in cursor.fetchall()]
+    profiles = Profile.objects.in_bulk(pks)
+    return [profiles[pk] for pk in pks if pk in profiles]
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def reindex_post(instance, **kwargs):
+    '''Re-indexes a saved or deleted post.'''
+    reindex(POST_TABLE, instance.pk)
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def reindex_profile(instance, **kwargs):
+    '''Re-indexes a saved or deleted profile.'''
+    reindex(PROFILE_TABLE, instance.pk)
@@ -0,0 +1,97 @@
+## mini_insta/images.py
+## Author: William Fugate wfugate@bu.edu
+## description: background pipeline that makes resized, EXIF-free renditions of uploaded photos
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from PIL import Image, ImageOps
+from .blobs import acquire, disown, release
+from .models import Photo
+
+logger = logging.getLogger(__name__)
+
+#widths of the renditions made for each photo (wider than the original are skipped)
+RENDITION_WIDTHS = [320, 640, 1080]
+#format name -> (Pillow format, file extension, save options)
+RENDITION_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+#uploads are processed off the request thread by this pool
+executor = ThreadPoolExecutor(max_workers=getattr(settings, 'MINI_INSTA_IMAGE_WORKERS', 2), thread_name_prefix='mini_insta_images')
+
+def get_rendition_widths(original_width):
+    '''Returns the rendition widths to make for an image of the given width.'''
+    widths = [width for width in RENDITION_WIDTHS if width <= original_width]
+    return widths or [original_width] #a small image still gets one rendition, at its own size
+
+def flatten(image):
+    '''Returns the image as RGB (or greyscale), with any transparency composited onto white.'''
+    if image.mode in ('RGB', 'L'):
+        return image
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+def make_renditions(photo):
+    '''Resizes a photo's uploaded image into every rendition width and format, and records them on the photo.
+
+    Renditions are re-encoded from the pixels only, so EXIF data (camera, GPS location...) is not
+    copied into them; the EXIF orientation is applied first so the pixels are the right way up.
+    '''
+    with photo.image_file.open('rb') as original:
+        image = Image.open(original)
+        image = ImageOps.exif_transpose(image) #also loads the pixels, before the file is closed
+    image = flatten(image)
+
+    renditions = {name: {} for name in RENDITION_FORMATS}
+    storage = photo.image_file.storage
+    for width in get_rendition_widths(image.width):
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for name, (pillow_format, extension, options) in RENDITION_FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, pillow_format, **options)
+            #stored by content hash, so identical uploads share their renditions too
+            renditions[name][str(width)] = storage.save(f'rendition.{extension}', ContentFile(buffer.getvalue()))
+
+    new_names = [name for names in renditions.values() for name in names.values()]
+    old_names = [name for names in photo.renditions.values() for name in names.values()]
+    with transaction.atomic():
+        updated = Photo.objects.filter(pk=photo.pk).update(width=image.width, height=image.height, renditions=renditions) #no save(), so nothing re-queues it
+        if not updated: #the photo was deleted while it was being resized, nothing refers to the new files
+            disown(new_names)
+            return
+        acquire(new_names)
+        release(old_names) #when reprocessing, the previous renditions
+    photo.width, photo.height, photo.renditions = image.width, image.height, renditions
+
+def process_photo(pk):
+    '''Makes the renditions of one photo; runs on the worker pool.'''
+    try:
+        photo = Photo.objects.filter(pk=pk).first()
+        if photo and photo.image_file:
+            make_renditions(photo)
+    except Exception:
+        logger.exception('could not make renditions for photo %s', pk) #the photo keeps serving its original
+    finally:
+        connection.close() #each worker thread opens its own connection
+
+def queue_photo(pk):
+    '''Hands a photo to the worker pool once the transaction that saved it has committed.'''
+    transaction.on_commit(lambda: executor.submit(process_photo, pk))
+
+@receiver(post_save, sender=Photo)
+def queue_uploaded_photo(instance, created, **kwargs):
+    '''Queues newly uploaded photos for processing.'''
+    if created and instance.image_file:
+        queue_photo(instance.pk)
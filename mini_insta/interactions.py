@@ -0,0 +1,124 @@
+## mini_insta/interactions.py
+## Author: William Fugate wfugate@bu.edu
+## description: writes likes and follows in bulk, one insert or delete per kind of change
+from django.db import IntegrityError, router, transaction
+from django.db.models.signals import post_save
+from .models import Follow, Like, Post, Profile
+from .relationships import invalidate
+
+#most operations one batch request may carry
+MAX_OPERATIONS = 500
+
+OPERATIONS = ('like', 'unlike', 'follow', 'unfollow')
+
+def like_posts(profile, post_ids):
+    '''Likes the given posts as profile, skipping its own posts, missing posts and posts it already likes.
+
+    Returns the ids of the posts that were newly liked.
+    '''
+    with transaction.atomic():
+        lock_follows(profile) #another request can't like the same post between the select and the insert
+        new_ids = list(Post.objects.filter(pk__in=set(post_ids)).exclude(profile=profile)
+                       .exclude(like__profile=profile).values_list('pk', flat=True))
+        Like.objects.bulk_create([Like(profile=profile, post_id=pk) for pk in new_ids], ignore_conflicts=True) #like_profile_post_unique skips repeats
+    invalidate(profile.pk) #bulk_create() sends no post_save
+    return new_ids
+
+def unlike_posts(profile, post_ids):
+    '''Removes profile's likes of the given posts, and returns the ids of the posts that were liked.'''
+    with transaction.atomic():
+        likes = Like.objects.select_for_update().filter(profile=profile, post_id__in=set(post_ids))
+        unliked = list(likes.values_list('post_id', flat=True))
+        likes.delete()
+    return unliked
+
+def lock_follows(follower):
+    '''Locks follower's row until the end of the transaction, so its follows and likes are only written by one request at a time.'''
+    list(Profile.objects.select_for_update().filter(pk=follower.pk).values_list('pk', flat=True))
+
+def follow_profile(follower, profile_id):
+    '''Makes follower follow one profile, doing nothing if it is follower itself, missing or already followed.
+
+    Returns whether a follow was made. Follow.objects.create() sends post_save, which updates
+    the counters and feeds, only when the row was really inserted.
+    '''
+    if profile_id == follower.pk or not Profile.objects.filter(pk=profile_id).exists():
+        return False
+    try:
+        with transaction.atomic():
+            lock_follows(follower)
+            Follow.objects.create(follower_profile=follower, profile_id=profile_id)
+    except IntegrityError: #already following, follow_follower_profile_unique turned the repeat away
+        return False
+    return True
+
+def follow_profiles(follower, profile_ids):
+    '''Makes follower follow the given profiles, skipping itself, missing profiles and profiles it already follows.
+
+    bulk_create() with ignore_conflicts neither sends post_save nor says which rows it
+    inserted, so the pairs are selected again afterwards and post_save is sent only for
+    the ones that weren't there before, with their real pks. Returns the new follows.
+    '''
+    using = router.db_for_write(Follow)
+    with transaction.atomic(using=using):
+        lock_follows(follower) #another request can't slip the same follow in between the two selects
+        followed = Follow.objects.filter(follower_profile=follower)
+        profile_ids = set(profile_ids) - set(followed.filter(profile_id__in=set(profile_ids)).values_list('profile_id', flat=True))
+        new_ids = list(Profile.objects.filter(pk__in=profile_ids).exclude(pk=follower.pk).values_list('pk', flat=True))
+        Follow.objects.bulk_create([Follow(follower_profile=follower, profile_id=pk) for pk in new_ids], ignore_conflicts=True)
+        follows = list(followed.filter(profile_id__in=new_ids))
+        for follow in follows:
+            post_save.send(sender=Follow, instance=follow, created=True, update_fields=None, raw=False, using=using)
+    return follows
+
+def unfollow_profiles(follower, profile_ids):
+    '''Makes follower stop following the given profiles, and returns the ids of the ones it was following.'''
+    with transaction.atomic():
+        follows = Follow.objects.select_for_update().filter(follower_profile=follower, profile_id__in=set(profile_ids))
+        unfollowed = list(follows.values_list('profile_id', flat=True))
+        follows.delete() #post_delete updates the counters and feeds
+    return unfollowed
+
+def apply_operations(profile, operations):
+    '''Applies a batch of {"op": ..., "id": ...} operations as profile, and returns the ids each op changed.
+
+    When a batch has more than one operation on the same post or profile (a like then an
+    unlike, say), the last one wins, so each kind of change is a single query. Ids that changed
+    nothing (a missing or own post, a like that was already there) are left out of the result.
+    Raises ValueError if an operation is malformed.
+    '''
+    if not isinstance(operations, list):
+        raise ValueError('operations must be a list')
+    if len(operations) > MAX_OPERATIONS:
+        raise ValueError(f'at most {MAX_OPERATIONS} operations per request')
+
+    liked = {} #post id -> whether it should end up liked
+    followed = {} #profile id -> whether it should end up followed
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            raise ValueError(f"each operation needs an op, one of {', '.join(OPERATIONS)}")
+        pk = operation.get('id')
+        if not isinstance(pk, int) or isinstance(pk, bool):
+            raise ValueError('each operation needs an integer id')
+        if operation['op'] in ('like', 'unlike'):
+            liked[pk] = operation['op'] == 'like'
+        else:
+            followed[pk] = operation['op'] == 'follow'
+
+    requested = {
+        'like': [pk for pk, value in liked.items() if value],
+        'unlike': [pk for pk, value in liked.items() if not value],
+        'follow': [pk for pk, value in followed.items() if value],
+        'unfollow': [pk for pk, value in followed.items() if not value],
+    }
+    applied = dict.fromkeys(OPERATIONS, [])
+    with transaction.atomic():
+        if requested['like']:
+            applied['like'] = like_posts(profile, requested['like'])
+        if requested['unlike']:
+            applied['unlike'] = unlike_posts(profile, requested['unlike'])
+        if requested['follow']:
+            applied['follow'] = [follow.profile_id for follow in follow_profiles(profile, requested['follow'])]
+        if requested['unfollow']:
+            applied['unfollow'] = unfollow_profiles(profile, requested['unfollow'])
+    return {op: sorted(ids, key=requested[op].index) for op, ids in applied.items()} #in the order they were asked for
@@ -0,0 +1,15 @@
+## mini_insta/management/commands/collect_media.py
+## Author: William Fugate wfugate@bu.edu
+## description: management command to delete photo files that no photo uses any more
+## Run with: python manage.py collect_media
+
+from django.core.management.base import BaseCommand
+from mini_insta.blobs import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Deletes stored photo files that have no references (older than the grace period)'
+
+    def handle(self, *args, **options):
+        deleted = collect_garbage()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unused files'))
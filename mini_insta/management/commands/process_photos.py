@@ -0,0 +1,29 @@
+## mini_insta/management/commands/process_photos.py
+## Author: William Fugate wfugate@bu.edu
+## description: management command to make the resized renditions of uploaded photos
+## Run with: python manage.py process_photos [--all]
+
+from django.core.management.base import BaseCommand
+from mini_insta.images import make_renditions
+from mini_insta.models import Photo
+
+
+class Command(BaseCommand):
+    help = "Makes the resized renditions of uploaded photos that don't have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='remake the renditions of every uploaded photo, not just the unprocessed ones')
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.exclude(image_file='')
+        if not options['all']:
+            photos = photos.filter(renditions={})
+        done = 0
+        for photo in photos.iterator():
+            try:
+                make_renditions(photo)
+                done += 1
+            except Exception as error: #one bad file shouldn't stop the rest
+                self.stderr.write(f'Photo {photo.pk}: {error}')
+        self.stdout.write(self.style.SUCCESS(f'Made renditions for {done} photos'))
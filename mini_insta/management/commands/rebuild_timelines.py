@@ -0,0 +1,19 @@
+## mini_insta/management/commands/rebuild_timelines.py
+## Author: William Fugate wfugate@bu.edu
+## description: management command to rebuild the precomputed feeds from the Follow and Post tables
+## Run with: python manage.py rebuild_timelines [--profile 1 --profile 2]
+
+from django.core.management.base import BaseCommand
+from mini_insta.timeline import rebuild_timelines
+
+
+class Command(BaseCommand):
+    help = "Rebuilds every profile's feed from the profiles it follows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', type=int, action='append', dest='pks',
+                            help="only rebuild the feed of the profile with this pk (can be given more than once)")
+
+    def handle(self, *args, **options):
+        entries = rebuild_timelines(options['pks'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {entries} timeline entries'))
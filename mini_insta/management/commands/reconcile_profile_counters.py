@@ -0,0 +1,19 @@
+## mini_insta/management/commands/reconcile_profile_counters.py
+## Author: William Fugate wfugate@bu.edu
+## description: management command to repair the follower/following/post counts on Profile
+## Run with: python manage.py reconcile_profile_counters [--profile 1 --profile 2]
+
+from django.core.management.base import BaseCommand
+from mini_insta.counters import reconcile_profile_counters
+
+
+class Command(BaseCommand):
+    help = 'Recounts the follower, following and post counts of every profile and fixes any that are wrong'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', type=int, action='append', dest='pks',
+                            help='only reconcile the profile with this pk (can be given more than once)')
+
+    def handle(self, *args, **options):
+        fixed = reconcile_profile_counters(options['pks'])
+        self.stdout.write(self.style.SUCCESS(f'Fixed the counts of {fixed} profiles'))
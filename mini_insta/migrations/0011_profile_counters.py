@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:32
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_existing(apps, schema_editor):
+    '''Fills in the new counters from the existing Follow and Post rows.'''
+    Profile = apps.get_model('mini_insta', 'Profile')
+    Follow = apps.get_model('mini_insta', 'Follow')
+    Post = apps.get_model('mini_insta', 'Post')
+
+    def count(model, field):
+        counts = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(total=Count('pk')).values('total')
+        return Coalesce(Subquery(counts), Value(0))
+
+    Profile.objects.update(
+        follower_count=count(Follow, 'profile'),
+        following_count=count(Follow, 'follower_profile'),
+        post_count=count(Post, 'profile'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_insta', '0010_alter_profile_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_existing, migrations.RunPython.noop),
+    ]
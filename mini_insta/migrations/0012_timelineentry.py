@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_timelines(apps, schema_editor):
+    '''Delivers each followed profile's latest posts to its existing followers.'''
+    Follow = apps.get_model('mini_insta', 'Follow')
+    Post = apps.get_model('mini_insta', 'Post')
+    TimelineEntry = apps.get_model('mini_insta', 'TimelineEntry')
+    for follow in Follow.objects.all().iterator():
+        posts = Post.objects.filter(profile_id=follow.profile_id).order_by('-timestamp', '-pk')[:100]
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(owner_id=follow.follower_profile_id, post_id=post.pk, author_id=post.profile_id, timestamp=post.timestamp)
+            for post in posts
+        ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_insta', '0011_profile_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mini_insta.profile')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='mini_insta.profile')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='mini_insta.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'timestamp', 'post'], name='timeline_owner_idx'), models.Index(fields=['owner', 'author'], name='timeline_owner_author_idx')],
+                'constraints': [models.UniqueConstraint(fields=('owner', 'post'), name='timeline_owner_post_unique')],
+            },
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
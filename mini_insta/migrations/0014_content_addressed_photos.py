@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:40
+
+import hashlib
+import os
+import mini_insta.storage
+from collections import Counter
+from django.core.files.storage import FileSystemStorage
+from django.db import migrations, models
+
+
+#where mini_insta/storage.py put content-addressed files at this migration, copied here so
+#later changes to storage.py don't change what this migration does
+BLOB_DIRECTORY = 'blobs'
+
+
+def save_blob(storage, name, original):
+    '''Saves a file under the SHA-256 of its content, unless that content is already stored, and returns the name.'''
+    digest = hashlib.sha256()
+    for chunk in original.chunks():
+        digest.update(chunk)
+    digest = digest.hexdigest()
+    blob_name = f'{BLOB_DIRECTORY}/{digest[:2]}/{digest}{os.path.splitext(name)[1].lower()}'
+    if not storage.exists(blob_name):
+        storage.save(blob_name, original)
+    return blob_name
+
+
+def move_to_blobs(apps, schema_editor):
+    '''Copies the existing uploads into the content-addressed storage and counts their references.
+
+    Identical files collapse into one blob. The old files are left where they are. Renditions are
+    cleared, since they were stored under per-photo names; python manage.py process_photos remakes them.
+    '''
+    Photo = apps.get_model('mini_insta', 'Photo')
+    MediaBlob = apps.get_model('mini_insta', 'MediaBlob')
+    storage = FileSystemStorage()
+    references = Counter()
+    for photo in Photo.objects.exclude(image_file=''):
+        name = photo.image_file.name
+        if not name.startswith(f'{BLOB_DIRECTORY}/'):
+            if not storage.exists(name):
+                continue #missing file, leave the photo as it is
+            with storage.open(name) as original:
+                name = save_blob(storage, name, original)
+        Photo.objects.filter(pk=photo.pk).update(image_file=name, renditions={})
+        references[name] += 1
+    MediaBlob.objects.bulk_create([MediaBlob(name=name, ref_count=count) for name, count in references.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_insta', '0013_photo_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='image_file',
+            field=models.ImageField(blank=True, storage=mini_insta.storage.get_blob_storage, upload_to=''),
+        ),
+        migrations.RunPython(move_to_blobs, migrations.RunPython.noop),
+    ]
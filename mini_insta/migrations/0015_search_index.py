@@ -0,0 +1,48 @@
+# Creates the SQLite FTS5 tables behind the post and profile search
+
+from django.db import migrations
+
+#a copy of the tables mini_insta/fts.py uses as they were at this migration,
+#so later changes to fts.py don't change what this migration does
+CREATE_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS mini_insta_post_fts USING fts5("
+    "caption, created UNINDEXED, prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS mini_insta_profile_fts USING fts5("
+    "username, display_name, bio_text, prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+]
+
+INDEX_SQL = [
+    "INSERT INTO mini_insta_post_fts (rowid, caption, created) "
+    "SELECT id, caption, CAST(strftime('%%s', timestamp) AS REAL) FROM mini_insta_post",
+    "INSERT INTO mini_insta_profile_fts (rowid, username, display_name, bio_text) "
+    "SELECT id, username, display_name, bio_text FROM mini_insta_profile",
+]
+
+DROP_SQL = ["DROP TABLE IF EXISTS mini_insta_post_fts", "DROP TABLE IF EXISTS mini_insta_profile_fts"]
+
+
+def create_search_index(apps, schema_editor):
+    '''Creates the FTS5 tables and indexes the posts and profiles that already exist (SQLite only).'''
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_SQL + INDEX_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    '''Drops the FTS5 tables.'''
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_insta', '0014_content_addressed_photos'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
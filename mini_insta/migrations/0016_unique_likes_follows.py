@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:45
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicates(apps, schema_editor):
+    '''Deletes repeated likes and follows (keeping the first of each) so the unique constraints can be added.'''
+    Profile = apps.get_model('mini_insta', 'Profile')
+    Follow = apps.get_model('mini_insta', 'Follow')
+    Like = apps.get_model('mini_insta', 'Like')
+
+    for model, fields in ((Follow, ('follower_profile', 'profile')), (Like, ('profile', 'post'))):
+        repeated = model.objects.values(*fields).annotate(total=Count('pk'), first=Min('pk')).filter(total__gt=1).order_by()
+        for row in repeated:
+            model.objects.filter(**{field: row[field] for field in fields}).exclude(pk=row['first']).delete()
+
+    def count(field):
+        counts = Follow.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(total=Count('pk')).values('total')
+        return Coalesce(Subquery(counts), Value(0))
+
+    #the counters included the repeated follows
+    Profile.objects.update(follower_count=count('profile'), following_count=count('follower_profile'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_insta', '0015_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('follower_profile', 'profile'), name='follow_follower_profile_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(fields=('profile', 'post'), name='like_profile_post_unique'),
+        ),
+    ]
@@ -2,8 +2,11 @@
 ## Author: William Fugate
 ## description: data models for mini_insta app
 from django.db import models
+from django.db.models import Count, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.contrib.auth.models import User
+from .storage import get_blob_storage
 # Create your models here.
 
 class Profile(models.Model):
@@ -17,13 +20,17 @@ class Profile(models.Model):
     profile_image_url = models.URLField(blank=True)
     bio_text = models.TextField(blank=True)
     join_date = models.DateField(auto_now_add=True)
+    #denormalized counts, kept up to date by the receivers in counters.py (python manage.py reconcile_profile_counters repairs them)
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    post_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.username
     
     def get_all_posts(self):
-        '''Returns all posts made by this profile.'''
-        return Post.objects.filter(profile=self)
+        '''Returns all posts made by this profile, newest first.'''
+        return with_post_details(Post.objects.filter(profile=self).order_by('-timestamp', '-pk'))
     
     def get_absolute_url(self):
         '''Returns the URL to access this profile.'''
@@ -31,25 +38,28 @@ class Profile(models.Model):
     
     def get_followers(self):
         '''Returns all profiles that follow this profile.'''
-        return list(Follow.objects.filter(profile=self))
+        return list(Follow.objects.filter(profile=self).select_related('follower_profile'))
     
     def get_num_followers(self):
         '''Returns the number of followers this profile has.'''
-        return len(self.get_followers())
+        return self.follower_count
     
     def get_following(self):
         '''Returns all profiles that this profile is following.'''
-        return list(Follow.objects.filter(follower_profile=self))
+        return list(Follow.objects.filter(follower_profile=self).select_related('profile'))
     
     def get_num_following(self):
         '''Returns the number of profiles this profile is following.'''
-        return len(self.get_following())
+        return self.following_count
 
-    def get_post_feed(self):
-        '''Returns a feed of posts from profiles this profile is following.'''
-        following = self.get_following()
-        feed_posts = Post.objects.filter(profile__in=[f.profile for f in following]).order_by('-timestamp') #filter posts by profiles being followed
-        return feed_posts
+    def get_num_posts(self):
+        '''Returns the number of posts this profile has made.'''
+        return self.post_count
+
+    def get_post_feed(self, before=None):
+        '''Returns a feed of posts from profiles this profile is following, after the (timestamp, pk) key before.'''
+        from .timeline import get_feed #timeline.py imports these models
+        return get_feed(self, before)
     
 
 class Post(models.Model):
@@ -63,7 +73,15 @@ class Post(models.Model):
     
     def get_all_photos(self):
         '''Returns all photos associated with this post.'''
+        if 'photo_set' in getattr(self, '_prefetched_objects_cache', {}):
+            return self.photo_set.all() #already loaded by prefetch_related
         return Photo.objects.filter(post=self).order_by('timestamp')
+
+    def get_first_photo(self):
+        '''Returns the first photo of this post, or None if it has no photos.'''
+        if hasattr(self, 'first_photos'): #loaded by with_post_details
+            return self.first_photos[0] if self.first_photos else None
+        return self.get_all_photos().first()
     
     def get_absolute_url(self):
         '''Returns the URL to access this post.'''
@@ -71,28 +89,70 @@ class Post(models.Model):
     
     def get_all_comments(self):
         '''Returns all comments made on this post.'''
-        return Comment.objects.filter(post=self).order_by('timestamp')
+        return Comment.objects.filter(post=self).select_related('profile').order_by('timestamp')
     
     def get_likes(self):
         '''Returns all likes made on this post.'''
         return Like.objects.filter(post=self)
 
+    def get_num_likes(self):
+        '''Returns the number of likes on this post.'''
+        if hasattr(self, 'like_count'): #annotated by with_post_details
+            return self.like_count
+        return self.get_likes().count()
+
+    def get_num_comments(self):
+        '''Returns the number of comments on this post.'''
+        if hasattr(self, 'comment_count'): #annotated by with_post_details
+            return self.comment_count
+        return Comment.objects.filter(post=self).count()
+
 class Photo(models.Model):
     '''Model representing a photo associated with a post in the mini insta application.'''
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     image_url = models.URLField(blank=True)
-    image_file = models.ImageField(blank=True)
+    image_file = models.ImageField(blank=True, storage=get_blob_storage) #stored by content hash, so duplicate uploads share a file
     timestamp = models.DateTimeField(auto_now_add=True)
+    #filled in by the image pipeline in images.py once the upload has been processed
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    renditions = models.JSONField(default=dict, blank=True) #format -> {width: file name}
+
+    #width the pages ask for by default, about 1.5x the largest size they display photos at
+    DISPLAY_WIDTH = 640
 
     def __str__(self):
         return f"Photo for post {self.post.id}"
     
-    def get_image_url(self):
-        '''Returns an image's URL'''
+    def get_image_url(self, width=DISPLAY_WIDTH, format='webp'):
+        '''Returns an image's URL, preferring the smallest rendition at least width pixels wide'''
         if (self.image_file):
-            return self.image_file.url
+            rendition = self.get_rendition(width, format)
+            if rendition:
+                return self.image_file.storage.url(rendition)
+            return self.image_file.url #not processed yet
         else:
             return self.image_url
+
+    def get_rendition(self, width, format='webp'):
+        '''Returns the file name of the smallest rendition at least width pixels wide (or the widest one), or None.'''
+        names = self.renditions.get(format) or {}
+        if not names:
+            return None
+        widths = sorted(int(w) for w in names)
+        chosen = next((w for w in widths if w >= width), widths[-1])
+        return names[str(chosen)]
+
+    def get_file_names(self):
+        '''Returns the stored file names this photo uses: the upload and all of its renditions.'''
+        if not self.image_file:
+            return []
+        return [self.image_file.name] + [name for names in self.renditions.values() for name in names.values()]
+
+    def get_srcset(self, format='webp'):
+        '''Returns an img srcset listing every rendition, so the browser can pick the size it needs.'''
+        names = self.renditions.get(format) or {}
+        return ', '.join(f'{self.image_file.storage.url(name)} {w}w' for w, name in sorted(names.items(), key=lambda item: int(item[0])))
         
 class Follow(models.Model):
     '''Model representing a follow relationship between two profiles in the mini insta application.'''
@@ -100,6 +160,11 @@ class Follow(models.Model):
     follower_profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='follower_profile')
     timestamp = models.DateField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['follower_profile', 'profile'], name='follow_follower_profile_unique'),
+        ]
+
     def __str__(self):
         return f"{self.follower_profile.display_name} follows {self.profile.display_name}"
     
@@ -120,26 +185,61 @@ class Like(models.Model):
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'post'], name='like_profile_post_unique'),
+        ]
+
     def __str__(self):
         return f"Like by {self.profile.display_name} on {self.post}"
     
-
-    
-class Follow(models.Model):
-    '''Model representing a follow relationship between two profiles in the mini insta application.'''
-    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='propfile')
-    follower_profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='follower_profile')
-    timestamp = models.DateField(auto_now_add=True)
+class MediaBlob(models.Model):
+    '''Model representing a content-addressed file in the photo storage, and how many photos use it.'''
+    name = models.CharField(max_length=255, unique=True) #the file's name in ContentAddressedStorage
+    ref_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
-        return f"{self.follower_profile.display_name} follows {self.profile.display_name}"
-    
-class Like(models.Model):
-    '''Model representing a like made on a post in the mini insta application.'''
-    post = models.ForeignKey(Post, on_delete=models.CASCADE)
-    profile = models.ForeignKey(Profile, on_delete=models.CASCADE)
-    timestamp = models.DateTimeField(auto_now_add=True)
+        return f"{self.name} ({self.ref_count} references)"
+
+class TimelineEntry(models.Model):
+    '''Model representing a post delivered to a profile's feed (see timeline.py for how entries are written).'''
+    owner = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='timeline_entries') #whose feed the post is in
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='+') #copy of post.profile, so unfollowing can prune without a join
+    timestamp = models.DateTimeField() #copy of post.timestamp, so the feed is one range scan of timeline_owner_idx
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'post'], name='timeline_owner_post_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'timestamp', 'post'], name='timeline_owner_idx'),
+            models.Index(fields=['owner', 'author'], name='timeline_owner_author_idx'),
+        ]
 
     def __str__(self):
-        return f"Like by {self.profile.display_name} on {self.post}"
-    
+        return f"Post {self.post_id} in {self.owner_id}'s feed"
+
+
+
+def count_related(model, field):
+    '''Returns a subquery counting the model rows whose field points at the outer row (0 if none).
+
+    Unlike Count() over a join, several of these can be annotated on one queryset without multiplying rows.
+    '''
+    counts = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts), Value(0))
+
+def with_post_details(posts):
+    '''Loads what the post listings show along with a Post queryset, so they don't query once per post.
+
+    Each post gets its profile (select_related), its first photo in first_photos (one prefetch
+    query for the whole page) and like_count/comment_count annotations.
+    '''
+    first_photo = Photo.objects.order_by('timestamp', 'pk')[:1] #sliced prefetch, one photo per post
+    return posts.select_related('profile').prefetch_related(
+        Prefetch('photo_set', queryset=first_photo, to_attr='first_photos'),
+    ).annotate(
+        like_count=count_related(Like, 'post'),
+        comment_count=count_related(Comment, 'post'),
+    )
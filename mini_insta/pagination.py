@@ -0,0 +1,67 @@
+## mini_insta/pagination.py
+## Author: William Fugate wfugate@bu.edu
+## description: cursor pagination for the post lists (feed, profile posts, search results)
+import base64
+import binascii
+import json
+from datetime import datetime
+from django.db.models import Q
+
+#posts shown per page
+PAGE_SIZE = 20
+
+def encode_key(values):
+    '''Encodes a list of JSON values (a sort key) as an opaque, URL-safe cursor.'''
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_key(cursor):
+    '''Decodes a cursor back into its list of values, or returns None if it is missing or invalid.'''
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, binascii.Error):
+        return None
+
+def encode_cursor(post):
+    '''Encodes the sort key of a post as an opaque, URL-safe cursor.'''
+    return encode_key([post.timestamp.isoformat(), post.pk])
+
+def decode_cursor(cursor):
+    '''Decodes a cursor back into (timestamp, pk), or returns None if it is missing or invalid.'''
+    try:
+        timestamp, pk = decode_key(cursor)
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, TypeError):
+        return None
+
+def older_than(key, timestamp_field='timestamp', pk_field='pk'):
+    '''Returns a filter for the posts that come after key in newest-first order (everything if key is None).'''
+    if key is None:
+        return Q()
+    timestamp, pk = key
+    return Q(**{f'{timestamp_field}__lte': timestamp}) & ( #redundant, but lets SQLite seek into the index
+        Q(**{f'{timestamp_field}__lt': timestamp}) |
+        Q(**{timestamp_field: timestamp, f'{pk_field}__lt': pk})
+    )
+
+class PostPage:
+    '''One page of a cursor paginated post list.'''
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def has_next(self):
+        '''Returns whether there is a page after this one.'''
+        return self.next_cursor is not None
+
+def get_post_page(posts, page_size=PAGE_SIZE):
+    '''Returns the first page_size posts of a newest-first queryset that already has the cursor applied.'''
+    posts = list(posts[:page_size + 1]) #fetch one extra to know if there is a next page
+    next_cursor = None
+    if len(posts) > page_size:
+        posts = posts[:page_size]
+        next_cursor = encode_cursor(posts[-1])
+    return PostPage(posts, next_cursor)
@@ -0,0 +1,108 @@
+## mini_insta/relationships.py
+## Author: William Fugate wfugate@bu.edu
+## description: loads which of a page's posts the logged-in profile has liked and which profiles it follows
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Follow, Like, Profile
+
+#how long a viewer's flags for a page are kept in the cache, so revisiting a page skips the queries
+#(0 turns the cache off; any like or follow by the viewer makes their cached flags stale)
+RELATIONSHIP_CACHE_SECONDS = getattr(settings, 'MINI_INSTA_RELATIONSHIP_CACHE_SECONDS', 0)
+
+def get_version_key(profile_pk):
+    '''Returns the cache key holding the version of a viewer's cached flags.'''
+    return f'mini_insta:relationships_version:{profile_pk}'
+
+def invalidate(profile_pk):
+    '''Marks a viewer's cached flags as stale after they like, unlike, follow or unfollow.'''
+    if RELATIONSHIP_CACHE_SECONDS:
+        cache.set(get_version_key(profile_pk), str(time.time_ns()), timeout=None)
+
+class ViewerRelationships:
+    '''The posts a viewer has liked and the profiles they follow, out of those loaded so far.
+
+    load() fetches the flags for a page of posts and profiles with one query per kind, and the
+    sets then answer "has the viewer liked this?" in O(1), in views or as
+    {% if post.pk in liked_post_ids %} in templates. Anonymous viewers like and follow nothing.
+    '''
+
+    def __init__(self, profile):
+        self.profile = profile #None when not logged in
+        self.liked_post_ids = set()
+        self.followed_profile_ids = set()
+        self.loaded_post_ids = set()
+        self.loaded_profile_ids = set()
+        self.version = None
+
+    def load(self, posts=(), profiles=()):
+        '''Fetches the flags for any of the given posts and profiles that haven't been loaded yet.'''
+        if self.profile is None:
+            return self
+        post_ids = {post.pk for post in posts} - self.loaded_post_ids
+        if post_ids:
+            likes = Like.objects.filter(profile=self.profile, post_id__in=post_ids).values_list('post_id', flat=True)
+            self.liked_post_ids |= self.get_ids('liked', post_ids, likes)
+            self.loaded_post_ids |= post_ids
+        profile_ids = {profile.pk for profile in profiles} - self.loaded_profile_ids
+        if profile_ids:
+            follows = Follow.objects.filter(follower_profile=self.profile, profile_id__in=profile_ids).values_list('profile_id', flat=True)
+            self.followed_profile_ids |= self.get_ids('followed', profile_ids, follows)
+            self.loaded_profile_ids |= profile_ids
+        return self
+
+    def get_ids(self, kind, ids, queryset):
+        '''Returns the ids the queryset selects out of ids, from the cache if it is turned on.'''
+        if not RELATIONSHIP_CACHE_SECONDS:
+            return set(queryset)
+        if self.version is None:
+            self.version = cache.get(get_version_key(self.profile.pk))
+            if self.version is None:
+                self.version = str(time.time_ns())
+                cache.set(get_version_key(self.profile.pk), self.version, timeout=None)
+        digest = hashlib.sha1(','.join(map(str, sorted(ids))).encode()).hexdigest()
+        key = f'mini_insta:relationships:{self.profile.pk}:{self.version}:{kind}:{digest}'
+        found = cache.get(key)
+        if found is None:
+            found = list(queryset)
+            cache.set(key, found, RELATIONSHIP_CACHE_SECONDS)
+        return set(found)
+
+    def has_liked(self, post):
+        '''Returns whether the viewer has liked a loaded post.'''
+        return post.pk in self.liked_post_ids
+
+    def is_following(self, profile):
+        '''Returns whether the viewer follows a loaded profile.'''
+        return profile.pk in self.followed_profile_ids
+
+    def get_context(self):
+        '''Returns the sets for a template context.'''
+        return {'liked_post_ids': self.liked_post_ids, 'followed_profile_ids': self.followed_profile_ids}
+
+def get_relationships(request):
+    '''Returns the request's ViewerRelationships, so every view and template in a request shares one.'''
+    if not hasattr(request, '_mini_insta_relationships'):
+        profile = None
+        if request.user.is_authenticated:
+            try:
+                profile = request.user.profile
+            except Profile.DoesNotExist: #e.g. an admin user without a profile
+                pass
+        request._mini_insta_relationships = ViewerRelationships(profile)
+    return request._mini_insta_relationships
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def invalidate_like(instance, **kwargs):
+    '''Makes the liking profile's cached flags stale.'''
+    invalidate(instance.profile_id)
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow(instance, **kwargs):
+    '''Makes the following profile's cached flags stale.'''
+    invalidate(instance.follower_profile_id)
@@ -0,0 +1,73 @@
+## mini_insta/storage.py
+## Author: William Fugate wfugate@bu.edu
+## description: content-addressed file storage for uploaded photos
+import hashlib
+import os
+import tempfile
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.urls import reverse
+from django.utils.deconstruct import deconstructible
+
+#directory under MEDIA_ROOT that holds the content-addressed files
+BLOB_DIRECTORY = 'blobs'
+
+@deconstructible(path='mini_insta.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    '''Filesystem storage that names every file after the SHA-256 of its content.
+
+    Saving the same bytes twice returns the existing file's name instead of writing a copy,
+    so duplicate uploads share one file. Since a name always refers to the same content, the
+    URLs never change meaning and are served with far-future cache headers (see BlobView).
+    Who still uses a file is tracked by MediaBlob reference counts (see blobs.py).
+    '''
+
+    def save(self, name, content, max_length=None):
+        '''Saves the content under its hash, unless a file with the same content is already stored.'''
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks(): #chunks() starts from the beginning of the file
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        name = f'{BLOB_DIRECTORY}/{digest[:2]}/{digest}{extension}'
+
+        if self.exists(name):
+            os.utime(self.path(name)) #marks the file as just used, so garbage collection gives it a grace period
+            return name
+        return super().save(name, content, max_length)
+
+    def get_available_name(self, name, max_length=None):
+        '''Returns the name unchanged: a file that already has this name already has this content.'''
+        return name
+
+    def _save(self, name, content):
+        '''Writes the file to a temporary name and renames it into place, so readers never see a partial file.'''
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temporary_file:
+                for chunk in content.chunks():
+                    temporary_file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary_path, self.file_permissions_mode)
+            os.replace(temporary_path, full_path) #a concurrent upload of the same bytes just replaces it with identical content
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        return name
+
+    def url(self, name):
+        '''Returns the URL of BlobView for the file, which sends far-future cache headers.'''
+        return reverse('media_blob', kwargs={'name': name})
+
+blob_storage = ContentAddressedStorage()
+
+def get_blob_storage():
+    '''Returns the storage for Photo.image_file (a callable, so migrations don't serialize the instance).'''
+    return blob_storage
@@ -1,3 +1,363 @@
-from django.test import TestCase
+## mini_insta/tests.py
+## Author: William Fugate wfugate@bu.edu
+## description: query budget tests for the mini_insta pages
+import io
+import shutil
+import tempfile
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from unittest import mock
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from . import fts, timeline
+from .images import make_renditions
+from .interactions import follow_profiles
+from .models import Comment, Follow, Like, MediaBlob, Photo, Post, Profile, TimelineEntry
+from .storage import blob_storage
+from .views import PostFeedPageView, SearchView
 
-# Create your tests here.
+#most queries any of these pages may make, however many posts, photos, likes and comments there are
+QUERY_BUDGET = 10
+
+class QueryBudgetTests(TestCase):
+    '''Checks that the listing pages make a fixed number of queries instead of one or more per post.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        '''Creates a viewer following several profiles that each have posts with photos, likes and comments.'''
+        cls.user = User.objects.create_user(username='viewer', password='password')
+        cls.viewer = Profile.objects.create(user=cls.user, username='viewer', display_name='Viewer')
+        cls.profiles = []
+        for i in range(5):
+            user = User.objects.create_user(username=f'user{i}', password='password')
+            profile = Profile.objects.create(user=user, username=f'user{i}', display_name=f'User {i}', bio_text='findme')
+            Follow.objects.create(profile=profile, follower_profile=cls.viewer)
+            Follow.objects.create(profile=cls.viewer, follower_profile=profile)
+            cls.profiles.append(profile)
+        for profile in cls.profiles:
+            for j in range(4):
+                post = Post.objects.create(profile=profile, caption=f'findme post {j}')
+                for k in range(3):
+                    Photo.objects.create(post=post, image_url=f'https://example.com/{post.pk}/{k}.jpg')
+                for other in cls.profiles:
+                    Like.objects.create(post=post, profile=other)
+                    Comment.objects.create(post=post, profile=other, text='nice')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get_within_budget(self, url):
+        '''Fetches a page and fails if it made more than QUERY_BUDGET queries.'''
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), QUERY_BUDGET, f'{url} made {len(queries)} queries')
+        return response
+
+    def test_feed(self):
+        response = self.get_within_budget(reverse('show_feed'))
+        self.assertEqual(len(response.context['posts']), 20)
+
+    def test_profile(self):
+        response = self.get_within_budget(reverse('show_profile', kwargs={'pk': self.profiles[0].pk}))
+        self.assertContains(response, 'findme post', count=4)
+
+    def test_search(self):
+        response = self.get_within_budget(reverse('search') + '?query=findme')
+        self.assertEqual(len(response.context['posts']), 20)
+        self.assertEqual(len(response.context['profiles']), 5)
+
+    def test_followers(self):
+        response = self.get_within_budget(reverse('show_followers', kwargs={'pk': self.viewer.pk}))
+        self.assertContains(response, 'User 4')
+
+    def test_following(self):
+        response = self.get_within_budget(reverse('show_following', kwargs={'pk': self.viewer.pk}))
+        self.assertContains(response, 'User 4')
+
+    def test_post(self):
+        post = Post.objects.filter(profile=self.profiles[0]).first()
+        response = self.get_within_budget(reverse('show_post', kwargs={'pk': post.pk}))
+        self.assertContains(response, '<strong>Likes:</strong> 5')
+
+    def test_helpers_use_loaded_details(self):
+        post = Post.objects.filter(profile=self.profiles[0]).order_by('pk').first()
+        loaded = Profile.objects.get(pk=self.profiles[0].pk).get_all_posts().get(pk=post.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(loaded.get_first_photo().image_url, f'https://example.com/{post.pk}/0.jpg')
+            self.assertEqual(loaded.get_num_likes(), 5)
+            self.assertEqual(loaded.get_num_comments(), 5)
+            self.assertEqual(loaded.profile.username, 'user0')
+
+    @mock.patch.object(PostFeedPageView, 'page_size', 6)
+    def test_feed_pages(self):
+        page = self.get_within_budget(reverse('feed_page')).json()
+        seen = []
+        while True:
+            seen.append(page['html'].count('class="post"'))
+            if not page['next_cursor']:
+                break
+            page = self.get_within_budget(reverse('feed_page') + f'?cursor={page["next_cursor"]}').json()
+        self.assertEqual(seen, [6, 6, 6, 2])
+
+    @mock.patch.object(SearchView, 'page_size', 8)
+    def test_search_pages(self):
+        url = reverse('search') + '?query=findme'
+        response = self.get_within_budget(url)
+        seen = [post.pk for post in response.context['posts']]
+        while response.context['post_page'].has_next():
+            response = self.get_within_budget(f"{url}&cursor={response.context['post_page'].next_cursor}")
+            seen += [post.pk for post in response.context['posts']]
+        self.assertCountEqual(seen, Post.objects.values_list('pk', flat=True))
+
+    @mock.patch.object(fts, 'POST_CANDIDATES', 3)
+    def test_search_windows(self):
+        page = fts.search_posts('findme', page_size=4)
+        seen = [post.pk for post in page.object_list]
+        Post.objects.create(profile=self.profiles[0], caption='findme later') #newer than the first window, so not shown
+        while page.has_next():
+            page = fts.search_posts('findme', page.next_cursor, page_size=4)
+            seen += [post.pk for post in page.object_list]
+        self.assertEqual(len(seen), 20)
+        self.assertEqual(set(seen), set(Post.objects.exclude(caption='findme later').values_list('pk', flat=True)))
+        self.assertCountEqual(seen[:3], sorted(seen)[-3:]) #the newest window comes first
+        self.assertEqual(fts.search_posts('findme', 'garbage', page_size=4).object_list, fts.search_posts('findme', page_size=4).object_list)
+
+class InteractionTests(TestCase):
+    '''Checks the like and follow write paths, including the batched JSON endpoint.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        '''Creates a viewer and two other profiles with a post each.'''
+        cls.user = User.objects.create_user(username='viewer', password='password')
+        cls.viewer = Profile.objects.create(user=cls.user, username='viewer', display_name='Viewer')
+        cls.others = [
+            Profile.objects.create(user=User.objects.create_user(username=f'user{i}'), username=f'user{i}', display_name=f'User {i}')
+            for i in range(2)
+        ]
+        cls.posts = [Post.objects.create(profile=profile, caption='hello') for profile in cls.others]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post_operations(self, operations):
+        '''Posts a batch of operations to the interactions endpoint.'''
+        return self.client.post(reverse('interactions'), {'operations': operations}, content_type='application/json')
+
+    def test_repeated_clicks(self):
+        for _ in range(2):
+            self.client.get(reverse('like_post', kwargs={'pk': self.posts[0].pk}))
+            self.client.get(reverse('follow_profile', kwargs={'pk': self.others[0].pk}))
+        self.assertEqual(Like.objects.filter(profile=self.viewer).count(), 1)
+        self.assertEqual(Follow.objects.filter(follower_profile=self.viewer).count(), 1)
+        self.viewer.refresh_from_db()
+        self.assertEqual(self.viewer.following_count, 1)
+        self.assertIn(self.posts[0], self.viewer.get_post_feed())
+
+    def test_batch(self):
+        response = self.post_operations([
+            {'op': 'like', 'id': self.posts[0].pk},
+            {'op': 'like', 'id': self.posts[1].pk},
+            {'op': 'unlike', 'id': self.posts[1].pk}, #the last op on a post wins
+            {'op': 'follow', 'id': self.others[0].pk},
+            {'op': 'follow', 'id': self.others[1].pk},
+            {'op': 'follow', 'id': self.viewer.pk}, #can't follow yourself
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'like': [self.posts[0].pk], 'unlike': [], #posts[1] was never liked
+                                           'follow': [p.pk for p in self.others], 'unfollow': []})
+        self.assertEqual(list(Like.objects.filter(profile=self.viewer).values_list('post', flat=True)), [self.posts[0].pk])
+        self.assertCountEqual(Follow.objects.filter(follower_profile=self.viewer).values_list('profile', flat=True), [p.pk for p in self.others])
+        self.viewer.refresh_from_db()
+        self.assertEqual(self.viewer.following_count, 2)
+
+        self.post_operations([{'op': 'unfollow', 'id': self.others[1].pk}])
+        self.viewer.refresh_from_db()
+        self.assertEqual(self.viewer.following_count, 1)
+        self.assertEqual(list(self.viewer.get_post_feed()), [self.posts[0]])
+
+    def test_applied_ids(self):
+        own = Post.objects.create(profile=self.viewer, caption='mine')
+        self.post_operations([{'op': 'like', 'id': self.posts[0].pk}, {'op': 'follow', 'id': self.others[0].pk}])
+        response = self.post_operations([
+            {'op': 'like', 'id': self.posts[1].pk},
+            {'op': 'like', 'id': self.posts[0].pk}, #already liked
+            {'op': 'like', 'id': own.pk},
+            {'op': 'like', 'id': 10**6},
+            {'op': 'follow', 'id': self.others[0].pk}, #already followed
+            {'op': 'follow', 'id': self.viewer.pk},
+            {'op': 'unfollow', 'id': self.others[1].pk}, #not followed
+        ])
+        self.assertEqual(response.json(), {'like': [self.posts[1].pk], 'unlike': [], 'follow': [], 'unfollow': []})
+        response = self.post_operations([{'op': 'unlike', 'id': pk} for pk in (10**6, self.posts[1].pk, self.posts[0].pk)]
+                                        + [{'op': 'unfollow', 'id': self.others[0].pk}])
+        self.assertEqual(response.json(), {'like': [], 'unlike': [self.posts[1].pk, self.posts[0].pk], 'follow': [], 'unfollow': [self.others[0].pk]})
+
+    def test_follow_twice(self):
+        other = self.others[0]
+        for follow in (lambda: self.client.get(reverse('follow_profile', kwargs={'pk': other.pk})),
+                       lambda: self.post_operations([{'op': 'follow', 'id': other.pk}]),
+                       lambda: follow_profiles(self.viewer, [other.pk, other.pk])):
+            follow()
+            self.viewer.refresh_from_db()
+            other.refresh_from_db()
+            self.assertEqual((self.viewer.following_count, other.follower_count), (1, 1))
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.viewer).count(), 1)
+        self.assertEqual(follow_profiles(self.viewer, [other.pk, self.others[1].pk])[0].profile_id, self.others[1].pk)
+
+    def test_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        body = {'operations': [{'op': 'like', 'id': self.posts[0].pk}]}
+        self.assertEqual(client.post(reverse('interactions'), body, content_type='application/json').status_code, 403) #a session needs the CSRF token
+        client.cookies['csrftoken'] = 'x' * 32
+        response = client.post(reverse('interactions'), body, content_type='application/json', HTTP_X_CSRFTOKEN='x' * 32)
+        self.assertEqual(response.json()['like'], [self.posts[0].pk])
+
+        token = Token.objects.create(user=self.user)
+        client = Client(enforce_csrf_checks=True) #a mobile client: no session, no CSRF cookie
+        body = {'operations': [{'op': 'follow', 'id': self.others[0].pk}]}
+        response = client.post(reverse('interactions'), body, content_type='application/json', HTTP_X_AUTH_TOKEN=token.key)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['follow'], [self.others[0].pk], response.content)
+        self.assertEqual(client.post(reverse('interactions'), body, content_type='application/json', HTTP_X_AUTH_TOKEN='wrong').status_code, 403)
+        self.assertTrue(Follow.objects.filter(follower_profile=self.viewer, profile=self.others[0]).exists())
+
+    def test_bad_batch(self):
+        self.assertEqual(self.post_operations([{'op': 'poke', 'id': 1}]).status_code, 400)
+        self.assertEqual(self.post_operations([{'op': 'like', 'id': 'x'}]).status_code, 400)
+        self.assertEqual(self.client.post(reverse('interactions'), 'nope', content_type='application/json').status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.post_operations([]).status_code, 403)
+
+    def test_page_flags(self):
+        self.post_operations([{'op': 'like', 'id': self.posts[0].pk}, {'op': 'follow', 'id': self.others[0].pk}, {'op': 'follow', 'id': self.others[1].pk}])
+        response = self.client.get(reverse('show_feed'))
+        self.assertEqual(response.context['liked_post_ids'], {self.posts[0].pk})
+        self.assertContains(response, reverse('delete_like', kwargs={'pk': self.posts[0].pk}))
+        self.assertContains(response, reverse('like_post', kwargs={'pk': self.posts[1].pk}))
+        with self.assertNumQueries(7): #profile, posts, photos, session, user, viewer's profile, follows
+            response = self.client.get(reverse('show_profile', kwargs={'pk': self.others[0].pk}))
+        self.assertTrue(response.context['is_following'])
+
+class PhotoFileTests(TestCase):
+    '''Checks rendition URLs and the reference counts that decide when a stored file can be deleted.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        '''Creates a post to attach photos to.'''
+        user = User.objects.create_user(username='viewer', password='password')
+        profile = Profile.objects.create(user=user, username='viewer', display_name='Viewer')
+        cls.post = Post.objects.create(profile=profile, caption='hello')
+
+    def setUp(self):
+        '''Stores each test's files in a directory of its own.'''
+        media_root = tempfile.mkdtemp()
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.addCleanup(shutil.rmtree, media_root)
+
+    def get_stored_names(self):
+        '''Returns the names of all the stored files.'''
+        return {f'blobs/{directory}/{name}' for directory in blob_storage.listdir('blobs')[0] for name in blob_storage.listdir(f'blobs/{directory}')[1]}
+
+    def upload(self, color='red'):
+        '''Creates a photo of a 2000x1000 image of one color.'''
+        buffer = io.BytesIO()
+        Image.new('RGB', (2000, 1000), color).save(buffer, 'JPEG')
+        return Photo.objects.create(post=self.post, image_file=SimpleUploadedFile('upload.jpg', buffer.getvalue()))
+
+    def get_ref_counts(self, names):
+        '''Returns the reference count of each named file, None for files with no MediaBlob.'''
+        counts = dict(MediaBlob.objects.filter(name__in=names).values_list('name', 'ref_count'))
+        return [counts.get(name) for name in names]
+
+    @mock.patch('mini_insta.blobs.GRACE_SECONDS', 0)
+    def test_duplicates_share_files(self):
+        first, second = self.upload(), self.upload()
+        make_renditions(first)
+        make_renditions(second)
+        self.assertEqual(first.get_file_names(), second.get_file_names())
+        names = first.get_file_names()
+        self.assertEqual(len(names), 7) #the upload and 3 widths in 2 formats
+        self.assertEqual(self.get_ref_counts(names), [2] * 7)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.get_ref_counts(names), [1] * 7)
+        self.assertTrue(all(blob_storage.exists(name) for name in names))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(self.get_ref_counts(names), [None] * 7)
+        self.assertEqual(self.get_stored_names(), set())
+
+    @mock.patch('mini_insta.blobs.GRACE_SECONDS', 0)
+    def test_deleted_while_resizing(self):
+        photo = self.upload('blue')
+        Photo.objects.filter(pk=photo.pk).delete() #its file is only collected on commit, which never comes here
+        with self.captureOnCommitCallbacks(execute=True):
+            make_renditions(photo)
+        self.assertEqual(photo.renditions, {})
+        self.assertFalse(MediaBlob.objects.filter(ref_count__gt=0).exclude(name=photo.image_file.name).exists())
+        self.assertEqual(self.get_stored_names(), {photo.image_file.name}) #the renditions are gone, only the upload is left
+
+    def test_image_urls(self):
+        linked = Photo.objects.create(post=self.post, image_url='https://example.com/a.jpg')
+        self.assertEqual(linked.get_image_url(), 'https://example.com/a.jpg')
+        self.assertEqual(linked.get_srcset(), '')
+
+        photo = self.upload('green')
+        self.assertEqual(photo.get_image_url(), blob_storage.url(photo.image_file.name)) #not processed yet
+        self.assertEqual(photo.get_srcset(), '')
+        make_renditions(photo)
+        photo = Photo.objects.get(pk=photo.pk)
+        self.assertEqual(photo.get_image_url(400), blob_storage.url(photo.renditions['webp']['640']))
+        self.assertEqual(photo.get_image_url(5000), blob_storage.url(photo.renditions['webp']['1080'])) #the widest there is
+        self.assertEqual(photo.get_image_url(100, 'jpeg'), blob_storage.url(photo.renditions['jpeg']['320']))
+        self.assertEqual(photo.get_srcset(), ', '.join(f"{blob_storage.url(photo.renditions['webp'][w])} {w}w" for w in ('320', '640', '1080')))
+
+class TimelineTests(TestCase):
+    '''Checks posts are fanned out to feeds, pruned on unfollow, and read directly for popular profiles.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        '''Creates an author with a post and three followers.'''
+        cls.author = Profile.objects.create(user=User.objects.create_user(username='author'), username='author', display_name='Author')
+        cls.first_post = Post.objects.create(profile=cls.author, caption='first')
+        cls.followers = []
+        for i in range(3):
+            profile = Profile.objects.create(user=User.objects.create_user(username=f'fan{i}'), username=f'fan{i}', display_name=f'Fan {i}')
+            Follow.objects.create(profile=cls.author, follower_profile=profile)
+            cls.followers.append(profile)
+
+    def get_delivered(self, post):
+        '''Returns the pks of the profiles whose timeline has the post.'''
+        return set(TimelineEntry.objects.filter(post=post).values_list('owner_id', flat=True))
+
+    def test_fan_out(self):
+        self.assertEqual(self.get_delivered(self.first_post), {follower.pk for follower in self.followers}) #backfilled on follow
+        post = Post.objects.create(profile=self.author, caption='second')
+        self.assertEqual(self.get_delivered(post), {follower.pk for follower in self.followers})
+        self.assertEqual(list(self.followers[0].get_post_feed()), [post, self.first_post])
+
+    def test_prune(self):
+        Follow.objects.get(profile=self.author, follower_profile=self.followers[0]).delete()
+        self.assertEqual(list(self.followers[0].get_post_feed()), [])
+        self.assertEqual(list(self.followers[1].get_post_feed()), [self.first_post])
+
+    @mock.patch.object(timeline, 'FANOUT_LIMIT', 2)
+    def test_fanout_limit(self):
+        post = Post.objects.create(profile=self.author, caption='popular') #three followers, over the limit
+        self.assertEqual(self.get_delivered(post), set())
+        self.assertEqual(list(self.followers[0].get_post_feed()), [post, self.first_post]) #read from the Post table
+
+        with mock.patch.object(timeline, 'executor') as executor, self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.get(profile=self.author, follower_profile=self.followers[2]).delete()
+        executor.submit.assert_called_once_with(timeline.process_backfill, self.author.pk) #not delivered in the request
+        self.assertEqual(self.get_delivered(post), set())
+        timeline.backfill_followers(self.author.pk)
+        self.assertEqual(self.get_delivered(post), {self.followers[0].pk, self.followers[1].pk})
+        self.assertEqual(list(self.followers[0].get_post_feed()), [post, self.first_post])
@@ -0,0 +1,140 @@
+## mini_insta/timeline.py
+## Author: William Fugate wfugate@bu.edu
+## description: precomputed per-profile feeds (fan-out on write, with fan-out on read for very popular profiles)
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Follow, Post, Profile, TimelineEntry
+from .pagination import older_than
+
+#posts by profiles with more followers than this aren't copied into every follower's feed;
+#instead the feed reads them directly from the Post table
+FANOUT_LIMIT = getattr(settings, 'MINI_INSTA_FANOUT_LIMIT', 10000)
+
+#how many of a profile's latest posts are added to the feed when someone follows it
+BACKFILL_POSTS = 100
+
+BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+#a profile dropping back to FANOUT_LIMIT followers has its recent posts delivered to all of
+#them, up to FANOUT_LIMIT * BACKFILL_POSTS entries, by this pool instead of the unfollow request
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mini_insta_timelines')
+
+def is_fanned_out(profile):
+    '''Returns whether a profile's posts are written into its followers' feeds.'''
+    return profile.follower_count <= FANOUT_LIMIT
+
+def make_entries(owner_ids, posts):
+    '''Writes a timeline entry for every owner and post pair, skipping pairs that already have one.'''
+    entries = [
+        TimelineEntry(owner_id=owner_id, post_id=post.pk, author_id=post.profile_id, timestamp=post.timestamp)
+        for owner_id in owner_ids for post in posts
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+def fan_out_post(post):
+    '''Copies a new post into the feed of each of its author's followers.'''
+    followers = Follow.objects.filter(profile_id=post.profile_id).values_list('follower_profile_id', flat=True)
+    batch = []
+    with transaction.atomic():
+        for follower_id in followers.iterator(chunk_size=BATCH_SIZE):
+            batch.append(follower_id)
+            if len(batch) == BATCH_SIZE:
+                make_entries(batch, [post])
+                batch = []
+        make_entries(batch, [post])
+
+def backfill(owner_ids, author):
+    '''Copies an author's latest posts into the feeds of the given profiles.'''
+    posts = list(Post.objects.filter(profile=author).order_by('-timestamp', '-pk')[:BACKFILL_POSTS])
+    with transaction.atomic():
+        for i in range(0, len(owner_ids), BATCH_SIZE):
+            make_entries(owner_ids[i:i + BATCH_SIZE], posts)
+
+def backfill_followers(author_id):
+    '''Copies an author's latest posts into the feeds of all its followers, a batch of followers per transaction.
+
+    Does nothing if the author has gone back over FANOUT_LIMIT followers in the meantime.
+    '''
+    author = Profile.objects.filter(pk=author_id).only('follower_count').first()
+    if not author or not is_fanned_out(author):
+        return
+    posts = list(Post.objects.filter(profile=author).order_by('-timestamp', '-pk')[:BACKFILL_POSTS])
+    followers = Follow.objects.filter(profile=author).order_by('follower_profile_id').values_list('follower_profile_id', flat=True)
+    after = 0
+    while True: #keyset batches, so no transaction or lock is held for the whole backfill
+        batch = list(followers.filter(follower_profile_id__gt=after)[:BATCH_SIZE])
+        if not batch:
+            return
+        make_entries(batch, posts)
+        after = batch[-1]
+
+def process_backfill(author_id):
+    '''Runs backfill_followers() on a worker thread, logging instead of raising.'''
+    try:
+        backfill_followers(author_id)
+    except Exception:
+        logger.exception('could not deliver the posts of profile %s to its followers', author_id) #rebuild_timelines repairs it
+    finally:
+        connection.close() #the worker thread opens its own connection
+
+def rebuild_timelines(pks=None):
+    '''Rebuilds the feeds of the given profile pks (or every profile) from their follows.
+
+    Returns the number of timeline entries written.
+    '''
+    owners = Profile.objects.all() if pks is None else Profile.objects.filter(pk__in=pks)
+    owner_ids = list(owners.values_list('pk', flat=True))
+    with transaction.atomic():
+        TimelineEntry.objects.filter(owner_id__in=owner_ids).delete()
+        follows = Follow.objects.filter(follower_profile_id__in=owner_ids, profile__follower_count__lte=FANOUT_LIMIT).select_related('profile')
+        for follow in follows.iterator(chunk_size=BATCH_SIZE):
+            backfill([follow.follower_profile_id], follow.profile)
+    return TimelineEntry.objects.filter(owner_id__in=owner_ids).count()
+
+def get_feed(profile, before=None):
+    '''Returns the posts in a profile's feed, newest first, starting after the (timestamp, pk) key before.
+
+    Normally this is one range scan of the profile's timeline entries. If the profile follows
+    anyone too popular to fan out, their posts are read from the Post table and merged in.
+    '''
+    popular = Follow.objects.filter(follower_profile=profile, profile__follower_count__gt=FANOUT_LIMIT).values('profile_id')
+    if not popular.exists():
+        return Post.objects.filter( #one filter() call, so both conditions apply to the same timeline entry
+            Q(timeline_entries__owner=profile),
+            older_than(before, 'timeline_entries__timestamp', 'timeline_entries__post'),
+        ).order_by('-timeline_entries__timestamp', '-timeline_entries__post')
+
+    delivered = TimelineEntry.objects.filter(owner=profile).values('post_id')
+    return Post.objects.filter(Q(pk__in=delivered) | Q(profile_id__in=popular), older_than(before)).order_by('-timestamp', '-pk')
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(instance, created, **kwargs):
+    '''Pushes a new post to its author's followers, unless the author is too popular to fan out.'''
+    if created and is_fanned_out(Profile.objects.only('follower_count').get(pk=instance.profile_id)):
+        fan_out_post(instance)
+
+@receiver(post_save, sender=Follow)
+def backfill_new_follow(instance, created, **kwargs):
+    '''Adds the followed profile's latest posts to the new follower's feed.'''
+    if created and is_fanned_out(Profile.objects.only('follower_count').get(pk=instance.profile_id)):
+        backfill([instance.follower_profile_id], instance.profile_id)
+
+@receiver(post_delete, sender=Follow)
+def prune_unfollow(instance, **kwargs):
+    '''Removes the unfollowed profile's posts from the former follower's feed.
+
+    If the unfollowed profile just dropped back to being fanned out, its recent posts are
+    delivered to its followers in the background once this commits; until then their feeds
+    are missing the posts that weren't already delivered.
+    '''
+    TimelineEntry.objects.filter(owner_id=instance.follower_profile_id, author_id=instance.profile_id).delete()
+    author = Profile.objects.filter(pk=instance.profile_id).only('follower_count').first() #None if the author itself is being deleted
+    if author and author.follower_count == FANOUT_LIMIT:
+        transaction.on_commit(lambda: executor.submit(process_backfill, author.pk))
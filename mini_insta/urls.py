@@ -16,6 +16,7 @@ urlpatterns = [
     path('profile/<int:pk>/followers', ShowFollowersDetailView.as_view(), name='show_followers'), #route to show followers of a profile
     path('profile/<int:pk>/following', ShowFollowingDetailView.as_view(), name='show_following'), #route to show following of a profile
     path('profile/feed', PostFeedListView.as_view(), name='show_feed'), #route to show post feed of a profile
+    path('profile/feed/page', PostFeedPageView.as_view(), name='feed_page'), #route to get the next page of the feed as JSON
     path('profile/search', SearchView.as_view(), name='search'), #route to search for profiles and posts
     path('login/', auth_views.LoginView.as_view(template_name='mini_insta/login.html'), name='login'), #route to login page
 	path('logout/', auth_views.LogoutView.as_view(next_page='logged_out'), name='logout'), #route to logout page
@@ -25,5 +26,7 @@ urlpatterns = [
     path('profile/<int:pk>/delete_follow', DeleteFollowView.as_view(), name='delete_follow'), #route to unfollow a profile
     path('post/<int:pk>/like', LikePostView.as_view(), name='like_post'), #route to like a post
     path('post/<int:pk>/delete_like', DeleteLikeView.as_view(), name='delete_like'), #route to unlike a post
+    path('interactions', InteractionsView.as_view(), name='interactions'), #route to apply a batch of likes and follows as JSON
+    path('media/<path:name>', BlobView.as_view(), name='media_blob'), #route to serve uploaded photos with long-lived cache headers
 ]
 
@@ -3,7 +3,7 @@
 ## description: views.py for mini_insta app
 from django.shortcuts import render
 from django.views.generic import ListView
-from .models import Profile, Post, Photo, Like, Follow, Comment
+from .models import Profile, Post, Photo, Like, Follow, Comment, with_post_details
 from django.views.generic import DetailView, CreateView, UpdateView, DeleteView, TemplateView
 from django.urls import reverse
 from .forms import UpdateProfileForm, UpdatePostForm, CreateProfileForm
@@ -11,6 +11,22 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
 from django.shortcuts import redirect
+from django.http import FileResponse, Http404, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from .storage import BLOB_DIRECTORY, blob_storage
+from . import fts
+from .relationships import get_relationships
+from .interactions import apply_operations, follow_profile, like_posts, unfollow_profiles, unlike_posts
+from .fts import search_posts, search_profiles
+from django.template.loader import render_to_string
+from django.views import View
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+from .pagination import PAGE_SIZE, decode_cursor, get_post_page, older_than
 
 
 class ProfileRequiredMixin(LoginRequiredMixin):
@@ -23,13 +39,26 @@ class ProfileRequiredMixin(LoginRequiredMixin):
         '''Return the login URL.'''
         return reverse('login')
 
+class PostPageMixin:
+    '''Mixin for views that show one cursor page of posts at a time (?cursor=... for the next page).'''
+    page_size = PAGE_SIZE
+
+    def get_cursor(self):
+        '''Returns the (timestamp, pk) key of the last post on the previous page, or None on the first page.'''
+        return decode_cursor(self.request.GET.get('cursor'))
+
+    def get_post_page(self, posts):
+        '''Returns the page of a newest-first post queryset that starts at the cursor.'''
+        self.post_page = get_post_page(posts, self.page_size)
+        return self.post_page
+
 class ProfileListView(ListView):
     '''View to see all profiles.'''
     model = Profile
     template_name = 'mini_insta/show_all_profiles.html'
     context_object_name = 'profiles'
 
-class ProfileDetailView(DetailView):
+class ProfileDetailView(PostPageMixin, DetailView):
     '''View to see a profile.'''
     model = Profile
     template_name = 'mini_insta/show_profile.html'
@@ -38,17 +67,12 @@ class ProfileDetailView(DetailView):
     def get_context_data(self, **kwargs):
         '''Add the whether the logged-in user is viewing their own profile to the context.'''
         context = super().get_context_data(**kwargs)
-        profile = self.get_object()
-        if self.request.user.is_authenticated:
-            user_profile = Profile.objects.get(user=self.request.user)
-            context['is_owner'] = (user_profile == profile)
-            context['is_following'] = Follow.objects.filter(
-                follower_profile=user_profile,
-                profile=profile
-            ).exists()
-        else:
-            context['is_owner'] = False
-            context['is_following'] = False
+        profile = self.object #already loaded by DetailView
+        context['post_page'] = self.get_post_page(profile.get_all_posts().filter(older_than(self.get_cursor())))
+        relationships = get_relationships(self.request).load(profiles=[profile])
+        context['is_owner'] = self.request.user.is_authenticated and profile.user_id == self.request.user.pk
+        context['is_following'] = relationships.is_following(profile)
+        context.update(relationships.get_context())
         return context
 
 
@@ -58,22 +82,20 @@ class PostDetailView(DetailView):
     template_name = 'mini_insta/show_post.html'
     context_object_name = 'post'
 
+    def get_queryset(self):
+        '''Load the post's profile and counts along with the post.'''
+        return with_post_details(Post.objects.all())
+
     def get_context_data(self, **kwargs):
         '''Add is_owner to the template context.'''
         context = super().get_context_data(**kwargs)
-        post = self.get_object()
-        if self.request.user.is_authenticated:
-            user_profile = Profile.objects.get(user=self.request.user)
-            context['is_owner'] = (user_profile == post.profile)
-
-            context['has_liked'] = Like.objects.filter(
-                profile=user_profile,
-                post=post
-            ).exists()
-        else:
-            context['is_owner'] = False
-            context['has_liked'] = False
+        post = self.object #already loaded by DetailView
+        relationships = get_relationships(self.request).load(posts=[post])
+        context['is_owner'] = self.request.user.is_authenticated and post.profile.user_id == self.request.user.pk
+        context['has_liked'] = relationships.has_liked(post)
+        context.update(relationships.get_context())
         return context
+
 class CreatePostView(ProfileRequiredMixin, CreateView):
     model = Post
     template_name = 'mini_insta/create_post_form.html'
@@ -164,23 +186,35 @@ class ShowFollowingDetailView(DetailView):
     template_name = 'mini_insta/show_following.html'
     context_object_name = 'profile'
 
-class PostFeedListView(ProfileRequiredMixin, ListView):
+class PostFeedListView(ProfileRequiredMixin, PostPageMixin, ListView):
     template_name = 'mini_insta/show_feed.html'
     context_object_name = 'posts'
-    ordering = ['-timestamp']
 
     def get_queryset(self):
-        '''Return the post feed for the logged-in user's profile.'''
+        '''Return one page of the post feed for the logged-in user's profile.'''
         profile = self.get_profile() #get the profile of the logged-in user
-        return profile.get_post_feed()
+        return self.get_post_page(with_post_details(profile.get_post_feed(before=self.get_cursor()))).object_list
 
     def get_context_data(self, **kwargs):
-        '''Add profile to the template context.'''
+        '''Add profile and the page to the template context.'''
         context = super().get_context_data(**kwargs)
         context['profile'] = self.get_profile()  #add the profile to the context
+        context['post_page'] = self.post_page #for the link to the next page
+        context.update(get_relationships(self.request).load(posts=context['posts']).get_context()) #for the like buttons
         return context
+
+class PostFeedPageView(ProfileRequiredMixin, PostPageMixin, View):
+    '''JSON endpoint returning the next page of the feed as rendered HTML, for loading more posts in place.'''
+
+    def get(self, request):
+        '''Return {"html": ..., "next_cursor": ...} for the page after ?cursor=.'''
+        profile = self.get_profile()
+        page = self.get_post_page(with_post_details(profile.get_post_feed(before=self.get_cursor())))
+        context = {'posts': page.object_list, **get_relationships(request).load(posts=page.object_list).get_context()}
+        html = render_to_string('mini_insta/feed_posts.html', context, request)
+        return JsonResponse({'html': html, 'next_cursor': page.next_cursor})
     
-class SearchView(ProfileRequiredMixin, ListView):
+class SearchView(ProfileRequiredMixin, PostPageMixin, ListView):
     '''View to search profiles and posts.'''
     template_name = 'mini_insta/search_results.html'
     context_object_name = 'posts'
@@ -194,11 +228,15 @@ class SearchView(ProfileRequiredMixin, ListView):
             return super().dispatch(request, *args, **kwargs) #continue with ListView processing if there is a query
 
     def get_queryset(self):
-        '''Return posts matching the search query.'''
+        '''Return one page of the posts matching the search query, best matches first.'''
         query = self.request.GET.get('query', '') #get the search query
+        if fts.is_supported(): #ranked search on the full-text index
+            self.post_page = search_posts(query, self.request.GET.get('cursor'), self.page_size)
+            return self.post_page.object_list
+        posts = Post.objects.none()
         if query:
-            return Post.objects.filter(caption__icontains=query).order_by('-timestamp') #if theres a search query, filter posts by caption
-        return Post.objects.none()
+            posts = Post.objects.filter(caption__icontains=query).order_by('-timestamp', '-pk') #if theres a search query, filter posts by caption
+        return self.get_post_page(with_post_details(posts.filter(older_than(self.get_cursor())))).object_list
 
     def get_context_data(self, **kwargs):
         '''Add profile, query, posts, and matching profiles to context.'''
@@ -211,9 +249,12 @@ class SearchView(ProfileRequiredMixin, ListView):
         #get the query
         query = self.request.GET.get('query', '')
         context['query'] = query
+        context['post_page'] = self.post_page #for the link to the next page
         
         #get matching profiles
-        if query:
+        if query and fts.is_supported():
+            context['profiles'] = search_profiles(query)
+        elif query:
             #combine results from all three fields
             username_matches = Profile.objects.filter(username__icontains=query)
             display_name_matches = Profile.objects.filter(display_name__icontains=query)
@@ -225,6 +266,8 @@ class SearchView(ProfileRequiredMixin, ListView):
         else:
             context['profiles'] = Profile.objects.none()
         
+        #which results the user already follows
+        context.update(get_relationships(self.request).load(profiles=context['profiles']).get_context())
         return context
     
 class LoggedOutView(TemplateView):
@@ -260,23 +303,9 @@ class FollowProfileView(ProfileRequiredMixin, TemplateView):
 
     def dispatch(self, request, *args, **kwargs):
         '''Handle following the profile before rendering the template.'''
-        user_profile = self.get_profile()
-        profile_to_follow = Profile.objects.get(pk=kwargs['pk'])
-        #create a Follow relationship if it doesn't already exist
-        if user_profile != profile_to_follow:
-            #check if already following
-            existing_follow = Follow.objects.filter(
-                follower_profile=user_profile,
-                profile=profile_to_follow
-            ).first()
-            
-            if not existing_follow:
-                #create the follow relationship
-                Follow.objects.create(
-                    follower_profile=user_profile,
-                    profile=profile_to_follow
-                )
-        return redirect('show_profile', pk=profile_to_follow.pk)
+        #one insert, which does nothing if already following (or if it's the user's own profile)
+        follow_profile(self.get_profile(), kwargs['pk'])
+        return redirect('show_profile', pk=kwargs['pk'])
     
 class DeleteFollowView(ProfileRequiredMixin, TemplateView):
     '''View to unfollow a profile.'''
@@ -284,16 +313,9 @@ class DeleteFollowView(ProfileRequiredMixin, TemplateView):
 
     def dispatch(self, request, *args, **kwargs):
         '''Handle unfollowing the profile before rendering the template.'''
-        user_profile = self.get_profile()
-        profile_to_unfollow = Profile.objects.get(pk=kwargs['pk'])
-        
         #delete the Follow relationship if it exists
-        Follow.objects.filter(
-            follower_profile=user_profile,
-            profile=profile_to_unfollow
-        ).delete()
-        
-        return redirect('show_profile', pk=profile_to_unfollow.pk)
+        unfollow_profiles(self.get_profile(), [kwargs['pk']])
+        return redirect('show_profile', pk=kwargs['pk'])
     
 class LikePostView(ProfileRequiredMixin, TemplateView):
     '''View to like a post.'''
@@ -301,23 +323,9 @@ class LikePostView(ProfileRequiredMixin, TemplateView):
 
     def dispatch(self, request, *args, **kwargs):
         '''Handle liking the post before rendering the template.'''
-        user_profile = self.get_profile()
-        post_to_like = Post.objects.get(pk=kwargs['pk'])
-        
-        #create a Like relationship if it doesn't already exist
-        if user_profile != post_to_like.profile:
-            existing_like = Like.objects.filter(
-                profile=user_profile,
-                post=post_to_like
-            ).first()
-            
-            if not existing_like:
-                #create the like relationship
-                Like.objects.create(
-                    profile=user_profile,
-                    post=post_to_like
-                )
-        return redirect('show_post', pk=post_to_like.pk)
+        #one insert, which does nothing if already liked (or if it's the user's own post)
+        like_posts(self.get_profile(), [kwargs['pk']])
+        return redirect('show_post', pk=kwargs['pk'])
 
 class DeleteLikeView(ProfileRequiredMixin, TemplateView):
     '''View to unlike a post.'''
@@ -325,14 +333,40 @@ class DeleteLikeView(ProfileRequiredMixin, TemplateView):
 
     def dispatch(self, request, *args, **kwargs):
         '''Handle unliking the post before rendering the template.'''
-        user_profile = self.get_profile()
-        post_to_unlike = Post.objects.get(pk=kwargs['pk'])
-        
         #delete the Like relationship if it exists
-        Like.objects.filter(
-            profile=user_profile,
-            post=post_to_unlike
-        ).delete()
-        
-        return redirect('show_post', pk=post_to_unlike.pk)
-    
\ No newline at end of file
+        unlike_posts(self.get_profile(), [kwargs['pk']])
+        return redirect('show_post', pk=kwargs['pk'])
+
+class InteractionsView(APIView):
+    '''Applies a batch of queued likes, unlikes, follows and unfollows in one request.
+
+    POST a JSON body like {"operations": [{"op": "like", "id": 12}, {"op": "unfollow", "id": 3}]},
+    where id is a post for like/unlike and a profile for follow/unfollow. The response lists
+    the ids each op actually changed, leaving out missing ids and ones already in that state.
+
+    Mobile clients authenticate with the API token from runtracker's auth/login/ (an
+    X-Auth-Token or "Authorization: Token ..." header) and need no CSRF cookie. Pages using the
+    login session must send the CSRF token in X-CSRFToken, as for any other POST.
+    '''
+    authentication_classes = [SessionAuthentication, *api_settings.DEFAULT_AUTHENTICATION_CLASSES] #session first, so no credentials is a 403
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        '''Applies the operations in the request body.'''
+        try:
+            applied = apply_operations(request.user.profile, request.data.get('operations'))
+        except (AttributeError, ValueError) as error: #a body that isn't a JSON object has no get()
+            return Response({'error': str(error)}, status=400)
+        return Response(applied)
+
+
+@method_decorator(cache_control(public=True, max_age=60 * 60 * 24 * 365, immutable=True), name='dispatch')
+class BlobView(View):
+    '''Serves an uploaded photo or rendition from the content-addressed storage.
+    The file name is a hash of its content, so a URL always means the same bytes and can be cached for good.'''
+
+    def get(self, request, name):
+        '''Returns the stored file.'''
+        if not name.startswith(f'{BLOB_DIRECTORY}/') or '..' in name.split('/') or not blob_storage.exists(name):
+            raise Http404('No such file')
+        return FileResponse(blob_storage.open(name))
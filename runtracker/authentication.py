@@ -9,6 +9,6 @@ class CustomHeaderTokenAuthentication(TokenAuthentication): #overwrite TokenAuth
     def authenticate(self, request):
         auth = request.META.get('HTTP_X_AUTH_TOKEN') #get the custom auth token from the request
         if auth:
-            request.META['HTTP_AUTHORIZATION'] = f'Token {auth}' #use it instead of the normal auth token (also add Token prefix)
+            return self.authenticate_credentials(auth) #check it directly, request.headers may already be cached without an Authorization header
         
         return super().authenticate(request)
\ No newline at end of file
@@ -0,0 +1,109 @@
+## runtracker/geo.py
+## Author: William Fugate wfugate@bu.edu
+## description: vectorized distance calculations between GPS points, for nearby runs and route lengths
+import numpy as np
+
+#mean radius of the earth, which the spherical haversine distance uses
+EARTH_RADIUS_M = 6371008.8
+
+#the WGS-84 ellipsoid GPS coordinates are measured on, which the Vincenty distance uses
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+#haversine is never off from the ellipsoidal distance by more than this fraction (see tests.py),
+#so anything past a radius by more than this is out whichever distance is used
+HAVERSINE_ERROR = 0.0057
+
+VINCENTY_ITERATIONS = 200
+VINCENTY_TOLERANCE = 1e-12
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    '''Returns the great-circle distances in meters between points given in degrees.
+
+    Any argument can be a scalar or an array and they broadcast together, so one target
+    against an array of points, or consecutive points of a route, is a single call.
+    '''
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def vincenty_m(lat1, lon1, lat2, lon2):
+    '''Returns the distances in meters on the WGS-84 ellipsoid between points given in degrees.
+
+    Accurate to well under a millimeter, but the iteration doesn't converge for nearly
+    antipodal points; those get their haversine distance instead. Broadcasts like haversine_m.
+    '''
+    shape = np.broadcast_shapes(*(np.shape(value) for value in (lat1, lon1, lat2, lon2)))
+    lat1, lon1, lat2, lon2 = (a.ravel() for a in np.broadcast_arrays(*(np.asarray(value, dtype=np.float64) for value in (lat1, lon1, lat2, lon2))))
+    u1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1))) #reduced latitudes
+    u2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1, sin_u2, cos_u2 = np.sin(u1), np.cos(u1), np.sin(u2), np.cos(u2)
+    l = np.radians(lon2 - lon1)
+
+    def step(lam, i):
+        '''Returns the next estimate of lambda for the points at indexes i, and the terms the distance needs.'''
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.hypot(cos_u2[i] * sin_lam, cos_u1[i] * sin_u2[i] - sin_u1[i] * cos_u2[i] * cos_lam)
+        cos_sigma = sin_u1[i] * sin_u2[i] + cos_u1[i] * cos_u2[i] * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1[i] * cos_u2[i] * sin_lam / np.where(sin_sigma == 0, 1.0, sin_sigma))
+        cos2_alpha = 1 - sin_alpha ** 2
+        cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1[i] * sin_u2[i] / np.where(cos2_alpha == 0, 1.0, cos2_alpha)) #0 on the equator
+        c = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+        following = l[i] + (1 - c) * WGS84_F * sin_alpha * (
+            sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+        return following, (sin_sigma, cos_sigma, sigma, cos2_alpha, cos_2sigma_m)
+
+    #iterate only on the points that haven't converged yet, most take a handful of steps
+    lam = l.copy()
+    active = np.arange(len(l))
+    for _ in range(VINCENTY_ITERATIONS):
+        following, _ = step(lam[active], active)
+        done = np.abs(following - lam[active]) < VINCENTY_TOLERANCE
+        lam[active] = following
+        active = active[~done]
+        if not len(active):
+            break
+
+    everything = np.arange(len(l))
+    _, (sin_sigma, cos_sigma, sigma, cos2_alpha, cos_2sigma_m) = step(lam, everything)
+    u_squared = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    big_a = 1 + u_squared / 16384 * (4096 + u_squared * (-768 + u_squared * (320 - 175 * u_squared)))
+    big_b = u_squared / 1024 * (256 + u_squared * (-128 + u_squared * (74 - 47 * u_squared)))
+    delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    distances = WGS84_B * big_a * (sigma - delta_sigma)
+
+    if len(active): #nearly antipodal points never converged
+        distances[active] = haversine_m(lat1[active], lon1[active], lat2[active], lon2[active])
+    return distances.reshape(shape)
+
+def distances_m(lat, lon, lats, lons, refine=False):
+    '''Returns the distances in meters from one point to arrays of points.
+
+    Haversine by default; with refine, Vincenty's ellipsoidal distance, which matches geopy's
+    geodesic() to within a millimeter.
+    '''
+    return vincenty_m(lat, lon, lats, lons) if refine else haversine_m(lat, lon, lats, lons)
+
+def within_radius(lat, lon, lats, lons, radius_m):
+    '''Returns (indexes, distances) of the points within radius_m meters of (lat, lon), measured on the ellipsoid.
+
+    Haversine rules out everything clearly too far away, and only the points that could be
+    within the radius are refined with Vincenty.
+    '''
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    rough = haversine_m(lat, lon, lats, lons)
+    indexes = np.flatnonzero(rough <= radius_m * (1 + HAVERSINE_ERROR))
+    exact = vincenty_m(lat, lon, lats[indexes], lons[indexes])
+    keep = exact <= radius_m
+    return indexes[keep], exact[keep]
+
+def path_length_m(lats, lons, refine=False):
+    '''Returns the length in meters of the path through the points in order.'''
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    if len(lats) < 2:
+        return 0.0
+    measure = vincenty_m if refine else haversine_m
+    return float(measure(lats[:-1], lons[:-1], lats[1:], lons[1:]).sum())
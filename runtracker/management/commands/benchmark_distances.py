@@ -0,0 +1,54 @@
+## runtracker/management/commands/benchmark_distances.py
+## Author: William Fugate wfugate@bu.edu
+## description: management command comparing the vectorized distance functions in geo.py with a geopy loop
+## Run with: python manage.py benchmark_distances [--sizes 10000 100000 1000000] [--geopy-limit 100000]
+
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from geopy.distance import geodesic
+from runtracker.geo import haversine_m, vincenty_m, within_radius
+
+
+class Command(BaseCommand):
+    help = 'Times one-target-to-many distance calculations with geopy, haversine and Vincenty, and reports their errors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                            help='how many run centers to measure the distance to')
+        parser.add_argument('--geopy-limit', type=int, default=100000,
+                            help='time the geopy loop on at most this many centers and scale up the time for more')
+        parser.add_argument('--seed', type=int, default=412)
+
+    def time(self, function):
+        '''Returns (result, seconds) of calling function.'''
+        start = time.perf_counter()
+        result = function()
+        return result, time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        target = (42.3505, -71.1054) #BU campus, like populate_data
+        self.stdout.write(f"{'runs':>9} {'geopy':>11} {'haversine':>11} {'vincenty':>11} {'500m search':>12} {'haversine err':>14} {'vincenty err':>13}")
+        for size in options['sizes']:
+            #half within a few km of the target, half anywhere, so both short and long distances are covered
+            near = size // 2
+            lats = np.concatenate([target[0] + rng.uniform(-0.05, 0.05, near), rng.uniform(-89.9, 89.9, size - near)])
+            lons = np.concatenate([target[1] + rng.uniform(-0.05, 0.05, near), rng.uniform(-180, 180, size - near)])
+
+            haversine, haversine_seconds = self.time(lambda: haversine_m(*target, lats, lons))
+            vincenty, vincenty_seconds = self.time(lambda: vincenty_m(*target, lats, lons))
+            _, search_seconds = self.time(lambda: within_radius(*target, lats, lons, 500))
+
+            sample = min(size, options['geopy_limit'])
+            picked = rng.choice(size, sample, replace=False) if sample < size else np.arange(size)
+            geopy, geopy_seconds = self.time(lambda: np.array([geodesic(target, (lats[i], lons[i])).meters for i in picked]))
+            geopy_seconds *= size / sample
+            haversine_error = np.max(np.abs(haversine[picked] - geopy) / np.maximum(geopy, 1e-9))
+            vincenty_error = np.max(np.abs(vincenty[picked] - geopy))
+
+            self.stdout.write(
+                f"{size:>9} {geopy_seconds * 1000:>9.0f}{'ms' if sample == size else '*'} {haversine_seconds * 1000:>9.1f}ms "
+                f"{vincenty_seconds * 1000:>9.1f}ms {search_seconds * 1000:>10.1f}ms {haversine_error:>13.3%} {vincenty_error * 1000:>10.3f}mm"
+            )
+        self.stdout.write('* geopy time scaled up from a sample of --geopy-limit centers')
@@ -4,6 +4,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from runtracker.models import Run, UserProfile, Badge, Group, GroupMembership
+from runtracker.routes import encode_route
 from datetime import datetime, timedelta
 import random
 
@@ -66,7 +67,7 @@ class Command(BaseCommand):
                     duration_seconds=duration,
                     center_lat=center_lat,
                     center_lon=center_lon,
-                    route_data=route_points
+                    route=encode_route(route_points)
                 )
                 
                 # Update profile stats
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:48
+
+import math
+from django.conf import settings
+from django.db import migrations, models
+
+#the grid runtracker/spatial.py used at this migration, copied here so later changes
+#to spatial.py don't change what this migration does
+GRID_CELL_DEGREES = 0.01
+GRID_ROWS = round(180 / GRID_CELL_DEGREES)
+GRID_COLUMNS = round(360 / GRID_CELL_DEGREES)
+
+
+def get_cell(lat, lon):
+    '''Returns the number of the grid cell a point falls in.'''
+    row = min(max(math.floor((lat + 90) / GRID_CELL_DEGREES), 0), GRID_ROWS - 1)
+    column = math.floor((lon + 180) / GRID_CELL_DEGREES) % GRID_COLUMNS
+    return row * GRID_COLUMNS + column
+
+
+def fill_grid_cells(apps, schema_editor):
+    '''Puts the existing runs in their grid cells.'''
+    Run = apps.get_model('runtracker', 'Run')
+    runs = []
+    for run in Run.objects.only('center_lat', 'center_lon').iterator(chunk_size=2000):
+        run.grid_cell = get_cell(run.center_lat, run.center_lon)
+        runs.append(run)
+        if len(runs) == 2000:
+            Run.objects.bulk_update(runs, ['grid_cell'])
+            runs = []
+    Run.objects.bulk_update(runs, ['grid_cell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runtracker', '0003_remove_badge_criteria_remove_badge_description_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='grid_cell',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_grid_cells, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['grid_cell'], name='run_grid_cell_idx'),
+        ),
+    ]
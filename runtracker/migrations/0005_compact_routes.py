@@ -0,0 +1,157 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:02
+
+import logging
+import math
+import struct
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from django.db import migrations, models
+
+#format 1 of the route encoding in runtracker/routes.py, copied here so later changes
+#to routes.py don't change what this migration does
+HEADER = struct.Struct('<BBIqh') #version, flags, point count, first timestamp (microseconds since 1970), UTC offset (minutes)
+HAS_TIMESTAMPS = 1
+NAIVE_TIMESTAMPS = 2
+COORDINATE_SCALE = 10 ** 7
+VARINT_GROUPS = 10
+EPOCH = datetime(1970, 1, 1)
+
+logger = logging.getLogger(__name__)
+
+
+def encode_varints(values):
+    '''Returns the LEB128 varint bytes of an array of unsigned 64-bit integers.'''
+    groups = (values[:, None] >> (np.arange(VARINT_GROUPS, dtype=np.uint64) * np.uint64(7))) & np.uint64(0x7f)
+    lengths = VARINT_GROUPS - np.argmax(groups[:, ::-1] != 0, axis=1)
+    lengths[~groups.any(axis=1)] = 1
+    used = np.arange(VARINT_GROUPS) < lengths[:, None]
+    continued = np.arange(VARINT_GROUPS) < (lengths - 1)[:, None]
+    return (groups | (continued.astype(np.uint64) << np.uint64(7)))[used].astype(np.uint8).tobytes()
+
+
+def decode_varints(data):
+    '''Returns the unsigned integers in a run of LEB128 varint bytes.'''
+    data = np.frombuffer(data, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    positions = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7f).astype(np.uint64) << (positions.astype(np.uint64) * np.uint64(7))
+    return np.add.reduceat(parts, starts)
+
+
+def encode_route(points):
+    '''Returns the format 1 encoding of a list of {"latitude", "longitude", "timestamp"} points.'''
+    lats = np.round(np.array([float(point['latitude']) for point in points], dtype=np.float64) * COORDINATE_SCALE)
+    lons = np.round(np.array([float(point['longitude']) for point in points], dtype=np.float64) * COORDINATE_SCALE)
+    if not (np.all(np.abs(lats) <= 90 * COORDINATE_SCALE) and np.all(np.abs(lons) <= 180 * COORDINATE_SCALE)):
+        raise ValueError('latitude must be within ±90 and longitude within ±180')
+    flags = start_us = offset_minutes = 0
+    seconds = np.zeros(len(points), dtype=np.int64)
+    timestamps = [point.get('timestamp') for point in points]
+    if points and all(timestamps):
+        flags |= HAS_TIMESTAMPS
+        times = [value if isinstance(value, datetime) else datetime.fromisoformat(value) for value in timestamps]
+        start = times[0]
+        if start.tzinfo is None:
+            flags |= NAIVE_TIMESTAMPS
+            start_utc = start
+        else:
+            offset_minutes = int(start.utcoffset().total_seconds() // 60)
+            start_utc = start.astimezone(timezone.utc).replace(tzinfo=None)
+        start_us = (start_utc - EPOCH) // timedelta(microseconds=1)
+        seconds = np.array([round((time - start).total_seconds()) for time in times], dtype=np.int64)
+    columns = np.stack([lats.astype(np.int64), lons.astype(np.int64), seconds], axis=1)
+    deltas = np.diff(columns, axis=0, prepend=np.zeros((1, 3), dtype=np.int64)).ravel()
+    zigzagged = ((deltas << 1) ^ (deltas >> 63)).astype(np.uint64)
+    return HEADER.pack(1, flags, len(points), start_us, offset_minutes) + encode_varints(zigzagged)
+
+
+def decode_route(data):
+    '''Returns the list of {"latitude", "longitude", "timestamp"} points in a format 1 route.'''
+    data = bytes(data or b'')
+    if not data:
+        return []
+    _, flags, count, start_us, offset_minutes = HEADER.unpack_from(data)
+    values = decode_varints(data[HEADER.size:])
+    deltas = (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+    columns = np.cumsum(deltas.reshape(count, 3), axis=0)
+    timestamps = [None] * count
+    if flags & HAS_TIMESTAMPS:
+        start = EPOCH + timedelta(microseconds=start_us)
+        if not flags & NAIVE_TIMESTAMPS:
+            start = start.replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(minutes=offset_minutes)))
+        timestamps = [(start + timedelta(seconds=second)).isoformat() for second in columns[:, 2].tolist()]
+    return [
+        {'latitude': lat / COORDINATE_SCALE, 'longitude': lon / COORDINATE_SCALE, 'timestamp': timestamp}
+        for lat, lon, timestamp in zip(columns[:, 0].tolist(), columns[:, 1].tolist(), timestamps)
+    ]
+
+
+def usable_coordinates(points):
+    '''Returns the latitude and longitude of the points that have finite, in-range coordinates, dropping the rest.'''
+    usable = []
+    for point in points:
+        try:
+            lat, lon = float(point['latitude']), float(point['longitude'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if math.isfinite(lat) and math.isfinite(lon) and abs(lat) <= 90 and abs(lon) <= 180:
+            usable.append({'latitude': lat, 'longitude': lon})
+    return usable
+
+
+def encode_routes(apps, schema_editor):
+    '''Converts each run's JSON route into the compact encoding.
+
+    A route that can't be encoded as it is keeps only its usable coordinates, without
+    timestamps, and the run's pk is logged; the migration never stops on a bad route.
+    '''
+    Run = apps.get_model('runtracker', 'Run')
+    runs = []
+    for run in Run.objects.only('route_data').iterator(chunk_size=500):
+        points = run.route_data if isinstance(run.route_data, list) else []
+        try:
+            run.route = encode_route(points)
+        except (AttributeError, KeyError, OverflowError, TypeError, ValueError): #unreadable points or timestamps
+            usable = usable_coordinates(points)
+            logger.warning('run %s: route kept %d of %d points, without timestamps', run.pk, len(usable), len(points))
+            run.route = encode_route(usable)
+        runs.append(run)
+        if len(runs) == 500:
+            Run.objects.bulk_update(runs, ['route'])
+            runs = []
+    Run.objects.bulk_update(runs, ['route'])
+
+
+def decode_routes(apps, schema_editor):
+    '''Converts the compact routes back into JSON.'''
+    Run = apps.get_model('runtracker', 'Run')
+    for run in Run.objects.only('route').iterator(chunk_size=500):
+        Run.objects.filter(pk=run.pk).update(route_data=decode_route(run.route))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runtracker', '0004_run_grid_cell'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='route',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AlterField( #so removing the field can be reversed
+            model_name='run',
+            name='route_data',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(encode_routes, decode_routes),
+        migrations.RemoveField(
+            model_name='run',
+            name='route_data',
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:32
+
+import math
+import django.db.models.expressions
+import django.db.models.functions.comparison
+import django.db.models.functions.math
+from django.db import migrations, models
+
+#the grid runtracker/spatial.py used at this migration, for filling the plain column back in when reversing
+GRID_CELL_DEGREES = 0.01
+GRID_ROWS = round(180 / GRID_CELL_DEGREES)
+GRID_COLUMNS = round(360 / GRID_CELL_DEGREES)
+
+
+def fill_grid_cells(apps, schema_editor):
+    '''Puts the runs back in their grid cells once grid_cell is a plain column again.'''
+    Run = apps.get_model('runtracker', 'Run')
+    runs = []
+    for run in Run.objects.only('center_lat', 'center_lon').iterator(chunk_size=2000):
+        row = min(max(math.floor((run.center_lat + 90) / GRID_CELL_DEGREES), 0), GRID_ROWS - 1)
+        run.grid_cell = row * GRID_COLUMNS + math.floor((run.center_lon + 180) / GRID_CELL_DEGREES) % GRID_COLUMNS
+        runs.append(run)
+        if len(runs) == 2000:
+            Run.objects.bulk_update(runs, ['grid_cell'])
+            runs = []
+    Run.objects.bulk_update(runs, ['grid_cell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runtracker', '0005_compact_routes'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, fill_grid_cells), #runs last when reversing
+        #a field can't be altered into a generated one, so the column and its index are made again
+        migrations.RemoveIndex(
+            model_name='run',
+            name='run_grid_cell_idx',
+        ),
+        migrations.RemoveField(
+            model_name='run',
+            name='grid_cell',
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='grid_cell',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.comparison.Cast(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast(django.db.models.functions.comparison.Least(django.db.models.functions.comparison.Greatest(django.db.models.functions.math.Floor(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('center_lat'), '+', models.Value(90.0)), '/', models.Value(0.01))), 0), 17999), models.BigIntegerField()), '*', models.Value(36000)), '+', django.db.models.functions.math.Mod(django.db.models.expressions.CombinedExpression(django.db.models.functions.math.Mod(django.db.models.functions.comparison.Cast(django.db.models.functions.math.Floor(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('center_lon'), '+', models.Value(180.0)), '/', models.Value(0.01))), models.BigIntegerField()), 36000), '+', models.Value(36000)), 36000)), models.BigIntegerField()), output_field=models.BigIntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['grid_cell'], name='run_grid_cell_idx'),
+        ),
+    ]
@@ -3,6 +3,7 @@
 ## description: model definitions for runtracker app
 from django.db import models
 from django.contrib.auth.models import User
+from .spatial import get_cell_expression
 
 class Run(models.Model):
     """Model to represent a single run"""
@@ -12,13 +13,17 @@ class Run(models.Model):
     duration_seconds = models.IntegerField(default=0) #duration of the run in seconds
     center_lat = models.FloatField() #geographic center latitude
     center_lon = models.FloatField() #geographic center longitude
+    grid_cell = models.GeneratedField( #grid cell of the center, see spatial.py; the database keeps it current, bulk writes included
+        expression=get_cell_expression('center_lat', 'center_lon'), output_field=models.BigIntegerField(), db_persist=True,
+    )
 
-    route_data = models.JSONField() #stores GPS route data as JSON list of coordinates
+    route = models.BinaryField(default=b'') #GPS route in the compact encoding from routes.py (the API shows it as route_data)
 
     class Meta:
         indexes = [
             models.Index(fields=['user', 'start_time']),
             models.Index(fields=['distance_km']),
+            models.Index(fields=['grid_cell'], name='run_grid_cell_idx'),
         ]
         ordering = ['-start_time']
 
@@ -0,0 +1,61 @@
+## runtracker/nearby.py
+## Author: William Fugate wfugate@bu.edu
+## description: finds the runs nearest a point, closest first, using the grid cell index
+import heapq
+import math
+import numpy as np
+from .geo import within_radius
+from .models import Run
+from .spatial import within_box
+
+DEFAULT_RADIUS_METERS = 500
+MAX_RADIUS_METERS = 50000
+
+#the k-nearest search starts with this radius and widens it until it has found k runs
+FIRST_SEARCH_METERS = 250
+
+def get_runs_within(lat, lon, radius_m, exclude_pk=None):
+    '''Returns (ids, distances) of the runs whose centers are within radius_m meters of (lat, lon), in no order.'''
+    rows = Run.objects.filter(within_box(lat, lon, radius_m)).values_list('id', 'center_lat', 'center_lon')
+    if exclude_pk is not None:
+        rows = rows.exclude(pk=exclude_pk)
+    rows = np.array(list(rows), dtype=np.float64).reshape(-1, 3)
+    indexes, distances = within_radius(lat, lon, rows[:, 1], rows[:, 2], radius_m)
+    return rows[indexes, 0].astype(np.int64), distances
+
+def get_all(lat, lon, radius_m, exclude_pk=None):
+    '''Returns the (distance, id) pairs of every run within radius_m of (lat, lon), closest first.'''
+    ids, distances = get_runs_within(lat, lon, radius_m, exclude_pk)
+    return sorted(zip(distances.tolist(), ids.tolist()))
+
+def get_page(lat, lon, radius_m, limit, after=None, exclude_pk=None):
+    '''Returns up to limit (distance, id) pairs of the runs within radius_m, closest first, starting after the pair after.
+
+    Only the closest limit + 1 are kept (a bounded heap), so a page costs O(n log limit) rather
+    than sorting every run in the radius. The extra pair tells whether there is a next page.
+    Returns (page, has_next).
+    '''
+    ids, distances = get_runs_within(lat, lon, radius_m, exclude_pk)
+    pairs = zip(distances.tolist(), ids.tolist())
+    if after is not None:
+        pairs = (pair for pair in pairs if pair > after) #(distance, id) order, ties broken by id
+    page = heapq.nsmallest(limit + 1, pairs)
+    return page[:limit], len(page) > limit
+
+def get_nearest(lat, lon, k, radius_m=MAX_RADIUS_METERS, exclude_pk=None):
+    '''Returns the (distance, id) pairs of the k runs nearest (lat, lon) within radius_m, closest first.
+
+    The search starts small and widens, and stops as soon as a search radius holds k runs,
+    since nothing outside it can be nearer. The next radius is guessed from how many runs
+    the last one held, so a dense area usually takes one or two searches.
+    '''
+    search_m = min(FIRST_SEARCH_METERS, radius_m)
+    while True:
+        ids, distances = get_runs_within(lat, lon, search_m, exclude_pk)
+        if len(ids) >= k or search_m >= radius_m:
+            return heapq.nsmallest(k, zip(distances.tolist(), ids.tolist()))
+        if len(ids):
+            growth = 1.5 * math.sqrt(k / len(ids)) #runs found grow with the area, the square of the radius
+        else:
+            growth = 4
+        search_m = min(search_m * max(growth, 2), radius_m)
@@ -0,0 +1,187 @@
+## runtracker/routes.py
+## Author: William Fugate wfugate@bu.edu
+## description: compact binary encoding of GPS routes for Run.route
+import struct
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from .geo import EARTH_RADIUS_M, path_length_m
+
+#a route is a header followed by one varint triple per point: the change in latitude and longitude
+#from the previous point in 1e-7 degrees (about 1 cm), and the change in its timestamp in whole
+#seconds. Consecutive GPS fixes are close together, so most changes fit in one to three bytes
+#and a point takes about 5 bytes instead of about 100 as JSON.
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<BBIqh') #version, flags, point count, first timestamp (microseconds since 1970), UTC offset (minutes)
+HAS_TIMESTAMPS = 1
+NAIVE_TIMESTAMPS = 2
+
+COORDINATE_SCALE = 10 ** 7
+VARINT_GROUPS = 10 #7-bit groups in the largest 64-bit varint
+EPOCH = datetime(1970, 1, 1)
+
+def zigzag(values):
+    '''Maps signed integers to unsigned ones with small magnitudes staying small (0, -1, 1, -2 -> 0, 1, 2, 3).'''
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+def unzigzag(values):
+    '''Reverses zigzag().'''
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+def encode_varints(values):
+    '''Returns the LEB128 varint bytes of an array of unsigned 64-bit integers, all at once.'''
+    values = values.astype(np.uint64)
+    groups = (values[:, None] >> (np.arange(VARINT_GROUPS, dtype=np.uint64) * np.uint64(7))) & np.uint64(0x7f) #7-bit groups, low first
+    lengths = VARINT_GROUPS - np.argmax(groups[:, ::-1] != 0, axis=1) #bytes needed, up to the highest nonzero group
+    lengths[~groups.any(axis=1)] = 1 #0 is still one byte
+    used = np.arange(VARINT_GROUPS) < lengths[:, None]
+    continued = np.arange(VARINT_GROUPS) < (lengths - 1)[:, None] #every byte but the last sets the high bit
+    return (groups | (continued.astype(np.uint64) << np.uint64(7)))[used].astype(np.uint8).tobytes()
+
+def decode_varints(data):
+    '''Returns the unsigned integers in a run of LEB128 varint bytes, all at once.
+
+    Raises ValueError if the last varint is cut off or one is longer than a 64-bit integer.
+    '''
+    data = np.frombuffer(data, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.uint64)
+    if data[-1] >= 0x80:
+        raise ValueError('route is truncated')
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    if (ends - starts).max() >= VARINT_GROUPS:
+        raise ValueError('route is corrupt (varint too long)')
+    positions = np.arange(len(data)) - np.repeat(starts, ends - starts + 1) #byte number within its varint
+    parts = (data & 0x7f).astype(np.uint64) << (positions.astype(np.uint64) * np.uint64(7))
+    return np.add.reduceat(parts, starts)
+
+def parse_timestamp(value):
+    '''Returns a datetime from an ISO 8601 string (or datetime).'''
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+def encode_route(points):
+    '''Returns the binary encoding of a list of {"latitude", "longitude", "timestamp"} points.
+
+    Timestamps are kept to the microsecond for the first point and to the second after it;
+    either every point has one or none does. Raises ValueError (or KeyError/TypeError) if a
+    point is malformed.
+    '''
+    points = points or []
+    lats = np.round(np.array([float(point['latitude']) for point in points], dtype=np.float64) * COORDINATE_SCALE)
+    lons = np.round(np.array([float(point['longitude']) for point in points], dtype=np.float64) * COORDINATE_SCALE)
+    if not (np.all(np.abs(lats) <= 90 * COORDINATE_SCALE) and np.all(np.abs(lons) <= 180 * COORDINATE_SCALE)):
+        raise ValueError('latitude must be within ±90 and longitude within ±180')
+
+    flags = 0
+    start_us = 0
+    offset_minutes = 0
+    seconds = np.zeros(len(points), dtype=np.int64)
+    timestamps = [point.get('timestamp') for point in points]
+    if any(timestamps) and not all(timestamps):
+        raise ValueError('either every point or none must have a timestamp')
+    if points and all(timestamps):
+        flags |= HAS_TIMESTAMPS
+        times = [parse_timestamp(timestamp) for timestamp in timestamps]
+        start = times[0]
+        if start.tzinfo is None:
+            flags |= NAIVE_TIMESTAMPS
+            start_utc = start
+        else:
+            offset_minutes = int(start.utcoffset().total_seconds() // 60)
+            start_utc = start.astimezone(timezone.utc).replace(tzinfo=None)
+        start_us = (start_utc - EPOCH) // timedelta(microseconds=1)
+        seconds = np.array([round((time - start).total_seconds()) for time in times], dtype=np.int64) #mixing naive and aware raises TypeError
+
+    columns = np.stack([lats.astype(np.int64), lons.astype(np.int64), seconds], axis=1)
+    deltas = np.diff(columns, axis=0, prepend=np.zeros((1, 3), dtype=np.int64)) #the first point is its own change from 0
+    return HEADER.pack(FORMAT_VERSION, flags, len(points), start_us, offset_minutes) + encode_varints(zigzag(deltas.ravel()))
+
+def decode_arrays(data):
+    '''Returns (lats, lons, seconds) arrays of an encoded route, seconds being relative to the first point.
+
+    Raises ValueError if the route is truncated or corrupt.
+    '''
+    data = bytes(data or b'') #some databases hand back a memoryview
+    if not data:
+        return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+    if len(data) < HEADER.size:
+        raise ValueError('route is truncated')
+    version, flags, count, start_us, offset_minutes = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f'unknown route format {version}')
+    values = decode_varints(data[HEADER.size:])
+    if len(values) != count * 3:
+        raise ValueError(f'route is corrupt ({len(values)} values for {count} points)')
+    columns = np.cumsum(unzigzag(values).reshape(count, 3), axis=0)
+    lats, lons = columns[:, 0] / COORDINATE_SCALE, columns[:, 1] / COORDINATE_SCALE
+    if not (np.all(np.abs(lats) <= 90) and np.all(np.abs(lons) <= 180)):
+        raise ValueError('route is corrupt (coordinates out of range)')
+    return lats, lons, columns[:, 2]
+
+def decode_route(data, indexes=None):
+    '''Returns the list of {"latitude", "longitude", "timestamp"} points in an encoded route, timestamps as ISO strings.
+
+    If indexes is given, only the points at those indexes are returned. Raises ValueError if
+    the route is truncated or corrupt.
+    '''
+    data = bytes(data or b'')
+    if not data:
+        return []
+    lats, lons, seconds = decode_arrays(data)
+    if indexes is not None:
+        lats, lons, seconds = lats[indexes], lons[indexes], seconds[indexes]
+    _, flags, _, start_us, offset_minutes = HEADER.unpack_from(data)
+    timestamps = [None] * len(lats)
+    if flags & HAS_TIMESTAMPS:
+        try:
+            start = EPOCH + timedelta(microseconds=start_us)
+            if not flags & NAIVE_TIMESTAMPS:
+                offset = timezone(timedelta(minutes=offset_minutes))
+                start = start.replace(tzinfo=timezone.utc).astimezone(offset)
+            timestamps = [(start + timedelta(seconds=second)).isoformat() for second in seconds.tolist()]
+        except (OverflowError, ValueError):
+            raise ValueError('route is corrupt (timestamps out of range)')
+    return [
+        {'latitude': lat, 'longitude': lon, 'timestamp': timestamp}
+        for lat, lon, timestamp in zip(lats.tolist(), lons.tolist(), timestamps)
+    ]
+
+def route_length_km(data):
+    '''Returns the length in kilometers of an encoded route.'''
+    lats, lons, _ = decode_arrays(data)
+    return path_length_m(lats, lons, refine=True) / 1000
+
+def simplify(lats, lons, tolerance_m):
+    '''Returns the indexes of the points Douglas-Peucker keeps at a tolerance in meters, first and last included.
+
+    A point is dropped if it is within tolerance_m of the straight line between the points kept
+    on either side of it. Distances are measured on a flat projection around the route, which
+    is accurate to well under a percent over the few kilometers of a run.
+    '''
+    count = len(lats)
+    if count < 3:
+        return np.arange(count)
+    middle = np.radians(np.mean(lats))
+    y = np.radians(lats) * EARTH_RADIUS_M
+    x = np.radians(lons) * EARTH_RADIUS_M * np.cos(middle)
+    keep = np.zeros(count, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, count - 1)]
+    while stack: #a stack instead of recursion, long tracks would go too deep
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        length = np.hypot(dx, dy)
+        if length == 0: #a loop back to the start, measure from the point itself
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(dx * py - dy * px) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_m:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack += [(first, split), (split, last)]
+    return np.flatnonzero(keep)
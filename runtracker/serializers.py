@@ -4,6 +4,7 @@
 from rest_framework import serializers
 from .models import Run, UserProfile, Badge, Group, GroupMembership
 from django.contrib.auth import get_user_model
+from .routes import decode_route, encode_route, route_length_km
 
 class UserSerializer(serializers.ModelSerializer):
     """Serializer for User model"""
@@ -13,10 +14,29 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 
+class RouteField(serializers.Field):
+    """Shows a run's compact binary route as a list of {latitude, longitude, timestamp} points"""
+
+    def to_representation(self, value):
+        try:
+            return decode_route(value)
+        except ValueError: #a corrupt stored route, show the rest of the run
+            return None
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not all(isinstance(point, dict) for point in data):
+            raise serializers.ValidationError('Expected a list of points.')
+        try:
+            return encode_route(data)
+        except (KeyError, TypeError, ValueError):
+            raise serializers.ValidationError('Points need a latitude and longitude in range, and either all or none need ISO 8601 timestamps.')
+
+
 #serializer for Run model
 class RunSerializer(serializers.ModelSerializer):
     '''Serializer for Run model'''
     user = UserSerializer(read_only=True) #serializer for user field
+    route_data = RouteField(source='route') #stored encoded, see routes.py
 
     user_id = serializers.PrimaryKeyRelatedField(
         queryset=get_user_model().objects.all(),
@@ -27,6 +47,22 @@ class RunSerializer(serializers.ModelSerializer):
         model = Run
         fields = ['id', 'user', 'user_id', 'distance_km', 'duration_seconds', 'center_lon', 'center_lat', 'start_time', 'route_data']
         read_only_fields = ['start_time']
+        extra_kwargs = {'distance_km': {'required': False}}
+
+    def validate(self, attrs):
+        """Measure the route for the distance if the client didn't send one"""
+        if 'distance_km' not in attrs and self.instance is None:
+            attrs['distance_km'] = round(route_length_km(attrs.get('route')), 3)
+        return attrs
+
+class RunSummarySerializer(serializers.ModelSerializer):
+    '''Serializer for listing runs, without the route (fetch that from runs/<id>/route/)'''
+    user = UserSerializer(read_only=True)
+
+    class Meta:
+        model = Run
+        fields = ['id', 'user', 'distance_km', 'duration_seconds', 'center_lon', 'center_lat', 'start_time']
+        read_only_fields = fields
 
 class UserProfileSerializer(serializers.ModelSerializer):
     '''Serializer for UserProfile model'''
@@ -0,0 +1,90 @@
+## runtracker/spatial.py
+## Author: William Fugate wfugate@bu.edu
+## description: grid cell index on run centers, for finding nearby runs without reading every run
+import math
+from django.db.models import BigIntegerField, F, Q
+from django.db.models.functions import Cast, Floor, Greatest, Least, Mod
+
+#the world is split into square cells of this many degrees (about 1.1 km north to south),
+#numbered row by row from the south pole and the antimeridian
+GRID_CELL_DEGREES = 0.01
+GRID_ROWS = round(180 / GRID_CELL_DEGREES)
+GRID_COLUMNS = round(360 / GRID_CELL_DEGREES)
+
+#smallest radius of curvature of the WGS-84 ellipsoid (north-south, at the equator), so a
+#bounding box computed with it never cuts off a point that is really within the radius
+MIN_EARTH_RADIUS_METERS = 6335439
+
+def get_row(lat):
+    '''Returns the grid row a latitude falls in.'''
+    return min(max(math.floor((lat + 90) / GRID_CELL_DEGREES), 0), GRID_ROWS - 1)
+
+def get_column(lon):
+    '''Returns the grid column a longitude falls in (longitudes wrap around).'''
+    return math.floor((lon + 180) / GRID_CELL_DEGREES) % GRID_COLUMNS
+
+def get_cell(lat, lon):
+    '''Returns the number of the grid cell a point falls in.'''
+    return get_row(lat) * GRID_COLUMNS + get_column(lon)
+
+def get_cell_expression(lat_field, lon_field):
+    '''Returns a database expression computing get_cell() from two float fields (Run.grid_cell is generated from it).'''
+    row = Least(Greatest(Floor((F(lat_field) + 90.0) / GRID_CELL_DEGREES), 0), GRID_ROWS - 1)
+    column = Cast(Floor((F(lon_field) + 180.0) / GRID_CELL_DEGREES), BigIntegerField())
+    column = Mod(Mod(column, GRID_COLUMNS) + GRID_COLUMNS, GRID_COLUMNS) #SQL keeps the sign of a negative remainder, Python doesn't
+    return Cast(Cast(row, BigIntegerField()) * GRID_COLUMNS + column, BigIntegerField())
+
+def get_bounding_box(lat, lon, radius_m):
+    '''Returns (south, north, west, east) in degrees, bounding every point within radius_m of (lat, lon).
+
+    west is greater than east when the box crosses the antimeridian, and the box spans every
+    longitude (west=-180, east=180) when it reaches a pole.
+    '''
+    delta_lat = math.degrees(radius_m / MIN_EARTH_RADIUS_METERS)
+    south = max(lat - delta_lat, -90.0)
+    north = min(lat + delta_lat, 90.0)
+    widest = max(abs(south), abs(north)) #parallels are shortest farthest from the equator
+    if widest >= 90.0 or delta_lat >= 90.0:
+        return south, north, -180.0, 180.0
+    delta_lon = delta_lat / math.cos(math.radians(widest))
+    if delta_lon >= 180.0:
+        return south, north, -180.0, 180.0
+    west = (lon - delta_lon + 180.0) % 360.0 - 180.0
+    east = (lon + delta_lon + 180.0) % 360.0 - 180.0
+    return south, north, west, east
+
+def get_cell_ranges(south, north, west, east):
+    '''Returns the (first, last) runs of consecutive cell numbers covering a bounding box.
+
+    Each grid row the box covers is one or two runs of cells (two if it crosses the
+    antimeridian); rows covering every longitude are merged into one run.
+    '''
+    if west == -180.0 and east == 180.0:
+        return [(get_row(south) * GRID_COLUMNS, get_row(north) * GRID_COLUMNS + GRID_COLUMNS - 1)]
+    first_column, last_column = get_column(west), get_column(east)
+    if first_column <= last_column:
+        spans = [(first_column, last_column)]
+    else:
+        spans = [(0, last_column), (first_column, GRID_COLUMNS - 1)]
+    return [
+        (row * GRID_COLUMNS + first, row * GRID_COLUMNS + last)
+        for row in range(get_row(south), get_row(north) + 1) for first, last in spans
+    ]
+
+def within_box(lat, lon, radius_m):
+    '''Returns a filter selecting the runs whose centers are in the bounding box around (lat, lon).
+
+    The grid cell ranges are what the database looks up in the grid_cell index, so only the
+    runs in nearby cells are read; the exact bounds then drop those in the corners of the cells.
+    Exact distances still have to be checked on the results.
+    '''
+    south, north, west, east = get_bounding_box(lat, lon, radius_m)
+    cells = Q()
+    for first, last in get_cell_ranges(south, north, west, east):
+        cells |= Q(grid_cell__range=(first, last))
+    bounds = Q(center_lat__range=(south, north))
+    if west <= east:
+        bounds &= Q(center_lon__range=(west, east))
+    else:
+        bounds &= Q(center_lon__gte=west) | Q(center_lon__lte=east)
+    return cells & bounds
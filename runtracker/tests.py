@@ -1,3 +1,263 @@
-from django.test import TestCase
+## runtracker/tests.py
+## Author: William Fugate wfugate@bu.edu
+## description: tests for the runtracker nearby-runs search and distance math
+import json
+import random
+from datetime import datetime, timedelta
+import numpy as np
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from geopy.distance import geodesic
+from . import geo, routes, spatial
+from .models import Group, GroupMembership, Run
+from .serializers import RunSerializer
+from .nearby import DEFAULT_RADIUS_METERS
 
-# Create your tests here.
+class ProximitySearchTests(TestCase):
+    '''Checks the grid-indexed nearby search finds exactly the runs a full scan would.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        '''Creates runs clustered around a few places, including the antimeridian and near a pole.'''
+        cls.user = User.objects.create_user(username='runner', password='password')
+        rng = random.Random(412)
+        cls.runs = []
+        for lat, lon in [(42.35, -71.1), (0.0, 179.999), (-0.001, -179.999), (89.99, 10.0)]:
+            for _ in range(40):
+                cls.runs.append(Run.objects.create(
+                    user=cls.user, distance_km=5, center_lat=lat + rng.uniform(-0.008, 0.008),
+                    center_lon=(lon + rng.uniform(-0.008, 0.008) + 180) % 360 - 180,
+                ))
+
+    def test_matches_full_scan(self):
+        for target in self.runs[::7]:
+            distances = self.get_distances(target)
+            expected = [pk for pk, distance in distances if distance <= DEFAULT_RADIUS_METERS]
+            self.assertEqual(self.get_all_pages(target, limit=100), expected)
+
+    def get_distances(self, target):
+        '''Returns (pk, geodesic distance) of every other run, closest first.'''
+        distances = [
+            (run.pk, geodesic((target.center_lat, target.center_lon), (run.center_lat, run.center_lon)).meters)
+            for run in self.runs if run.pk != target.pk
+        ]
+        return sorted(distances, key=lambda pair: (pair[1], pair[0]))
+
+    def get_all_pages(self, target, **params):
+        '''Follows the nearby-runs cursors to the end, and returns the pks in order.'''
+        url = reverse('run-proximity', kwargs={'run_id': target.pk})
+        pks = []
+        while True:
+            page = self.client.get(url, params).json()
+            pks += [result['id'] for result in page['results']]
+            distances = [result['distance_from_center_m'] for result in page['results']]
+            self.assertEqual(distances, sorted(distances))
+            if not page['next_cursor']:
+                return pks
+            params['cursor'] = page['next_cursor']
+
+    def test_pages(self):
+        target = self.runs[0]
+        expected = [pk for pk, distance in self.get_distances(target) if distance <= 1500]
+        self.assertEqual(self.get_all_pages(target, radius=1500, limit=7), expected)
+
+    def test_k_nearest(self):
+        for target in self.runs[::20]:
+            response = self.client.get(reverse('run-proximity', kwargs={'run_id': target.pk}), {'k': 5})
+            self.assertEqual([result['id'] for result in response.json()['results']], [pk for pk, _ in self.get_distances(target)[:5]])
+
+    def test_unpaged(self):
+        target = self.runs[0]
+        url = reverse('run-proximity', kwargs={'run_id': target.pk})
+        distances = self.get_distances(target)
+        response = self.client.get(url).json() #the original shape: every run in the radius, as a list
+        self.assertEqual([result['id'] for result in response], [pk for pk, distance in distances if distance <= DEFAULT_RADIUS_METERS])
+        response = self.client.get(url, {'radius': 2000}).json()
+        self.assertEqual([result['id'] for result in response], [pk for pk, distance in distances if distance <= 2000])
+        self.assertGreater(len(response), 20) #not cut to a page
+        self.assertEqual(len(self.client.get(url, {'limit': 5}).json()['results']), 5)
+
+    def test_bad_parameters(self):
+        url = reverse('run-proximity', kwargs={'run_id': self.runs[0].pk})
+        for params in [{'radius': 'far'}, {'radius': -1}, {'radius': 10 ** 9}, {'limit': 0}, {'k': 'nan'}, {'cursor': 'x'}]:
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+
+    def test_grid_cell_follows_center(self):
+        run = self.runs[0]
+        cell = run.grid_cell
+        run.center_lat += 1
+        run.save(update_fields=['center_lat'])
+        run.refresh_from_db()
+        self.assertNotEqual(run.grid_cell, cell)
+
+    def test_grid_cell_bulk_writes(self):
+        rng = random.Random(21)
+        points = [(90, 180), (-90, -180), (89.999999, 179.999999), (42.35, -71.1), (0.01, -0.01), (0, 0)]
+        points += [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(200)]
+        runs = Run.objects.bulk_create([Run(user=self.user, distance_km=1, center_lat=lat, center_lon=lon) for lat, lon in points])
+        created = Run.objects.filter(pk__in=[run.pk for run in runs])
+        for run in created:
+            self.assertEqual(run.grid_cell, spatial.get_cell(run.center_lat, run.center_lon), (run.center_lat, run.center_lon))
+        created.update(center_lat=12.345, center_lon=-170.5)
+        self.assertEqual(set(created.values_list('grid_cell', flat=True)), {spatial.get_cell(12.345, -170.5)})
+
+    def test_distance_from_route(self):
+        route = [{'latitude': 42.35 + i * 0.001, 'longitude': -71.1, 'timestamp': ''} for i in range(11)]
+        serializer = RunSerializer(data={'user_id': self.user.pk, 'center_lat': 42.355, 'center_lon': -71.1, 'route_data': route})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertAlmostEqual(serializer.validated_data['distance_km'], geodesic((42.35, -71.1), (42.36, -71.1)).km, places=3)
+
+
+class DistanceAccuracyTests(SimpleTestCase):
+    '''Documents how far the vectorized distances in geo.py are from geopy's geodesic().
+
+    Haversine treats the earth as a sphere, so it is within HAVERSINE_ERROR (0.57%) of the
+    ellipsoidal distance: up to 0.56% long for north-south paths near the equator and 0.45%
+    short near the poles. Vincenty is within 1 mm, except for nearly antipodal points
+    (over 19,900 km apart) where it falls back to haversine.
+    '''
+
+    def setUp(self):
+        '''Makes pairs of points from a few meters to half the world apart.'''
+        rng = np.random.default_rng(412)
+        n = 3000
+        self.lat1 = rng.uniform(-89.9, 89.9, n)
+        self.lon1 = rng.uniform(-180, 180, n)
+        spread = rng.choice([0.0001, 0.01, 1, 90, 180], n)
+        self.lat2 = np.clip(self.lat1 + rng.uniform(-1, 1, n) * spread, -89.99, 89.99)
+        self.lon2 = (self.lon1 + rng.uniform(-1, 1, n) * spread * 2 + 180) % 360 - 180
+        self.expected = np.array([geodesic(a, b).meters for a, b in zip(zip(self.lat1, self.lon1), zip(self.lat2, self.lon2))])
+
+    def test_haversine(self):
+        distances = geo.haversine_m(self.lat1, self.lon1, self.lat2, self.lon2)
+        relative = np.abs(distances - self.expected) / self.expected
+        self.assertLess(relative.max(), geo.HAVERSINE_ERROR)
+
+    def test_vincenty(self):
+        distances = geo.vincenty_m(self.lat1, self.lon1, self.lat2, self.lon2)
+        converging = self.expected < 19900000
+        self.assertLess(np.abs(distances - self.expected)[converging].max(), 0.001)
+        self.assertLess((np.abs(distances - self.expected) / self.expected).max(), geo.HAVERSINE_ERROR)
+
+    def test_same_point(self):
+        self.assertEqual(geo.vincenty_m(42.35, -71.1, 42.35, -71.1), 0)
+        self.assertEqual(geo.haversine_m(42.35, -71.1, 42.35, -71.1), 0)
+
+    def test_within_radius(self):
+        rng = np.random.default_rng(7)
+        lats = 42.35 + rng.uniform(-0.01, 0.01, 2000)
+        lons = -71.1 + rng.uniform(-0.01, 0.01, 2000)
+        indexes, distances = geo.within_radius(42.35, -71.1, lats, lons, 500)
+        expected = [i for i in range(2000) if geodesic((42.35, -71.1), (lats[i], lons[i])).meters <= 500]
+        self.assertEqual(list(indexes), expected)
+        self.assertTrue((distances <= 500).all())
+
+    def test_route_length(self):
+        route = [{'latitude': 42.35 + i * 0.001, 'longitude': -71.1 + (i % 2) * 0.001} for i in range(50)]
+        expected = sum(geodesic((a['latitude'], a['longitude']), (b['latitude'], b['longitude'])).km for a, b in zip(route, route[1:]))
+        self.assertAlmostEqual(routes.route_length_km(routes.encode_route(route)), expected, places=6)
+        self.assertEqual(routes.route_length_km(routes.encode_route([])), 0)
+
+
+class RouteEncodingTests(SimpleTestCase):
+    '''Checks routes survive the compact encoding.'''
+
+    def test_round_trip(self):
+        rng = random.Random(412)
+        start = datetime(2026, 10, 1, 7, 30, 0, 123456)
+        lat, lon = 42.35, -71.1
+        route = []
+        for i in range(2000):
+            lat += rng.uniform(-3e-5, 3e-5)
+            lon += rng.uniform(-3e-5, 3e-5)
+            route.append({'latitude': lat, 'longitude': lon, 'timestamp': (start + timedelta(seconds=i * 2)).isoformat()})
+        encoded = routes.encode_route(route)
+        self.assertLess(len(encoded), len(json.dumps(route)) / 15)
+        decoded = routes.decode_route(encoded)
+        self.assertEqual([point['timestamp'] for point in decoded], [point['timestamp'] for point in route])
+        for original, point in zip(route, decoded):
+            self.assertAlmostEqual(point['latitude'], original['latitude'], places=7) #1e-7 degree fixed point
+            self.assertAlmostEqual(point['longitude'], original['longitude'], places=7)
+
+    def test_timestamps(self):
+        route = [
+            {'latitude': -33.9, 'longitude': 151.2, 'timestamp': '2026-10-01T07:30:00+10:00'},
+            {'latitude': -33.9, 'longitude': 151.3, 'timestamp': '2026-09-30T21:31:00Z'}, #same run, reported in UTC
+            {'latitude': 90, 'longitude': -180, 'timestamp': '2026-10-01T07:29:00+10:00'},
+        ]
+        decoded = routes.decode_route(routes.encode_route(route))
+        self.assertEqual([point['timestamp'] for point in decoded], ['2026-10-01T07:30:00+10:00', '2026-10-01T07:31:00+10:00', '2026-10-01T07:29:00+10:00'])
+        self.assertEqual(routes.decode_route(routes.encode_route([{'latitude': 1, 'longitude': 2}])), [{'latitude': 1, 'longitude': 2, 'timestamp': None}])
+        self.assertEqual(routes.decode_route(routes.encode_route([])), [])
+
+    def test_bad_points(self):
+        mixed = [{'latitude': 0, 'longitude': 0, 'timestamp': '2026-10-01T07:30:00'}, {'latitude': 0, 'longitude': 0}]
+        for route in [[{'latitude': 91, 'longitude': 0}], [{'latitude': 'north', 'longitude': 0}], [{'longitude': 0}], [{'latitude': 0, 'longitude': 0, 'timestamp': 'noon'}], mixed]:
+            serializer = RunSerializer(data={'center_lat': 0, 'center_lon': 0, 'route_data': route})
+            self.assertFalse(serializer.is_valid())
+            self.assertIn('route_data', serializer.errors)
+
+    def test_corrupt(self):
+        encoded = routes.encode_route([{'latitude': 42.35, 'longitude': -71.1}, {'latitude': 42.36, 'longitude': -71.1}])
+        header = routes.HEADER.size
+        for data in [
+            encoded[:header - 1], #cut off in the header
+            encoded[:-1], #cut off in the last varint
+            encoded[:-5], #the last point missing
+            encoded[:header] + b'\xff' * 11 + b'\x00', #a varint longer than 64 bits
+            routes.HEADER.pack(routes.FORMAT_VERSION, 0, 1, 0, 0) + routes.encode_varints(routes.zigzag(np.array([10 ** 10, 0, 0]))),
+            routes.HEADER.pack(routes.FORMAT_VERSION, routes.HAS_TIMESTAMPS, 1, 2 ** 62, 0) + b'\x00\x00\x00',
+        ]:
+            with self.assertRaises(ValueError):
+                routes.decode_route(data)
+
+
+class RouteEndpointTests(TestCase):
+    '''Checks runs are listed without their routes, and the route endpoint's simplification and ETags.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        '''Creates a group with a member who has a run along a long zig-zag track.'''
+        cls.user = User.objects.create_user(username='runner', password='password')
+        cls.group = Group.objects.create(name='Crew', description='', creator=cls.user)
+        GroupMembership.objects.create(group=cls.group, user=cls.user)
+        cls.route = [
+            {'latitude': 42.35 + i * 0.0001, 'longitude': -71.1 + (0.00001 if i % 2 else 0) + (0.01 if i == 500 else 0), 'timestamp': f'2026-10-01T07:{i // 60:02d}:{i % 60:02d}'}
+            for i in range(1000)
+        ]
+        cls.long_run = Run.objects.create(user=cls.user, distance_km=11, center_lat=42.4, center_lon=-71.1, route=routes.encode_route(cls.route))
+
+    def test_lists_leave_out_route(self):
+        response = self.client.get(reverse('group-runs', kwargs={'group_id': self.group.pk}))
+        self.assertEqual([run['id'] for run in response.json()], [self.long_run.pk])
+        self.assertNotIn('route_data', response.json()[0])
+        self.assertLess(len(response.content), 500)
+        self.assertEqual(len(self.client.get(reverse('run-detail', kwargs={'pk': self.long_run.pk})).json()['route_data']), 1000)
+
+    def test_simplified_route(self):
+        url = reverse('run-route', kwargs={'pk': self.long_run.pk})
+        full = self.client.get(url).json()
+        self.assertEqual(full['points'], routes.decode_route(routes.encode_route(self.route)))
+        simplified = self.client.get(url, {'tolerance': 5}).json()
+        self.assertEqual(simplified['total_points'], 1000)
+        #the 1 m wiggles go, the start, the 800 m detour at point 500 and the end stay
+        self.assertEqual([point['timestamp'] for point in simplified['points']], [self.route[i]['timestamp'] for i in (0, 499, 500, 501, 999)])
+        self.assertEqual(self.client.get(url, {'tolerance': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('run-route', kwargs={'pk': 0})).status_code, 404)
+
+    def test_corrupt_route(self):
+        run = Run.objects.create(user=self.user, distance_km=1, center_lat=42.4, center_lon=-71.1, route=routes.encode_route(self.route)[:-3])
+        response = self.client.get(reverse('run-route', kwargs={'pk': run.pk}))
+        self.assertEqual(response.status_code, 422)
+        self.assertIn("can't be read", response.json()['error'])
+        self.assertIsNone(self.client.get(reverse('run-detail', kwargs={'pk': run.pk})).json()['route_data'])
+
+    def test_etag(self):
+        url = reverse('run-route', kwargs={'pk': self.long_run.pk})
+        response = self.client.get(url, {'tolerance': 5})
+        self.assertEqual(self.client.get(url, {'tolerance': 5}, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200) #a different tolerance is a different body
+        for header in [f'W/{response["ETag"]}', f'"other", {response["ETag"]}', f'"other",W/{response["ETag"]}', '*']:
+            self.assertEqual(self.client.get(url, {'tolerance': 5}, HTTP_IF_NONE_MATCH=header).status_code, 304, header)
+        self.assertEqual(self.client.get(url, {'tolerance': 5}, HTTP_IF_NONE_MATCH='"other", W/"stale"').status_code, 200)
@@ -8,6 +8,7 @@ from .auth_views import login_view, register_view
 urlpatterns = [
     path('runs/', RunListCreateAPIView.as_view(), name='run-list-create'),
     path('runs/<int:pk>/', RunDetailAPIView.as_view(), name='run-detail'),
+    path('runs/<int:pk>/route/', RunRouteAPIView.as_view(), name='run-route'),
     path('profile/<int:user__id>/', UserProfileDetailAPIView.as_view(), name='profile-detail'),
     path('runs/<int:run_id>/nearby/', RunProximitySearchAPIView.as_view(), name='run-proximity'),
     path('profile/<int:user__id>/', UserProfileDetailAPIView.as_view(), name='profile-detail'),
@@ -1,19 +1,58 @@
 ## tracker/views.py
 ## Author: William Fugate wfugate@bu.edu
 ## description: views file for run tracker app
+import base64
+import binascii
+import hashlib
+import json
 from rest_framework import generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from geopy.distance import geodesic
 from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.utils.cache import parse_etags
 from django.contrib.auth import get_user_model
 
 from .models import Run, UserProfile, Group, GroupMembership, User, Badge
-from .serializers import RunSerializer, UserProfileSerializer, GroupSerializer, BadgeSerializer, GroupMembershipSerializer, UserSerializer
+from .nearby import DEFAULT_RADIUS_METERS, MAX_RADIUS_METERS, get_all, get_nearest, get_page
+from .routes import decode_arrays, decode_route, simplify
+from .serializers import RunSerializer, RunSummarySerializer, UserProfileSerializer, GroupSerializer, BadgeSerializer, GroupMembershipSerializer, UserSerializer
 
-PROXIMITY_THRESHOLD_METERS = 500
+DEFAULT_PAGE_SIZE = 20
+MAX_TOLERANCE_METERS = 1000
+MAX_RESULTS = 100
+
+def parse_bounded(value, kind, default, maximum):
+    """Returns a query parameter as a positive int or float no larger than maximum, or default if it's missing"""
+    if value in (None, ''):
+        return default
+    try:
+        number = kind(value)
+    except ValueError:
+        raise ValueError(f"'{value}' is not a number")
+    if not 0 < number <= maximum:
+        raise ValueError(f"{value} must be greater than 0 and at most {maximum}")
+    return number
+
+def etag_matches(etag, if_none_match):
+    """Returns whether an If-None-Match header matches the etag (weak comparison, so W/"..." matches too)"""
+    tags = parse_etags(if_none_match)
+    return '*' in tags or etag in [tag.removeprefix('W/') for tag in tags]
+
+def encode_cursor(pair):
+    """Returns an opaque cursor for the (distance, id) of the last run on a page"""
+    return base64.urlsafe_b64encode(json.dumps(pair).encode()).decode()
+
+def decode_cursor(cursor):
+    """Returns the (distance, id) in a cursor, or None if there is no cursor"""
+    if not cursor:
+        return None
+    try:
+        distance, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(distance), int(pk)
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError('invalid cursor')
 
 
 class UserListAPIView(generics.ListAPIView):
@@ -25,10 +64,16 @@ class RunListCreateAPIView(generics.ListCreateAPIView):
     """An API view to return a listing of Runs or create a new Run."""
     serializer_class = RunSerializer
     
+    def get_serializer_class(self):
+        """List summaries without routes, but take (and return) the route when creating a run"""
+        if self.request.method == 'GET':
+            return RunSummarySerializer
+        return RunSerializer
+
     def get_queryset(self):
         """Filter runs to only show the authenticated user's runs"""
         if self.request.user.is_authenticated:
-            runs = Run.objects.filter(user=self.request.user)
+            runs = Run.objects.filter(user=self.request.user).select_related('user').defer('route') #the route isn't listed
             return runs
         return Run.objects.none()
     
@@ -61,6 +106,38 @@ class RunDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = RunSerializer
 
 
+class RunRouteAPIView(APIView):
+    """An API view to get a run's GPS route, optionally simplified.
+
+    ?tolerance=<meters> drops the points within that distance of the line through their
+    neighbours (Douglas-Peucker), which is usually most of a track. The response has an ETag,
+    so a client that already has the route gets an empty 304 back.
+    """
+
+    def get(self, request, pk):
+        """Returns {"points": [...], "total_points": n} for the run's route."""
+        route = Run.objects.filter(pk=pk).values_list('route', flat=True).first()
+        if route is None:
+            return Response({"error": "Run not found"}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            tolerance = parse_bounded(request.query_params.get('tolerance'), float, None, MAX_TOLERANCE_METERS)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        route = bytes(route)
+        etag = '"%s"' % hashlib.sha1(route + repr(tolerance).encode()).hexdigest()
+        if etag_matches(etag, request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        try:
+            lats, lons, _ = decode_arrays(route)
+            indexes = simplify(lats, lons, tolerance) if tolerance else None
+            points = decode_route(route, indexes)
+        except ValueError as error:
+            return Response({"error": f"The stored route can't be read: {error}"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return Response({"points": points, "total_points": len(lats)}, headers={'ETag': etag})
+
+
 class UserProfileDetailAPIView(generics.RetrieveAPIView):
     """An API view to retrieve a user's Profile stats."""
     queryset = UserProfile.objects.all()
@@ -69,41 +146,63 @@ class UserProfileDetailAPIView(generics.RetrieveAPIView):
 
 
 class RunProximitySearchAPIView(APIView):
-    """An API view to find runs within proximity of a target run's center."""
+    """An API view to find runs within proximity of a target run's center.
+
+    Query parameters:
+      radius - search radius in meters (default 500, at most 50 km)
+      limit  - runs per page (default 20, at most 100)
+      cursor - the next_cursor of the previous page
+      k      - return just the k closest runs instead of pages (at most 100)
+    Runs come back closest first, as {"results": [...], "next_cursor": ...}. Without limit,
+    cursor or k, every run within the radius comes back as a plain list, as this view always did.
+    """
 
     def get(self, request, run_id):
         """Finds runs whose geographic center is within the specified distance of the target run's center."""
         try:
-            target_run = Run.objects.get(pk=run_id)
+            target_run = Run.objects.only('center_lat', 'center_lon').get(pk=run_id) #not the route
         except Run.DoesNotExist:
             return Response(
                 {"error": "Run not found"}, 
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        target_center = (target_run.center_lat, target_run.center_lon)
-        
-        #get all other runs to compare
-        candidate_runs = Run.objects.exclude(pk=run_id).select_related('user')
-        nearby_runs_data = []
-
-        #compare
-        for candidate in candidate_runs:
-            candidate_center = (candidate.center_lat, candidate.center_lon)
-            
-            #calculate distance between centers
-            distance = geodesic(target_center, candidate_center).meters
-            
-            if distance <= PROXIMITY_THRESHOLD_METERS: #configurable currently 500 meters
-                nearby_runs_data.append({
-                    "id": candidate.id,
-                    "user": candidate.user.username,
-                    "distance_from_center_m": round(distance, 2),
-                    "run_distance": candidate.distance_km,
-                    "run_time": candidate.duration_seconds,
-                })
-
-        return Response(nearby_runs_data)
+        try:
+            k = parse_bounded(request.query_params.get('k'), int, None, MAX_RESULTS)
+            radius = parse_bounded(request.query_params.get('radius'), float, DEFAULT_RADIUS_METERS if k is None else MAX_RADIUS_METERS, MAX_RADIUS_METERS)
+            limit = parse_bounded(request.query_params.get('limit'), int, DEFAULT_PAGE_SIZE, MAX_RESULTS)
+            after = decode_cursor(request.query_params.get('cursor'))
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        center = (target_run.center_lat, target_run.center_lon)
+        paged = any(request.query_params.get(name) for name in ('k', 'limit', 'cursor'))
+        if not paged:
+            page, has_next = get_all(*center, radius, exclude_pk=run_id), False
+        elif k is not None:
+            page, has_next = get_nearest(*center, k, radius, exclude_pk=run_id), False
+        else:
+            page, has_next = get_page(*center, radius, limit, after, exclude_pk=run_id)
+
+        #details only for the runs on this page
+        details = Run.objects.filter(pk__in=[pk for _, pk in page]).values('id', 'user__username', 'distance_km', 'duration_seconds')
+        details = {row['id']: row for row in details}
+        nearby_runs_data = [
+            {
+                "id": pk,
+                "user": details[pk]['user__username'],
+                "distance_from_center_m": round(distance, 2),
+                "run_distance": details[pk]['distance_km'],
+                "run_time": details[pk]['duration_seconds'],
+            }
+            for distance, pk in page if pk in details #skip a run deleted in between
+        ]
+        if not paged:
+            return Response(nearby_runs_data)
+        return Response({
+            "results": nearby_runs_data,
+            "next_cursor": encode_cursor(page[-1]) if has_next else None,
+        })
     
 
 class GroupRemoveMemberAPIView(APIView):
@@ -180,7 +279,7 @@ class GroupListCreateAPIView(generics.ListCreateAPIView):
 
 class GroupRunsAPIView(generics.ListAPIView):
     """Get all runs for members of a group"""
-    serializer_class = RunSerializer
+    serializer_class = RunSummarySerializer
     
     def get_queryset(self):
         group_id = self.kwargs['group_id']
@@ -189,7 +288,7 @@ class GroupRunsAPIView(generics.ListAPIView):
         member_ids = group.memberships.values_list('user_id', flat=True)
         
         #get up to last 10 runs per person
-        return Run.objects.filter(user_id__in=member_ids).order_by('-start_time')[:10]
+        return Run.objects.filter(user_id__in=member_ids).select_related('user').defer('route').order_by('-start_time')[:10]
 
 class GroupDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     """View to retrieve, update, or delete a group"""
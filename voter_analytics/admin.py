@@ -2,6 +2,24 @@
 ## Author: William Fugate wfugate@bu.edu
 ## description: admin registration of models for voter_analytics
 from django.contrib import admin
-from .models import Voter
+from .models import Voter, PrecinctSummary
+from .summary import refresh_precinct_summary
 
-admin.site.register(Voter) 
\ No newline at end of file
+class VoterAdmin(admin.ModelAdmin):
+    '''Refreshes the precinct summaries an edit touches, since saving a single Voter doesn't.'''
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        refresh_precinct_summary({obj.precinct_number, form.initial.get('precinct_number', obj.precinct_number)}) #the voter may have moved precincts
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_precinct_summary([obj.precinct_number])
+
+    def delete_queryset(self, request, queryset):
+        precincts = set(queryset.values_list('precinct_number', flat=True))
+        super().delete_queryset(request, queryset)
+        refresh_precinct_summary(precincts)
+
+admin.site.register(Voter, VoterAdmin)
+admin.site.register(PrecinctSummary)
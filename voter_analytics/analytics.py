@@ -0,0 +1,170 @@
+## voter_analytics/analytics.py
+## Author: William Fugate wfugate@bu.edu
+## description: columnar in-memory snapshot of the Voter table for fast cross-tab counts
+import threading
+import time
+import numpy as np
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .filters import ELECTIONS
+from .models import Voter
+from .signals import voters_changed
+
+SNAPSHOT_VERSION_KEY = 'voter_analytics:snapshot_version'
+
+#dimensions that can be grouped by, besides the five elections
+DIMENSIONS = ['party', 'precinct', 'birth_year', 'decade', 'score'] + ELECTIONS
+
+class VoterSnapshot:
+    '''Read-only, columnar copy of the Voter table.
+
+    Party and precinct are dictionary encoded as small integer codes, birth year is int16,
+    and the five election flags are packed into one bitmask byte (bit i is ELECTIONS[i]),
+    so filter + group-by + count queries are a few vectorized NumPy operations.
+    '''
+
+    def __init__(self, party_codes, party_labels, precinct_codes, precinct_labels, birth_years, scores, elections):
+        self.party_codes = party_codes
+        self.party_labels = party_labels
+        self.precinct_codes = precinct_codes
+        self.precinct_labels = precinct_labels
+        self.birth_years = birth_years
+        self.scores = scores
+        self.elections = elections
+
+    def __len__(self):
+        return len(self.birth_years)
+
+    @classmethod
+    def build(cls):
+        '''Reads the Voter table once, column by column, into a new snapshot.'''
+        parties = {}
+        precincts = {}
+        party_codes = []
+        precinct_codes = []
+        birth_years = []
+        scores = []
+        elections = []
+        rows = Voter.objects.values_list('party_affiliation', 'precinct_number', 'date_of_birth', 'voter_score', *ELECTIONS)
+        for party, precinct, date_of_birth, score, *voted in rows.order_by().iterator(chunk_size=5000):
+            party_codes.append(parties.setdefault(party.strip(), len(parties))) #assign codes in order of first appearance
+            precinct_codes.append(precincts.setdefault(precinct.strip(), len(precincts)))
+            birth_years.append(date_of_birth.year)
+            scores.append(score)
+            bits = 0
+            for i, flag in enumerate(voted):
+                if flag:
+                    bits |= 1 << i
+            elections.append(bits)
+
+        return cls(
+            party_codes=np.array(party_codes, dtype=np.int16),
+            party_labels=list(parties),
+            precinct_codes=np.array(precinct_codes, dtype=np.int16),
+            precinct_labels=list(precincts),
+            birth_years=np.array(birth_years, dtype=np.int16),
+            scores=np.array(scores, dtype=np.int8),
+            elections=np.array(elections, dtype=np.uint8),
+        )
+
+    def mask(self, voter_filter):
+        '''Returns a boolean array selecting the voters that match a VoterFilter.'''
+        mask = np.ones(len(self), dtype=bool)
+        lookups = voter_filter.get_lookups() #same validated values the database queries use
+        if voter_filter.party:
+            if voter_filter.party not in self.party_labels:
+                return np.zeros(len(self), dtype=bool)
+            mask &= self.party_codes == self.party_labels.index(voter_filter.party)
+        if 'date_of_birth__gte' in lookups:
+            mask &= self.birth_years >= lookups['date_of_birth__gte'].year
+        if 'date_of_birth__lte' in lookups:
+            mask &= self.birth_years <= lookups['date_of_birth__lte'].year
+        if voter_filter.voter_score is not None:
+            mask &= self.scores == voter_filter.voter_score
+        required = 0
+        for field in voter_filter.elections:
+            required |= 1 << ELECTIONS.index(field)
+        if required:
+            mask &= (self.elections & required) == required #voted in every checked election
+        return mask
+
+    def get_dimension(self, name):
+        '''Returns (codes, labels) for a dimension, where codes index into labels.'''
+        if name == 'party':
+            return self.party_codes, self.party_labels
+        if name == 'precinct':
+            return self.precinct_codes, self.precinct_labels
+        if name == 'score':
+            low = int(self.scores.min()) if len(self) else 0
+            high = int(self.scores.max()) if len(self) else -1
+            return self.scores - low, list(range(low, high + 1))
+        if name in ('birth_year', 'decade'):
+            years = self.birth_years.astype(np.int32)
+            if name == 'decade':
+                years = years // 10 * 10
+            step = 10 if name == 'decade' else 1
+            low = int(years.min()) if len(self) else 0
+            high = int(years.max()) if len(self) else low - step
+            return (years - low) // step, list(range(low, high + 1, step))
+        if name in ELECTIONS:
+            return (self.elections >> ELECTIONS.index(name)) & 1, [False, True]
+        raise ValueError(f"unknown dimension '{name}', expected one of {', '.join(DIMENSIONS)}")
+
+    def count_by(self, dimensions, mask=None):
+        '''Counts the (masked) voters grouped by one or more dimensions.
+
+        Returns (labels, counts) where labels has one label list per dimension and counts is an
+        ndarray with one axis per dimension.
+        '''
+        codes = []
+        labels = []
+        for name in dimensions:
+            dimension_codes, dimension_labels = self.get_dimension(name)
+            codes.append(dimension_codes.astype(np.int64))
+            labels.append(dimension_labels)
+        shape = tuple(len(l) for l in labels)
+
+        combined = np.zeros(len(self), dtype=np.int64) #row-major cell number of each voter
+        for dimension_codes, size in zip(codes, shape):
+            combined = combined * size + dimension_codes
+        if mask is not None:
+            combined = combined[mask]
+        counts = np.bincount(combined, minlength=int(np.prod(shape))).reshape(shape)
+        return labels, counts
+
+    def election_counts(self, mask=None):
+        '''Counts how many of the (masked) voters voted in each election.'''
+        elections = self.elections if mask is None else self.elections[mask]
+        return {field: int(np.count_nonzero(elections & (1 << i))) for i, field in enumerate(ELECTIONS)}
+
+
+_snapshot = None
+_snapshot_version = None
+_snapshot_lock = threading.Lock()
+
+def get_snapshot_version():
+    '''Returns the current data version; the snapshot is rebuilt whenever it changes.'''
+    version = cache.get(SNAPSHOT_VERSION_KEY)
+    if version is None:
+        version = str(time.time_ns())
+        cache.set(SNAPSHOT_VERSION_KEY, version, timeout=None)
+    return version
+
+def get_snapshot():
+    '''Returns this process's snapshot of the Voter table, rebuilding it if the data has changed.'''
+    global _snapshot, _snapshot_version
+    version = get_snapshot_version()
+    if _snapshot is None or _snapshot_version != version:
+        with _snapshot_lock: #only one thread rebuilds, the others wait and reuse it
+            if _snapshot is None or _snapshot_version != version:
+                _snapshot = VoterSnapshot.build()
+                _snapshot_version = version
+    return _snapshot
+
+@receiver(voters_changed)
+@receiver(post_save, sender=Voter)
+@receiver(post_delete, sender=Voter)
+def invalidate_snapshot(**kwargs):
+    '''Marks every process's snapshot as stale when the voter data changes.'''
+    cache.set(SNAPSHOT_VERSION_KEY, str(time.time_ns()), timeout=None)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class VoterAnalyticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'voter_analytics'
+
+    def ready(self):
+        '''Connects the cache invalidation, precinct summary and search index receivers.'''
+        from . import metadata, charts, analytics, summary, fts
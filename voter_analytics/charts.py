@@ -0,0 +1,39 @@
+## voter_analytics/charts.py
+## Author: William Fugate wfugate@bu.edu
+## description: cache for the rendered GraphsView chart fragments
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Voter
+from .signals import voters_changed
+
+CHARTS_VERSION_KEY = 'voter_analytics:charts_version'
+
+#how long (in seconds) a rendered set of charts is kept, even without a data reload
+CHART_CACHE_TIMEOUT = getattr(settings, 'VOTER_CHART_CACHE_TIMEOUT', 60 * 60)
+
+def get_charts_version():
+    '''Returns the current chart version; every chart key includes it so bumping it invalidates them all.'''
+    version = cache.get(CHARTS_VERSION_KEY)
+    if version is None:
+        version = str(time.time_ns()) #never reuse an old version if the key was evicted
+        cache.set(CHARTS_VERSION_KEY, version, timeout=None)
+    return version
+
+def get_charts(voter_filter, build_charts):
+    '''Returns the chart fragments for a filter, calling build_charts() only on a cache miss.'''
+    key = f'voter_analytics:charts:{get_charts_version()}:{voter_filter.get_cache_key()}'
+    charts = cache.get(key)
+    if charts is None:
+        charts = build_charts()
+        cache.set(key, charts, timeout=CHART_CACHE_TIMEOUT)
+    return charts
+
+@receiver(voters_changed)
+@receiver(post_save, sender=Voter)
+@receiver(post_delete, sender=Voter)
+def invalidate_charts(**kwargs):
+    '''Starts a new chart version whenever the voter data changes; old entries expire on their own.'''
+    cache.set(CHARTS_VERSION_KEY, str(time.time_ns()), timeout=None)
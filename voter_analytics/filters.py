@@ -0,0 +1,53 @@
+## voter_analytics/filters.py
+## Author: William Fugate wfugate@bu.edu
+## description: shared search filter logic for the voter_analytics views
+import hashlib
+from datetime import date
+
+ELECTIONS = ['v20state', 'v21town', 'v21primary', 'v22general', 'v23town']
+
+def parse_int(value):
+    '''Returns value as an int, or None if it is missing or not a number.'''
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+class VoterFilter:
+    '''Reads the voter search parameters from a GET request and applies them to a Voter queryset.
+
+    Birth year bounds are turned into plain date ranges on date_of_birth so they can be
+    answered from the date_of_birth indexes instead of extracting the year from every row.
+    '''
+
+    def __init__(self, params):
+        '''Parses the search parameters (will be empty if not present).'''
+        self.party = (params.get('party_affiliation') or '').strip()
+        self.min_year = parse_int(params.get('min_birth_year'))
+        self.max_year = parse_int(params.get('max_birth_year'))
+        self.voter_score = parse_int(params.get('voter_score'))
+        self.elections = [field for field in ELECTIONS if params.get(field)] #checked election boxes
+
+    def get_lookups(self):
+        '''Returns the filter keyword arguments for the parameters that were given.'''
+        lookups = {}
+        if self.party:
+            lookups['party_affiliation'] = self.party
+        if self.min_year is not None and 1 <= self.min_year <= 9999:
+            lookups['date_of_birth__gte'] = date(self.min_year, 1, 1) #born during or after min_year
+        if self.max_year is not None and 1 <= self.max_year <= 9999:
+            lookups['date_of_birth__lte'] = date(self.max_year, 12, 31) #born during or before max_year
+        if self.voter_score is not None:
+            lookups['voter_score'] = self.voter_score
+        for field in self.elections:
+            lookups[f'{field}__in'] = [True] #field=True compiles to a bare column test on SQLite, and the partial voter_<election>_voted_idx indexes are conditioned on this exact IN (1)
+        return lookups
+
+    def filter(self, queryset):
+        '''Applies the search parameters to the given Voter queryset.'''
+        return queryset.filter(**self.get_lookups())
+
+    def get_cache_key(self):
+        '''Returns a key that is the same for any two requests with the same effective filters.'''
+        normalized = repr(sorted(self.get_lookups().items())) #ignores parameter order, blanks and bad values
+        return hashlib.sha1(normalized.encode()).hexdigest()
@@ -0,0 +1,131 @@
+## voter_analytics/fts.py
+## Author: William Fugate wfugate@bu.edu
+## description: SQLite FTS5 name and address search index for voters
+import difflib
+import re
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Voter
+from .signals import voters_changed
+
+#word index with prefix indexes for 2 and 3 letter prefixes, for type-ahead matching
+WORD_TABLE = 'voter_analytics_voter_fts'
+#the distinct words in the index, which misspelled words are corrected against
+VOCAB_TABLE = 'voter_analytics_voter_fts_vocab'
+
+#how many close spellings a misspelled word is expanded to, and how close they must be
+FUZZY_SPELLINGS = 3
+FUZZY_CUTOFF = 0.75
+#a close spelling starts with the same letter and is at most this many letters longer or shorter
+FUZZY_LENGTH_DIFFERENCE = 2
+
+CREATE_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {WORD_TABLE} USING fts5("
+    "last_name, first_name, street_name, zip, prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {VOCAB_TABLE} USING fts5vocab({WORD_TABLE}, 'row')",
+]
+
+DROP_SQL = [f"DROP TABLE IF EXISTS {VOCAB_TABLE}", f"DROP TABLE IF EXISTS {WORD_TABLE}"]
+
+def is_supported():
+    '''Returns whether the database can hold the index (FTS5 is SQLite only).'''
+    return connection.vendor == 'sqlite'
+
+def sync_voter_index(pks=None):
+    '''Brings the search index up to date for the given voter pks, or rebuilds it entirely if pks is None.
+
+    Each row's rowid is the voter's pk, so syncing a voter is a delete plus an insert of
+    that one row; the Voter table is never rescanned for a partial sync.
+    '''
+    if not is_supported():
+        return
+    if pks is not None:
+        pks = list(pks)
+        if not pks:
+            return
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if pks is None:
+            cursor.execute(f"DELETE FROM {WORD_TABLE}")
+            index_rows(cursor, '', [])
+        else:
+            for i in range(0, len(pks), 500): #stay under SQLite's variable limit
+                chunk = pks[i:i + 500]
+                placeholders = ', '.join(['%s'] * len(chunk))
+                cursor.execute(f"DELETE FROM {WORD_TABLE} WHERE rowid IN ({placeholders})", chunk)
+                index_rows(cursor, f"WHERE id IN ({placeholders})", chunk) #deleted voters aren't found, so they stay out
+
+def index_rows(cursor, where, params):
+    '''Copies the selected voters' names and addresses into the index.'''
+    cursor.execute(
+        f"INSERT INTO {WORD_TABLE} (rowid, last_name, first_name, street_name, zip) "
+        f"SELECT id, last_name, first_name, residence_address_street_name, residence_address_zip "
+        f"FROM voter_analytics_voter {where}", params)
+
+def get_terms(query):
+    '''Splits a search string into lowercase words, dropping FTS5 syntax characters.'''
+    return re.findall(r'\w+', query.lower())
+
+def match_pks(match, limit, exclude=()):
+    '''Returns the pks of up to limit voters matching an FTS5 query, skipping those in exclude.'''
+    if limit <= 0: #SQLite reads a negative LIMIT as no limit
+        return []
+    with connection.cursor() as cursor:
+        #no ORDER BY rank: scoring every match costs more than the search itself on common names,
+        #and LIMIT lets SQLite stop at the first matches
+        cursor.execute(f"SELECT rowid FROM {WORD_TABLE} WHERE {WORD_TABLE} MATCH %s LIMIT %s", [match, limit + len(exclude)])
+        return [row[0] for row in cursor.fetchall() if row[0] not in exclude][:limit]
+
+def search_voters(query, limit=20, fuzzy=False):
+    '''Returns up to limit Voters matching every word of the query, best matches first.
+
+    Voters matching the words exactly come first, then those where each word is the start of
+    a name, street or zip ("smi wal" finds Smith on Walnut St). With fuzzy set, or if nothing
+    matches, misspelled words are swapped for close spellings from the index ("smiht" finds Smith).
+    '''
+    terms = get_terms(query)
+    if not terms or limit <= 0 or not is_supported():
+        return []
+
+    pks = match_pks(' '.join(f'"{term}"' for term in terms), limit) #whole words
+    if len(pks) < limit:
+        pks += match_pks(' '.join(f'"{term}"*' for term in terms), limit - len(pks), exclude=set(pks)) #then prefixes
+    if (fuzzy or not pks) and len(pks) < limit:
+        pks += match_pks(get_fuzzy_match(terms), limit - len(pks), exclude=set(pks)) #then close spellings
+
+    voters = Voter.objects.in_bulk(pks)
+    return [voters[pk] for pk in pks if pk in voters] #keep the ranked order
+
+def get_fuzzy_match(terms):
+    '''Returns an FTS5 query matching every term, each either as a prefix or as one of its closest spellings.'''
+    groups = []
+    with connection.cursor() as cursor:
+        for term in terms:
+            spellings = difflib.get_close_matches(term, get_spelling_candidates(cursor, term), n=FUZZY_SPELLINGS, cutoff=FUZZY_CUTOFF)
+            options = [f'"{term}"*'] + [f'"{word}"' for word in spellings if word != term]
+            groups.append('(' + ' OR '.join(options) + ')')
+    return ' AND '.join(groups)
+
+def get_spelling_candidates(cursor, term):
+    '''Returns the words in the index that could be a close spelling of term.
+
+    Only words starting with the same letter and of about the same length are compared.
+    fts5vocab reads a range of terms straight from the index, so this is a few hundred words
+    out of the whole roll's vocabulary, instead of scanning all of it in Python.
+    '''
+    cursor.execute(
+        f"SELECT term FROM {VOCAB_TABLE} WHERE term >= %s AND term < %s AND length(term) BETWEEN %s AND %s",
+        [term[0], chr(ord(term[0]) + 1), len(term) - FUZZY_LENGTH_DIFFERENCE, len(term) + FUZZY_LENGTH_DIFFERENCE])
+    return [row[0] for row in cursor.fetchall()]
+
+@receiver(voters_changed)
+def sync_changed_voters(pks=None, **kwargs):
+    '''Re-indexes the voters the loader touched.'''
+    sync_voter_index(pks)
+
+@receiver(post_save, sender=Voter)
+@receiver(post_delete, sender=Voter)
+def sync_single_voter(instance, **kwargs):
+    '''Re-indexes a single saved or deleted voter.'''
+    sync_voter_index([instance.pk])
@@ -0,0 +1,88 @@
+## voter_analytics/management/commands/explain_voter_filters.py
+## Author: William Fugate wfugate@bu.edu
+## description: benchmark showing the query plans of the voter search filters with and without the filter indexes
+## Run with: python manage.py explain_voter_filters [--rows 200000]
+
+import random
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from voter_analytics.models import Voter
+from voter_analytics.filters import VoterFilter
+
+#common search form combinations to benchmark
+CASES = [
+    ('party', {'party_affiliation': 'R'}),
+    ('party + birth years', {'party_affiliation': 'R', 'min_birth_year': '1960', 'max_birth_year': '1965'}),
+    ('birth years', {'min_birth_year': '1990', 'max_birth_year': '1991'}),
+    ('voter score', {'voter_score': '5'}),
+    ('voter score + birth years', {'voter_score': '5', 'min_birth_year': '1940', 'max_birth_year': '1950'}),
+    ('one election', {'v22general': 'on'}),
+    ('elections', {'v23town': 'on', 'v21town': 'on'}),
+    ('party + election', {'party_affiliation': 'R', 'v21primary': 'on'}),
+    ('all elections', {'v20state': 'on', 'v21town': 'on', 'v21primary': 'on', 'v22general': 'on', 'v23town': 'on'}),
+]
+
+class Command(BaseCommand):
+    help = 'Loads a synthetic voter table and prints EXPLAIN plans for the search filters with and without indexes (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200000, help='number of synthetic voters to insert (default 200000)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic(): #everything below, including the dropped indexes, is rolled back
+            self.stdout.write(f"Inserting {options['rows']} synthetic voters...")
+            self.make_voters(options['rows'])
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE') #give the planner real statistics
+
+            self.stdout.write(self.style.SUCCESS('\nWith filter indexes'))
+            self.explain_all('indexed')
+
+            with connection.cursor() as cursor:
+                for index in Voter._meta.indexes:
+                    cursor.execute(f'DROP INDEX "{index.name}"')
+            self.stdout.write(self.style.SUCCESS('\nWithout filter indexes'))
+            self.explain_all('unindexed')
+
+            transaction.set_rollback(True)
+
+    def make_voters(self, rows):
+        '''Bulk inserts rows random voters with a realistic spread of parties, ages and scores.'''
+        parties = ['D'] * 30 + ['U'] * 55 + ['R'] * 12 + ['L', 'J', 'G'] #mostly unenrolled and democrat, like Newton
+        start = date(1920, 1, 1)
+        voters = []
+        for i in range(rows):
+            flags = [random.random() < p for p in (0.8, 0.25, 0.3, 0.6, 0.2)]
+            voters.append(Voter(
+                last_name=f'Last{i % 5000}', first_name=f'First{i % 700}',
+                residence_address_street_number=str(i % 400), residence_address_street_name='Main St',
+                residence_address_apt_number='', residence_address_zip='02459',
+                date_of_birth=start + timedelta(days=random.randint(0, 30000)),
+                date_of_registration=date(2010, 1, 1),
+                party_affiliation=random.choice(parties), precinct_number=str(i % 32),
+                v20state=flags[0], v21town=flags[1], v21primary=flags[2], v22general=flags[3], v23town=flags[4],
+                voter_score=sum(flags),
+            ))
+            if len(voters) == 5000:
+                Voter.objects.bulk_create(voters)
+                voters = []
+        Voter.objects.bulk_create(voters)
+
+    def explain_all(self, tag):
+        '''Prints the plan and COUNT timing for each benchmark filter.'''
+        for label, params in CASES:
+            queryset = VoterFilter(params).filter(Voter.objects.all())
+            start = time.perf_counter()
+            count = queryset.count()
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stdout.write(f'{label}: {count} voters, {elapsed:.1f} ms')
+
+            #sqlite3 caches prepared statements by their SQL text and EXPLAIN output is fixed when prepared,
+            #so tag the statement to get a fresh plan after the indexes are dropped
+            sql, sql_params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql} -- {tag}', sql_params)
+                for row in cursor.fetchall():
+                    self.stdout.write(f'    {row[-1]}')
@@ -0,0 +1,57 @@
+## voter_analytics/management/commands/load_voters.py
+## Author: William Fugate wfugate@bu.edu
+## description: management command to bulk load the voter CSV into the Voter table
+## Run with: python manage.py load_voters <path to csv> [--sync [--delete-missing]]
+
+from django.core.management.base import BaseCommand, CommandError
+from voter_analytics.models import load_data, sync_data
+
+
+class Command(BaseCommand):
+    help = 'Streams a voter CSV file into the Voter table using batched bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='path to the voter CSV file')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='number of rows written per transaction (default 10000, or 1000 with --sync)')
+        parser.add_argument('--rejects', default=None,
+                            help='file to write rejected rows to (default <path>.rejects.csv)')
+        parser.add_argument('--sync', action='store_true',
+                            help='incrementally sync an existing table keyed on voter ID instead of a full load')
+        parser.add_argument('--delete-missing', action='store_true',
+                            help='with --sync, delete voters that are no longer in the file')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        batch_options = {'batch_size': options['batch_size']} if options['batch_size'] else {} #else each function's own default
+        rejects = options['rejects'] or f'{path}.rejects.csv'
+
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['delete_missing'] and not options['sync']:
+            raise CommandError('--delete-missing can only be used with --sync')
+
+        try:
+            if options['sync']:
+                self.stdout.write(f'Syncing voters from {path}...')
+                stats = sync_data(path, rejects_filename=rejects, **batch_options,
+                                  delete_missing=options['delete_missing'])
+            else:
+                self.stdout.write(f'Loading voters from {path}...')
+                stats = load_data(path, rejects_filename=rejects, **batch_options)
+        except FileNotFoundError:
+            raise CommandError(f'File not found: {path}')
+
+        if options['sync']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Inserted {stats['inserted']}, updated {stats['updated']}, deleted {stats['deleted']} "
+                f"({stats['unchanged']} unchanged) in {stats['seconds']:.2f}s"
+            ))
+        else:
+            rate = stats['loaded'] / stats['seconds'] if stats['seconds'] else 0
+            self.stdout.write(self.style.SUCCESS(
+                f"Loaded {stats['loaded']} voters in {stats['seconds']:.2f}s ({rate:,.0f} rows/sec)"
+            ))
+        if stats['rejected']:
+            self.stdout.write(self.style.WARNING(f"Rejected {stats['rejected']} rows, see {rejects}"))
+
@@ -0,0 +1,21 @@
+## voter_analytics/management/commands/refresh_precinct_summary.py
+## Author: William Fugate wfugate@bu.edu
+## description: management command to rebuild the PrecinctSummary table
+## Run with: python manage.py refresh_precinct_summary [--precinct 1A --precinct 2B]
+
+from django.core.management.base import BaseCommand
+from voter_analytics.summary import refresh_precinct_summary
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the precinct turnout summary from the Voter table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--precinct', action='append', dest='precincts',
+                            help='only refresh this precinct (can be given more than once)')
+
+    def handle(self, *args, **options):
+        precincts = options['precincts']
+        rows = refresh_precinct_summary(precincts)
+        which = ', '.join(precincts) if precincts else 'all precincts'
+        self.stdout.write(self.style.SUCCESS(f'Wrote {rows} summary rows for {which}'))
@@ -0,0 +1,57 @@
+## voter_analytics/metadata.py
+## Author: William Fugate wfugate@bu.edu
+## description: cached search dropdown metadata (parties, birth years, voter scores) for the voter pages
+from django.core.cache import cache
+from django.db.models import Max, Min
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Voter
+from .signals import voters_changed
+
+METADATA_CACHE_KEY = 'voter_analytics:filter_metadata'
+
+def compute_filter_metadata():
+    '''Reads the distinct parties and the birth year and voter score ranges from the Voter table.'''
+    parties = set()
+    for p in Voter.objects.values_list('party_affiliation', flat=True).distinct().order_by():
+        if p and p.strip(): #stripping the whitespace
+            parties.add(p.strip())
+
+    bounds = Voter.objects.aggregate(
+        min_birth=Min('date_of_birth'), max_birth=Max('date_of_birth'),
+        min_score=Min('voter_score'), max_score=Max('voter_score'),
+    )
+    return {
+        'party_affiliations': sorted(parties),
+        'birth_year_range': (bounds['min_birth'].year, bounds['max_birth'].year) if bounds['min_birth'] else None,
+        'voter_score_range': (bounds['min_score'], bounds['max_score']) if bounds['min_score'] is not None else None,
+    }
+
+def get_filter_metadata():
+    '''Returns the dropdown metadata for the search form, computing it only when it isn't cached.
+
+    The cache entry never expires on its own; the loader and model signals invalidate it.
+    '''
+    metadata = cache.get(METADATA_CACHE_KEY)
+    if metadata is None:
+        metadata = compute_filter_metadata()
+        cache.set(METADATA_CACHE_KEY, metadata, timeout=None)
+    return metadata
+
+def get_search_context():
+    '''Returns the search form's dropdown options as template context.'''
+    metadata = get_filter_metadata()
+    birth_years = metadata['birth_year_range']
+    voter_scores = metadata['voter_score_range']
+    return {
+        'party_affiliations': metadata['party_affiliations'],
+        'birth_years': range(birth_years[0], birth_years[1] + 1) if birth_years else [],
+        'voter_scores': range(voter_scores[0], voter_scores[1] + 1) if voter_scores else [],
+    }
+
+@receiver(voters_changed)
+@receiver(post_save, sender=Voter)
+@receiver(post_delete, sender=Voter)
+def invalidate_filter_metadata(**kwargs):
+    '''Drops the cached metadata whenever the voter data changes.'''
+    cache.delete(METADATA_CACHE_KEY)
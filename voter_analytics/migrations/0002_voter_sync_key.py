@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_analytics', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voter',
+            name='row_hash',
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='voter',
+            name='voter_id',
+            field=models.CharField(blank=True, max_length=20, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_analytics', '0002_voter_sync_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['party_affiliation', 'date_of_birth'], name='voter_party_dob_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['date_of_birth'], name='voter_dob_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['voter_score', 'date_of_birth'], name='voter_score_dob_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['v23town', 'v21town', 'v21primary', 'v22general', 'v20state'], name='voter_elections_idx'),
+        ),
+    ]
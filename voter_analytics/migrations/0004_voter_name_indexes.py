@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_analytics', '0003_voter_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['last_name', 'first_name', 'id'], name='voter_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['party_affiliation', 'last_name', 'first_name', 'id'], name='voter_party_name_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_analytics', '0004_voter_name_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecinctSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('precinct_number', models.CharField(max_length=10)),
+                ('party_affiliation', models.CharField(max_length=10)),
+                ('voters', models.IntegerField(default=0)),
+                ('v20state', models.IntegerField(default=0)),
+                ('v21town', models.IntegerField(default=0)),
+                ('v21primary', models.IntegerField(default=0)),
+                ('v22general', models.IntegerField(default=0)),
+                ('v23town', models.IntegerField(default=0)),
+                ('score_histogram', models.JSONField(default=list)),
+            ],
+            options={
+                'ordering': ['precinct_number', 'party_affiliation'],
+                'unique_together': {('precinct_number', 'party_affiliation')},
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Creates the SQLite FTS5 tables behind the voter name and address search
+
+from django.db import migrations
+
+#a copy of the tables voter_analytics/fts.py uses as they were at this migration,
+#so later changes to fts.py don't change what this migration does
+CREATE_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS voter_analytics_voter_fts USING fts5("
+    "last_name, first_name, street_name, zip, prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS voter_analytics_voter_fts_vocab USING fts5vocab(voter_analytics_voter_fts, 'row')",
+]
+
+INDEX_SQL = (
+    "INSERT INTO voter_analytics_voter_fts (rowid, last_name, first_name, street_name, zip) "
+    "SELECT id, last_name, first_name, residence_address_street_name, residence_address_zip FROM voter_analytics_voter"
+)
+
+DROP_SQL = ["DROP TABLE IF EXISTS voter_analytics_voter_fts_vocab", "DROP TABLE IF EXISTS voter_analytics_voter_fts"]
+
+
+def create_search_index(apps, schema_editor):
+    '''Creates the FTS5 tables and indexes the voters already loaded (SQLite only).'''
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_SQL + [INDEX_SQL]:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    '''Drops the FTS5 tables.'''
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_analytics', '0005_precinctsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_analytics', '0006_voter_search_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='voter',
+            name='voter_elections_idx',
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(condition=models.Q(('v20state__in', [True])), fields=['last_name', 'first_name', 'id', 'v20state', 'v21town', 'v21primary', 'v22general', 'v23town'], name='voter_v20state_voted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(condition=models.Q(('v21town__in', [True])), fields=['last_name', 'first_name', 'id', 'v20state', 'v21town', 'v21primary', 'v22general', 'v23town'], name='voter_v21town_voted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(condition=models.Q(('v21primary__in', [True])), fields=['last_name', 'first_name', 'id', 'v20state', 'v21town', 'v21primary', 'v22general', 'v23town'], name='voter_v21primary_voted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(condition=models.Q(('v22general__in', [True])), fields=['last_name', 'first_name', 'id', 'v20state', 'v21town', 'v21primary', 'v22general', 'v23town'], name='voter_v22general_voted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(condition=models.Q(('v23town__in', [True])), fields=['last_name', 'first_name', 'id', 'v20state', 'v21town', 'v21primary', 'v22general', 'v23town'], name='voter_v23town_voted_idx'),
+        ),
+    ]
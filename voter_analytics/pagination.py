@@ -0,0 +1,68 @@
+## voter_analytics/pagination.py
+## Author: William Fugate wfugate@bu.edu
+## description: keyset (seek) pagination for the voter list
+import base64
+import binascii
+import json
+from django.db.models import Q
+
+#the list is ordered on these, and voter_name_idx/voter_party_name_idx cover them so each page is an index seek
+VOTER_ORDERING = ['last_name', 'first_name', 'id']
+
+#largest count the approximate count will go up to before showing "N+"
+APPROX_COUNT_LIMIT = 10000
+
+def encode_cursor(voter):
+    '''Encodes the sort key of a voter as an opaque, URL-safe cursor.'''
+    key = json.dumps([voter.last_name, voter.first_name, voter.pk])
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    '''Decodes a cursor back into (last_name, first_name, id), or returns None if it is invalid.'''
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        last_name, first_name, pk = json.loads(base64.urlsafe_b64decode(padded))
+        return str(last_name), str(first_name), int(pk)
+    except (ValueError, TypeError, binascii.Error):
+        return None
+
+class KeysetPage:
+    '''One page of a keyset paginated voter list.'''
+
+    def __init__(self, object_list, next_cursor, is_first):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.is_first = is_first
+
+    def has_next(self):
+        '''Returns whether there is a page after this one.'''
+        return self.next_cursor is not None
+
+def keyset_page(queryset, cursor, page_size):
+    '''Returns the page of page_size voters that comes after the cursor (or the first page).
+
+    Instead of OFFSET, the page seeks straight to the rows after the previous page's last
+    (last_name, first_name, id), so a page deep into the results costs the same as the first.
+    '''
+    queryset = queryset.order_by(*VOTER_ORDERING)
+    key = decode_cursor(cursor) if cursor else None
+    if key:
+        last_name, first_name, pk = key
+        queryset = queryset.filter(
+            Q(last_name__gte=last_name), #redundant, but lets SQLite seek into the index instead of scanning from the start
+            Q(last_name__gt=last_name) |
+            Q(last_name=last_name, first_name__gt=first_name) |
+            Q(last_name=last_name, first_name=first_name, id__gt=pk)
+        )
+
+    voters = list(queryset[:page_size + 1]) #fetch one extra to know if there is a next page
+    next_cursor = None
+    if len(voters) > page_size:
+        voters = voters[:page_size]
+        next_cursor = encode_cursor(voters[-1])
+    return KeysetPage(voters, next_cursor, is_first=key is None)
+
+def approximate_count(queryset):
+    '''Counts the queryset up to APPROX_COUNT_LIMIT, returning (count, is_capped).'''
+    count = queryset.order_by()[:APPROX_COUNT_LIMIT + 1].count()
+    return min(count, APPROX_COUNT_LIMIT), count > APPROX_COUNT_LIMIT
@@ -0,0 +1,19 @@
+## voter_analytics/serializers.py
+## Author: William Fugate wfugate@bu.edu
+## description: serializers for the voter_analytics app
+from rest_framework import serializers
+from .models import Voter
+
+#fields shared by the API and the streaming export
+VOTER_FIELDS = [
+    'id', 'voter_id', 'last_name', 'first_name', 'residence_address_street_number',
+    'residence_address_street_name', 'residence_address_apt_number', 'residence_address_zip',
+    'date_of_birth', 'date_of_registration', 'party_affiliation', 'precinct_number',
+    'v20state', 'v21town', 'v21primary', 'v22general', 'v23town', 'voter_score',
+]
+
+#serializer for Voter model
+class VoterSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Voter
+        fields = VOTER_FIELDS
@@ -0,0 +1,9 @@
+## voter_analytics/signals.py
+## Author: William Fugate wfugate@bu.edu
+## description: custom signals for the voter_analytics app
+from django.dispatch import Signal
+
+#sent by the loader once the Voter table has been bulk loaded or synced,
+#since bulk_create/bulk_update/queryset deletes don't send the model signals.
+#precincts and pks are the changed precincts and voter pks, or None if everything may have changed
+voters_changed = Signal()
@@ -0,0 +1,55 @@
+## voter_analytics/summary.py
+## Author: William Fugate wfugate@bu.edu
+## description: keeps the PrecinctSummary table in sync with the Voter table
+from django.db import transaction
+from django.db.models import Count, Q
+from django.dispatch import receiver
+from .filters import ELECTIONS
+from .models import PrecinctSummary, Voter
+from .signals import voters_changed
+
+def refresh_precinct_summary(precincts=None):
+    '''Recomputes the PrecinctSummary rows for the given precincts (or all of them if None).
+
+    Each precinct is recomputed from the Voter table with two grouped queries and its rows
+    are replaced in one transaction, so only the voters in changed precincts are read.
+    Returns the number of summary rows written.
+    '''
+    voters = Voter.objects.all()
+    if precincts is not None:
+        precincts = sorted(set(precincts))
+        if not precincts:
+            return 0
+        voters = voters.filter(precinct_number__in=precincts)
+
+    summaries = {}
+    grouped = voters.values('precinct_number', 'party_affiliation').annotate(
+        total=Count('id'),
+        **{field: Count('id', filter=Q(**{field: True})) for field in ELECTIONS}, #turnout for every election in one pass
+    ).order_by()
+    for row in grouped:
+        key = (row['precinct_number'].strip(), row['party_affiliation'].strip())
+        summary = summaries.setdefault(key, PrecinctSummary(precinct_number=key[0], party_affiliation=key[1], score_histogram=[]))
+        summary.voters += row['total']
+        for field in ELECTIONS:
+            setattr(summary, field, getattr(summary, field) + row[field])
+
+    scores = voters.values('precinct_number', 'party_affiliation', 'voter_score').annotate(total=Count('id')).order_by()
+    for row in scores:
+        histogram = summaries[(row['precinct_number'].strip(), row['party_affiliation'].strip())].score_histogram
+        score = max(row['voter_score'], 0)
+        histogram.extend([0] * (score + 1 - len(histogram))) #grow the histogram up to this score
+        histogram[score] += row['total']
+
+    with transaction.atomic():
+        existing = PrecinctSummary.objects.all()
+        if precincts is not None:
+            existing = existing.filter(precinct_number__in=precincts)
+        existing.delete()
+        PrecinctSummary.objects.bulk_create(summaries.values())
+    return len(summaries)
+
+@receiver(voters_changed)
+def refresh_changed_precincts(precincts=None, **kwargs):
+    '''Refreshes the summary for the precincts the loader touched.'''
+    refresh_precinct_summary(precincts)
@@ -1,3 +1,476 @@
-from django.test import TestCase
+## voter_analytics/tests.py
+## Author: William Fugate wfugate@bu.edu
+## description: tests for the voter loader, search, caches, API and precinct summaries
+import csv
+import json
+import os
+import random
+import shutil
+import string
+import tempfile
+from unittest import mock
+from datetime import date
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+import plotly
+from .admin import VoterAdmin
+from .analytics import get_snapshot
+from .filters import VoterFilter
+from . import fts
+from .fts import search_voters
+from .metadata import get_filter_metadata, get_search_context
+from .pagination import decode_cursor, encode_cursor
+from .views import VoterListView
+from .models import PrecinctSummary, Voter, load_data, parse_voter_row, sync_data
+from .signals import voters_changed
+from .summary import refresh_precinct_summary
 
-# Create your tests here.
+HEADER = ['Voter ID Number', 'Last Name', 'First Name', 'Residential Address - Street Number',
+          'Residential Address - Street Name', 'Residential Address - Apartment Number',
+          'Residential Address - Zip Code', 'Date of Birth', 'Date of Registration', 'Party Affiliation',
+          'Precinct Number', 'v20state', 'v21town', 'v21primary', 'v22general', 'v23town', 'voter_score']
+
+def make_row(voter_id, last_name='Smith', first_name='Pat', party='D', precinct='1', born='1980-05-01', votes=(True, False, False, True, False), score=None):
+    '''Returns one voter CSV row; the voter score defaults to the number of elections voted in.'''
+    return [
+        voter_id, last_name, first_name, '12', 'Main St', '', '02134', born, '2010-01-01', party.ljust(2), precinct,
+        *['TRUE' if vote else 'FALSE' for vote in votes], str(sum(votes) if score is None else score),
+    ]
+
+#a small electorate to search: (voter ID, last name, first name, party, precinct, born, elections voted in)
+VOTERS = [
+    ('V1', 'Adams', 'Ann', 'D', '1', '1950-03-02', (True, True, True, True, True)),
+    ('V2', 'Adams', 'Bob', 'R', '1', '1962-07-14', (True, False, False, True, False)),
+    ('V3', 'Baker', 'Cy', 'D', '2', '1962-01-01', (True, False, False, True, True)),
+    ('V4', 'Baker', 'Cy', 'U', '2', '1988-12-31', (False, False, False, False, False)),
+    ('V5', 'Chen', 'Dee', 'D', '3', '1999-06-30', (True, False, True, True, False)),
+    ('V6', 'Diaz', 'Eve', 'CC', '3', '2001-02-03', (True, False, False, False, False)),
+]
+
+def create_voters(voters=VOTERS):
+    '''Saves voters the way the loader does (no per-voter signals, one voters_changed) and returns them.'''
+    created = Voter.objects.bulk_create([
+        parse_voter_row(make_row(voter_id, last_name, first_name, party, precinct, born, votes))
+        for voter_id, last_name, first_name, party, precinct, born, votes in voters
+    ])
+    voters_changed.send(sender=Voter, precincts=None, pks=None)
+    return created
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'voter_analytics_tests'}})
+class CsvTestCase(TestCase):
+    '''Base class for tests that load voter CSV files from a temporary directory, with a cache of their own.'''
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_csv(self, rows, name='voters.csv'):
+        '''Writes rows under the voter CSV header and returns the file's path.'''
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            writer.writerows(rows)
+        return path
+
+    def get_summary(self):
+        '''Returns {(precinct, party): (voters, v22general turnout)} from the PrecinctSummary table.'''
+        return {(s.precinct_number, s.party_affiliation): (s.voters, s.v22general) for s in PrecinctSummary.objects.all()}
+
+class LoaderTests(CsvTestCase):
+    '''Checks the batched loader writes good rows and sends everything else to the rejects file.'''
+
+    def read_rejects(self, path):
+        '''Returns (line, error) of each row in a rejects file.'''
+        with open(path, newline='') as f:
+            return [(int(row[0]), row[1]) for row in list(csv.reader(f))[1:]]
+
+    def test_load(self):
+        rows = [make_row(f'A{i}', last_name=f'Smith{i}') for i in range(25)]
+        rows += [make_row('B1', born=''), make_row('B2', score='high'), ['B3', 'Short'], make_row('A3', last_name='Again')]
+        rejects = os.path.join(self.directory, 'rejects.csv')
+        stats = load_data(self.write_csv(rows), batch_size=10, rejects_filename=rejects)
+        self.assertEqual((stats['loaded'], stats['rejected']), (25, 4))
+        self.assertEqual(Voter.objects.count(), 25)
+        self.assertEqual(Voter.objects.get(voter_id='A3').last_name, 'Smith3') #the first row with an ID wins
+        voter = Voter.objects.get(voter_id='A7')
+        self.assertEqual((voter.party_affiliation, voter.date_of_birth.year, voter.v20state, voter.v21town, voter.voter_score), ('D', 1980, True, False, 2))
+        self.assertEqual([line for line, _ in self.read_rejects(rejects)], [27, 28, 29, 30]) #line 1 is the header
+        self.assertIn('line 5', self.read_rejects(rejects)[3][1])
+
+    def test_load_into_loaded_table(self):
+        load_data(self.write_csv([make_row('A1')]))
+        rejects = os.path.join(self.directory, 'rejects.csv')
+        stats = load_data(self.write_csv([make_row('A1'), make_row('A2')], name='again.csv'), rejects_filename=rejects)
+        self.assertEqual((stats['loaded'], stats['rejected']), (1, 1))
+        self.assertIn('sync_data', self.read_rejects(rejects)[0][1])
+
+class SyncTests(CsvTestCase):
+    '''Checks re-syncing a voter file inserts, updates and deletes only what changed.'''
+
+    def test_sync(self):
+        load_data(self.write_csv([make_row('A1'), make_row('A2', party='R'), make_row('A3', precinct='2')]))
+        self.assertEqual(self.get_summary(), {('1', 'D'): (1, 1), ('1', 'R'): (1, 1), ('2', 'D'): (1, 1)})
+        a1 = Voter.objects.get(voter_id='A1')
+
+        path = self.write_csv([make_row('A1', last_name='Jones'), make_row('A2', party='R'), make_row('A4', precinct='2', votes=(False,) * 5)])
+        stats = sync_data(path, delete_missing=True)
+        self.assertEqual({key: stats[key] for key in ('inserted', 'updated', 'unchanged', 'deleted', 'rejected')},
+                         {'inserted': 1, 'updated': 1, 'unchanged': 1, 'deleted': 1, 'rejected': 0})
+        self.assertEqual(Voter.objects.get(pk=a1.pk).last_name, 'Jones') #updated in place
+        self.assertCountEqual(Voter.objects.values_list('voter_id', flat=True), ['A1', 'A2', 'A4'])
+        self.assertEqual(self.get_summary(), {('1', 'D'): (1, 1), ('1', 'R'): (1, 1), ('2', 'D'): (1, 0)})
+
+        stats = sync_data(path, delete_missing=True)
+        self.assertEqual((stats['inserted'], stats['updated'], stats['unchanged'], stats['deleted']), (0, 0, 3, 0))
+
+    def test_sync_edge_cases(self):
+        legacy = parse_voter_row(make_row('X'))
+        legacy.voter_id = None #loaded before voter IDs were kept
+        legacy.save()
+        load_data(self.write_csv([make_row('A1'), make_row('A2')]))
+        path = self.write_csv([
+            make_row('A1', last_name='First'), make_row('A1', last_name='Last'), #a repeated ID keeps its last row
+            make_row('A2', born='someday'), #rejected, but still in the file so not deleted
+            make_row('A3'),
+        ])
+        stats = sync_data(path, batch_size=2, delete_missing=True)
+        self.assertEqual((stats['inserted'], stats['updated'], stats['deleted'], stats['rejected']), (1, 1, 1, 1))
+        self.assertEqual(Voter.objects.get(voter_id='A1').last_name, 'Last')
+        self.assertCountEqual(Voter.objects.values_list('voter_id', flat=True), ['A1', 'A2', 'A3'])
+        self.assertFalse(Voter.objects.filter(pk=legacy.pk).exists())
+
+class GraphsTests(CsvTestCase):
+    '''Checks the graphs page counts only the voters matching the search.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        create_voters()
+
+    def get_chart_data(self, params):
+        '''Returns the x/y (or labels/values) of the birth year, party and election charts the graphs page draws.'''
+        with mock.patch.object(plotly.offline, 'plot', wraps=plotly.offline.plot) as plot:
+            self.assertEqual(self.client.get(reverse('graphs'), params).status_code, 200)
+        years, party, elections = [call.args[0]['data'][0] for call in plot.call_args_list]
+        return (
+            dict(zip(years.x, years.y)),
+            dict(zip(party.labels, party.values)),
+            dict(zip(elections.x, elections.y)),
+        )
+
+    def count_chart_builds(self, params):
+        '''Returns how many charts the graphs page had to draw for the search parameters.'''
+        with mock.patch.object(plotly.offline, 'plot', wraps=plotly.offline.plot) as plot:
+            self.client.get(reverse('graphs'), params)
+        return plot.call_count
+
+    def test_chart_cache(self):
+        self.assertEqual(self.count_chart_builds({'party_affiliation': 'D', 'v20state': 'on'}), 3)
+        self.assertEqual(self.count_chart_builds({'v20state': 'on', 'party_affiliation': 'D', 'voter_score': 'x'}), 0) #same effective filters
+        self.assertEqual(self.count_chart_builds({'party_affiliation': 'R'}), 3)
+        voter = Voter.objects.get(voter_id='V1')
+        voter.voter_score = 4
+        voter.save()
+        self.assertEqual(self.count_chart_builds({'party_affiliation': 'D', 'v20state': 'on'}), 3)
+        voters_changed.send(sender=Voter, precincts=None, pks=None)
+        self.assertEqual(self.count_chart_builds({'party_affiliation': 'R'}), 3)
+
+    def test_plotly_js(self):
+        response = self.client.get(reverse('plotly_js', kwargs={'version': plotly.__version__}))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertContains(self.client.get(reverse('graphs')), reverse('plotly_js', kwargs={'version': plotly.__version__}))
+        self.assertEqual(self.client.get(reverse('plotly_js', kwargs={'version': '0.0.1'})).status_code, 404)
+
+    def test_graphs(self):
+        years, parties, elections = self.get_chart_data({})
+        self.assertEqual(years, {1950: 1, 1962: 2, 1988: 1, 1999: 1, 2001: 1})
+        self.assertEqual(parties, {'D': 3, 'R': 1, 'U': 1, 'CC': 1})
+        self.assertEqual(elections, {'v20state': 5, 'v21town': 1, 'v21primary': 2, 'v22general': 4, 'v23town': 2})
+
+        years, parties, elections = self.get_chart_data({'party_affiliation': 'D', 'min_birth_year': 1960, 'v22general': 'on'})
+        self.assertEqual(years, {1962: 1, 1999: 1})
+        self.assertEqual(parties, {'D': 2})
+        self.assertEqual(elections, {'v20state': 2, 'v21town': 0, 'v21primary': 1, 'v22general': 2, 'v23town': 1})
+
+class VoterFilterTests(CsvTestCase):
+    '''Checks the search parameters turn into the lookups (and indexes) they should.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        create_voters()
+
+    def search(self, params):
+        '''Returns the voter IDs matching the search parameters, in order.'''
+        return list(VoterFilter(params).filter(Voter.objects.order_by('voter_id')).values_list('voter_id', flat=True))
+
+    def test_lookups(self):
+        voter_filter = VoterFilter({'party_affiliation': ' D ', 'min_birth_year': '1960', 'max_birth_year': '1999', 'voter_score': '3', 'v22general': 'on', 'v21town': ''})
+        self.assertEqual(voter_filter.get_lookups(), {
+            'party_affiliation': 'D', 'date_of_birth__gte': date(1960, 1, 1), 'date_of_birth__lte': date(1999, 12, 31),
+            'voter_score': 3, 'v22general__in': [True],
+        })
+        self.assertEqual(VoterFilter({'min_birth_year': 'soon', 'max_birth_year': '0', 'voter_score': ''}).get_lookups(), {})
+
+    def test_search(self):
+        self.assertEqual(self.search({}), ['V1', 'V2', 'V3', 'V4', 'V5', 'V6'])
+        self.assertEqual(self.search({'party_affiliation': 'D'}), ['V1', 'V3', 'V5'])
+        self.assertEqual(self.search({'min_birth_year': '1962', 'max_birth_year': '1962'}), ['V2', 'V3']) #the whole year, both ends
+        self.assertEqual(self.search({'voter_score': '2'}), ['V2'])
+        self.assertEqual(self.search({'v22general': 'on', 'v23town': 'on'}), ['V1', 'V3'])
+        self.assertEqual(self.search({'party_affiliation': 'D', 'v21primary': 'on', 'max_birth_year': '1960'}), ['V1'])
+
+    def test_cache_key(self):
+        key = VoterFilter({'party_affiliation': 'R', 'v20state': 'on'}).get_cache_key()
+        self.assertEqual(VoterFilter({'v20state': 'on', 'party_affiliation': 'R ', 'voter_score': 'x'}).get_cache_key(), key)
+        self.assertNotEqual(VoterFilter({'party_affiliation': 'R'}).get_cache_key(), key)
+
+    def test_election_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('partial index matching is checked on SQLite')
+        for field in ['v20state', 'v22general', 'v23town']:
+            sql, params = VoterFilter({field: 'on'}).filter(Voter.objects.all()).query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                self.assertIn(f'voter_{field}_voted_idx', ' '.join(row[-1] for row in cursor.fetchall()))
+
+class MetadataCacheTests(CsvTestCase):
+    '''Checks the search dropdowns are read once and re-read after the voters change.'''
+
+    def test_cached_until_changed(self):
+        create_voters()
+        self.assertEqual(get_filter_metadata(), {'party_affiliations': ['CC', 'D', 'R', 'U'], 'birth_year_range': (1950, 2001), 'voter_score_range': (0, 5)})
+        with self.assertNumQueries(0):
+            self.assertEqual(list(get_search_context()['voter_scores']), [0, 1, 2, 3, 4, 5])
+
+        voter = Voter.objects.get(voter_id='V6')
+        voter.party_affiliation = 'L'
+        voter.save() #post_save drops the cached metadata
+        self.assertEqual(get_filter_metadata()['party_affiliations'], ['D', 'L', 'R', 'U'])
+
+        load_data(self.write_csv([make_row('V7', born='1930-01-01', party='G')]))
+        self.assertEqual(get_filter_metadata()['birth_year_range'], (1930, 2001))
+        self.assertIn('G', get_search_context()['party_affiliations'])
+
+    def test_empty_table(self):
+        self.assertEqual(get_search_context(), {'party_affiliations': [], 'birth_years': [], 'voter_scores': []})
+
+class KeysetPaginationTests(CsvTestCase):
+    '''Checks following the voter list's cursors visits every voter once, in list order.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        create_voters()
+
+    @mock.patch.object(VoterListView, 'paginate_by', 2)
+    def test_pages(self):
+        expected = list(Voter.objects.order_by('last_name', 'first_name', 'id').values_list('voter_id', flat=True))
+        params = {'paginate': 'cursor'}
+        seen = []
+        while True:
+            response = self.client.get(reverse('voters'), params)
+            seen.append([voter.voter_id for voter in response.context['voters']])
+            page = response.context['cursor_page']
+            if not page.has_next():
+                break
+            params['cursor'] = page.next_cursor
+        self.assertEqual(seen, [expected[0:2], expected[2:4], expected[4:6]]) #the two Cy Bakers are split by id
+
+    @mock.patch.object(VoterListView, 'paginate_by', 2)
+    def test_filtered_and_counted(self):
+        with mock.patch('voter_analytics.pagination.APPROX_COUNT_LIMIT', 2):
+            response = self.client.get(reverse('voters'), {'paginate': 'cursor', 'party_affiliation': 'D', 'count': 'approx'})
+        self.assertEqual([voter.voter_id for voter in response.context['voters']], ['V1', 'V3'])
+        self.assertEqual((response.context['approx_count'], response.context['approx_count_capped']), (2, True))
+        response = self.client.get(reverse('voters'), {'paginate': 'cursor', 'party_affiliation': 'D', 'cursor': response.context['cursor_page'].next_cursor})
+        self.assertEqual([voter.voter_id for voter in response.context['voters']], ['V5'])
+
+    def test_cursors(self):
+        voter = Voter.objects.get(voter_id='V4')
+        self.assertEqual(decode_cursor(encode_cursor(voter)), ('Baker', 'Cy', voter.pk))
+        for bad in ['', 'nope', encode_cursor(voter)[:-3]]:
+            self.assertIsNone(decode_cursor(bad))
+        response = self.client.get(reverse('voters'), {'paginate': 'cursor', 'cursor': 'nope'})
+        self.assertTrue(response.context['cursor_page'].is_first) #a bad cursor starts over
+
+class SnapshotTests(CsvTestCase):
+    '''Checks the columnar snapshot counts the same voters the database would.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        create_voters()
+
+    def test_counts(self):
+        snapshot = get_snapshot()
+        self.assertEqual(len(snapshot), 6)
+        (parties, decades), counts = snapshot.count_by(['party', 'decade'])
+        self.assertEqual(decades, [1950, 1960, 1970, 1980, 1990, 2000])
+        table = dict(zip(parties, counts.tolist()))
+        self.assertEqual(table['D'], [1, 1, 0, 0, 1, 0])
+        self.assertEqual(table['CC'], [0, 0, 0, 0, 0, 1])
+
+        for params in [{}, {'party_affiliation': 'D'}, {'v22general': 'on', 'v20state': 'on'}, {'min_birth_year': '1962', 'voter_score': '3'}, {'party_affiliation': 'G'}]:
+            voter_filter = VoterFilter(params)
+            mask = snapshot.mask(voter_filter)
+            voters = voter_filter.filter(Voter.objects.all())
+            self.assertEqual(int(mask.sum()), voters.count(), params)
+            self.assertEqual(snapshot.election_counts(mask), {field: voters.filter(**{field: True}).count() for field in ['v20state', 'v21town', 'v21primary', 'v22general', 'v23town']})
+
+    def test_rebuilt_when_changed(self):
+        snapshot = get_snapshot()
+        self.assertIs(get_snapshot(), snapshot)
+        create_voters([('V7', 'Ng', 'Flo', 'R', '4', '1970-01-01', (False,) * 5)])
+        self.assertEqual(len(get_snapshot()), 7)
+
+    def test_crosstab(self):
+        response = self.client.get(reverse('crosstab'), {'rows': 'precinct', 'columns': 'v23town', 'party_affiliation': 'D'})
+        self.assertEqual(response.json(), {
+            'dimensions': ['precinct', 'v23town'], 'labels': [['1', '2', '3'], [False, True]],
+            'counts': [[0, 1], [0, 1], [1, 0]], 'total': 3,
+        })
+        self.assertEqual(self.client.get(reverse('crosstab'), {'rows': 'shoe size'}).status_code, 400)
+
+class ApiTests(CsvTestCase):
+    '''Checks the JSON API and the streaming CSV/NDJSON export apply the search filters.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        create_voters()
+
+    def test_list(self):
+        page = self.client.get(reverse('api_voters'), {'party_affiliation': 'D', 'page_size': 2}).json()
+        self.assertEqual(page['count'], 3)
+        self.assertEqual([voter['voter_id'] for voter in page['results']], ['V1', 'V3']) #list order, by name
+        self.assertEqual(page['results'][0]['date_of_birth'], '1950-03-02')
+        page = self.client.get(page['next']).json()
+        self.assertEqual([voter['voter_id'] for voter in page['results']], ['V5'])
+        self.assertIsNone(page['next'])
+
+    def test_detail(self):
+        voter = Voter.objects.get(voter_id='V2')
+        response = self.client.get(reverse('api_voter_detail', kwargs={'pk': voter.pk}))
+        self.assertEqual((response.json()['last_name'], response.json()['v20state']), ('Adams', True))
+        self.assertEqual(self.client.get(reverse('api_voter_detail', kwargs={'pk': 0})).status_code, 404)
+
+    def test_csv_export(self):
+        response = self.client.get(reverse('api_voters_export'), {'v22general': 'on'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:3], ['id', 'voter_id', 'last_name'])
+        self.assertEqual([row[1] for row in rows[1:]], ['V1', 'V2', 'V3', 'V5'])
+
+    def test_ndjson_export(self):
+        response = self.client.get(reverse('api_voters_export'), {'format': 'ndjson', 'party_affiliation': 'U'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        voter = json.loads(lines[0])
+        self.assertEqual((voter['voter_id'], voter['date_of_birth'], voter['v23town']), ('V4', '1988-12-31', False))
+
+class PrecinctSummaryTests(CsvTestCase):
+    '''Checks the precinct summaries match the voters after loads, syncs and admin edits.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        create_voters()
+
+    def test_summary(self):
+        summary = PrecinctSummary.objects.get(precinct_number='1', party_affiliation='D')
+        self.assertEqual((summary.voters, summary.v20state, summary.v21town, summary.v23town), (1, 1, 1, 1))
+        self.assertEqual(summary.score_histogram, [0, 0, 0, 0, 0, 1]) #one voter with a score of 5
+        self.assertEqual(PrecinctSummary.objects.count(), 6)
+        PrecinctSummary.objects.all().delete()
+        self.assertEqual(refresh_precinct_summary(), 6)
+        self.assertEqual(refresh_precinct_summary(['2']), 2)
+        self.assertEqual(refresh_precinct_summary([]), 0)
+
+    def test_dashboard(self):
+        precincts = self.client.get(reverse('precincts')).context['precincts']
+        self.assertEqual([precinct['number'] for precinct in precincts], ['1', '2', '3'])
+        self.assertEqual(precincts[1]['voters'], 2)
+        self.assertEqual(precincts[1]['turnout'], [50, 0, 0, 50, 50])
+        self.assertEqual(precincts[2]['parties'], [('CC', 1), ('D', 1)]) #biggest first, ties in summary order
+        self.assertEqual(precincts[0]['scores'], [0, 0, 1, 0, 0, 1])
+
+    def test_admin_edit(self):
+        voter_admin = VoterAdmin(Voter, admin.site)
+        request = RequestFactory().post('/')
+        request.user = User.objects.create_superuser('admin')
+        voter = Voter.objects.get(voter_id='V2')
+        form = voter_admin.get_form(request, voter)(instance=voter)
+        voter.precinct_number = '3'
+        voter_admin.save_model(request, voter, form, change=True)
+        self.assertFalse(PrecinctSummary.objects.filter(precinct_number='1', party_affiliation='R').exists()) #moved out of 1
+        self.assertEqual(PrecinctSummary.objects.get(precinct_number='3', party_affiliation='R').voters, 1)
+
+        voter_admin.delete_queryset(request, Voter.objects.filter(precinct_number='2'))
+        self.assertFalse(PrecinctSummary.objects.filter(precinct_number='2').exists())
+
+class SearchTests(CsvTestCase):
+    '''Checks the full-text name and address search, and that it follows loads and edits.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        create_voters()
+        create_voters([('V7', 'Smith', 'Gus', 'R', '4', '1970-01-01', (False,) * 5), ('V8', 'Smithers', 'Hal', 'R', '4', '1971-01-01', (False,) * 5)])
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor != 'sqlite':
+            self.skipTest('the search index is SQLite FTS5')
+
+    def search(self, query, **kwargs):
+        '''Returns the voter IDs the search finds, best first.'''
+        return [voter.voter_id for voter in search_voters(query, **kwargs)]
+
+    def test_search(self):
+        self.assertEqual(self.search('smith'), ['V7', 'V8']) #the whole word first, then names starting with it
+        self.assertEqual(self.search('ADAMS ann'), ['V1'])
+        self.assertEqual(self.search('ba c'), ['V3', 'V4'])
+        self.assertEqual(self.search('smith', limit=1), ['V7'])
+        self.assertEqual(self.search('"main" *'), self.search('main')) #FTS5 syntax is just punctuation
+        self.assertEqual(self.search(''), [])
+        self.assertEqual(self.search('smith', limit=0), [])
+        self.assertEqual(self.search('smith', limit=-1), []) #not LIMIT -1, which SQLite reads as no limit
+
+    def test_fuzzy(self):
+        self.assertEqual(self.search('smiht'), ['V7']) #nothing matches, so close spellings are tried
+        self.assertEqual(self.search('adams an', fuzzy=True)[:1], ['V1'])
+
+    def test_fuzzy_large_vocabulary(self):
+        rng = random.Random(11)
+        words = {''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))) for _ in range(40000)} #about a full roll's names and streets
+        with connection.cursor() as cursor: #index rows of no voter, they only add words
+            cursor.executemany(
+                f"INSERT INTO {fts.WORD_TABLE} (rowid, last_name, first_name, street_name, zip) VALUES (%s, %s, '', '', '')",
+                [(10 ** 6 + i, word) for i, word in enumerate(sorted(words))])
+            candidates = fts.get_spelling_candidates(cursor, 'smiht')
+        self.assertIn('smith', candidates)
+        self.assertTrue(all(word[0] == 's' and 3 <= len(word) <= 7 for word in candidates))
+        self.assertLess(len(candidates), len(words) / 20) #only these go through difflib
+        with self.assertNumQueries(5): #whole words, prefixes, the candidates, close spellings, the voters
+            self.assertEqual(self.search('smiht'), ['V7'])
+
+    def test_follows_changes(self):
+        voter = Voter.objects.get(voter_id='V6')
+        voter.last_name = 'Zimmer'
+        voter.save()
+        self.assertEqual(self.search('zimmer'), ['V6'])
+        self.assertEqual(self.search('diaz'), [])
+        load_data(self.write_csv([make_row('V9', last_name='Quill')]))
+        self.assertEqual(self.search('quil'), ['V9'])
+        sync_data(self.write_csv([make_row('V9', last_name='Quill')], name='sync.csv'), delete_missing=True)
+        self.assertEqual(self.search('zimmer'), [])
+
+    def test_view(self):
+        url = reverse('voter_search')
+        self.assertEqual(len(self.client.get(url, {'q': 'smith', 'limit': -1}).json()['results']), 1)
+        self.assertEqual(len(self.client.get(url, {'q': 'smith', 'limit': 0}).json()['results']), 2) #0 falls back to the default of 20
+        results = self.client.get(reverse('voter_search'), {'q': 'chen'}).json()['results']
+        voter = Voter.objects.get(voter_id='V5')
+        self.assertEqual(results, [{'id': voter.pk, 'name': 'Dee Chen', 'address': '12 Main St', 'zip': '02134', 'url': reverse('voter', kwargs={'pk': voter.pk})}])
@@ -7,5 +7,11 @@ urlpatterns = [
     path('', VoterListView.as_view(), name='voters'), #default route shows all voters
     path('voter/<int:pk>', VoterDetailView.as_view(), name='voter'), 
     path('graphs', GraphsView.as_view(), name='graphs'),
-
+    path('precincts', PrecinctDashboardView.as_view(), name='precincts'), #turnout and party mix per precinct
+    path('search', VoterSearchView.as_view(), name='voter_search'), #JSON name and address search
+    path('crosstab', CrossTabView.as_view(), name='crosstab'), #JSON voter counts grouped by up to two dimensions
+    path('plotly-<str:version>.min.js', PlotlyJSView.as_view(), name='plotly_js'), #plotly.js bundle for the graphs page
+    path('api/voters', VoterListAPIView.as_view(), name='api_voters'), #filtered, paginated JSON list of voters
+    path('api/voter/<int:pk>', VoterDetailAPIView.as_view(), name='api_voter_detail'),
+    path('api/voters/export', VoterExportView.as_view(), name='api_voters_export'), #streaming CSV/NDJSON export
 ]
\ No newline at end of file
@@ -2,11 +2,32 @@
 ## Author: William Fugate wfugate@bu.edu
 ## description: views.py for voter_analytics app
 
-from django.views.generic import ListView, DetailView
-from .models import Voter
+from django.views.generic import ListView, DetailView, View
+from django.urls import reverse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from rest_framework import generics
+from rest_framework.pagination import PageNumberPagination
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from .models import Voter, PrecinctSummary
+from .filters import VoterFilter, ELECTIONS, parse_int
+from .metadata import get_search_context
+from .pagination import VOTER_ORDERING, keyset_page, approximate_count
+from .charts import get_charts
+from .analytics import get_snapshot
+from .serializers import VoterSerializer, VOTER_FIELDS
+from .fts import search_voters
+import csv
+import json
+from functools import cache
 import plotly
 import plotly.graph_objs as go
 
+@cache
+def get_plotlyjs():
+    '''Reads the multi-megabyte plotly.js bundle from the plotly package once per process.'''
+    return plotly.offline.get_plotlyjs()
+
 class VoterListView(ListView):
     '''View to see the full list of voters.'''
     model = Voter
@@ -16,61 +37,29 @@ class VoterListView(ListView):
 
     def get_queryset(self):
         '''Filters the Voters by specified search parameters from GET request'''
-        queryset = Voter.objects.all() #get the voter objects
-
-        #get the search parameters from the request (will be null if not present)
-        party = self.request.GET.get('party_affiliation')
-        min_year = self.request.GET.get('min_birth_year')
-        max_year = self.request.GET.get('max_birth_year')
-        voter_score = self.request.GET.get('voter_score')
-
-        v20state = self.request.GET.get('v20state')
-        v21town = self.request.GET.get('v21town')
-        v21primary = self.request.GET.get('v21primary')
-        v22general = self.request.GET.get('v22general')
-        v23town = self.request.GET.get('v23town')
-
-        #check each parameter and apply a filter for it if present, resulting in filtered a list
-        if party:
-            queryset = queryset.filter(party_affiliation=party.strip())
-
-        if min_year:
-            queryset = queryset.filter(date_of_birth__year__gte=int(min_year))
-        
-        if max_year:
-            queryset = queryset.filter(date_of_birth__year__lte=int(max_year))
-        
-        if voter_score:
-            queryset = queryset.filter(voter_score=int(voter_score))
+        return VoterFilter(self.request.GET).filter(Voter.objects.all()).order_by(*VOTER_ORDERING)
 
-        if v20state:
-            queryset = queryset.filter(v20state=True)
+    def is_cursor_mode(self):
+        '''Returns whether the request opted in to keyset pagination (?paginate=cursor).'''
+        return self.request.GET.get('paginate') == 'cursor'
 
-        if v21town:
-            queryset = queryset.filter(v21town=True)
-        
-        if v21primary:
-            queryset = queryset.filter(v21primary=True)
-
-        if v22general:
-            queryset = queryset.filter(v22general=True)
-        
-        if v23town:
-            queryset = queryset.filter(v23town=True)
-        return queryset
+    def get_paginate_by(self, queryset):
+        '''Turns off the offset paginator (and its COUNT(*)) when keyset pagination is used.'''
+        if self.is_cursor_mode():
+            return None
+        return super().get_paginate_by(queryset)
 
     def get_context_data(self, **kwargs):
         '''Adds party affiliations and birth_years and voter_scores to VoterListView context'''
+        if self.is_cursor_mode():
+            page = keyset_page(self.object_list, self.request.GET.get('cursor'), self.paginate_by)
+            kwargs['object_list'] = page.object_list #show just this page of voters
+            kwargs['cursor_page'] = page
+            if self.request.GET.get('count') == 'approx': #counting is optional since it is the expensive part
+                kwargs['approx_count'], kwargs['approx_count_capped'] = approximate_count(self.object_list)
         context = super().get_context_data(**kwargs)
 
-        parties = Voter.objects.values_list('party_affiliation', flat=True).distinct().order_by('party_affiliation') #get all party affiliations as a list (flat) then get distinct and order them 
-        party_affiliations = []
-        for p in parties: #stripping the whitespace
-            if p:
-                party_affiliations += [p.strip()] 
-        context['party_affiliations'] = party_affiliations #assigning to context                                       
-        context['birth_years'] = range(1900, 2025)
-        context['voter_scores'] = range(0, 6)
+        context.update(get_search_context()) #cached party affiliations, birth_years and voter_scores for the dropdowns
         return context
 
 
@@ -90,79 +79,33 @@ class GraphsView(ListView):
     
     def get_queryset(self):
         '''Filters the voters based on search parameters'''
-        #same filtering logic from VoterListView
-        queryset = Voter.objects.all()
-        
-        party = self.request.GET.get('party_affiliation')
-        min_year = self.request.GET.get('min_birth_year')
-        max_year = self.request.GET.get('max_birth_year')
-        voter_score = self.request.GET.get('voter_score')
-
-        v20state = self.request.GET.get('v20state')
-        v21town = self.request.GET.get('v21town')
-        v21primary = self.request.GET.get('v21primary')
-        v22general = self.request.GET.get('v22general')
-        v23town = self.request.GET.get('v23town')
-        
-        if party:
-            queryset = queryset.filter(party_affiliation=party.strip())
-        
-        if min_year:
-            queryset = queryset.filter(date_of_birth__year__gte=int(min_year))
-        
-        if max_year:
-            queryset = queryset.filter(date_of_birth__year__lte=int(max_year))
-        
-        if voter_score:
-            queryset = queryset.filter(voter_score=int(voter_score))
-        
-        if v20state:
-            queryset = queryset.filter(v20state=True)
-
-        if v21town:
-            queryset = queryset.filter(v21town=True)
-        
-        if v21primary:
-            queryset = queryset.filter(v21primary=True)
-
-        if v22general:
-            queryset = queryset.filter(v22general=True)
-        
-        if v23town:
-            queryset = queryset.filter(v23town=True)
-        
-        return queryset
+        return VoterFilter(self.request.GET).filter(Voter.objects.all()) #same filtering logic from VoterListView
     
     def get_context_data(self, **kwargs):
-        '''Creates graphs based on Voter data and adds them to the context of the GraphsView'''
+        '''Adds the graphs of the filtered Voter data to the context of the GraphsView'''
         context = super().get_context_data(**kwargs)
-        
-        voters = self.get_queryset() #getting the set of Voters
-        
-        #same as VoterListView
-        parties = Voter.objects.values_list('party_affiliation', flat=True).distinct().order_by('party_affiliation')
-        party_affiliations = []
-        for p in parties: #stripping the whitespace
-            if p:
-                party_affiliations += [p.strip()] 
-        context['party_affiliations'] = party_affiliations #assigning to context     
-        context['birth_years'] = range(1900, 2010)
-        context['voter_scores'] = range(0, 6)
+        context.update(get_search_context()) #same as VoterListView
+
+        voter_filter = VoterFilter(self.request.GET)
+        #the charts only depend on the filters, so reuse them until the data is reloaded
+        context.update(get_charts(voter_filter, lambda: self.make_graphs(voter_filter)))
+        context['plotly_version'] = plotly.__version__ #plotly.js is loaded once from PlotlyJSView
+        return context
+
+    def make_graphs(self, voter_filter):
+        '''Creates the graph divs for the Voters matching the filter, counted from the in-memory snapshot'''
+        graphs = {}
+        snapshot = get_snapshot()
+        mask = snapshot.mask(voter_filter) #the voters matching the search parameters
         
         #birth year graph
-        birth_years = []
-        for voter in voters: #get all the voter year of births into a list
-            if voter.date_of_birth:
-                birth_years.append(voter.date_of_birth.year)
-
-        year_counts = {}
-        for year in birth_years: #find out how many of each year of birth there is
-            year_counts[year] = year_counts.get(year, 0) + 1
-        
-        sorted_years = sorted(year_counts.keys()) #sort to put data in order
+        (years,), year_counts = snapshot.count_by(['birth_year'], mask)
+        sorted_years = []
         counts = []
-        for year in sorted_years: 
-            counts += [year_counts[year]] #create a list of the sorted counts (to align with the years in order)
+        for year, count in zip(years, year_counts.tolist()): #already sorted so the years and counts line up
+            if count:
+                sorted_years += [year]
+                counts += [count]
         
         figure1 = go.Bar(x=sorted_years, y=counts) #make the bar graph 
 
@@ -171,15 +114,13 @@ class GraphsView(ListView):
                                          "layout_title_text": title1,
                                          }, 
                                          auto_open=False, 
+                                         include_plotlyjs=False, #the template loads plotly.js once
                                          output_type="div")
-        # send div as template context variable
-        context['birth_year_graph'] = birth_year_graph
+        graphs['birth_year_graph'] = birth_year_graph
         
         #party affiliation graph
-        party_counts = {}
-        for voter in voters: #make a list that counts how many of each party we have
-            party = voter.party_affiliation.strip()
-            party_counts[party] = party_counts.get(party, 0) + 1
+        (parties,), party_totals = snapshot.count_by(['party'], mask)
+        party_counts = {party: count for party, count in zip(parties, party_totals.tolist()) if count}
 
         figure2 = go.Pie( #make the graph 
                 labels=list(party_counts.keys()), 
@@ -191,16 +132,12 @@ class GraphsView(ListView):
                                          "layout_title_text": title2,
                                          }, 
                                          auto_open=False, 
+                                         include_plotlyjs=False, #the template loads plotly.js once
                                          output_type="div")
-        # send div as template context variable
-        context['party_affiliation_graph'] = party_affiliation_graph
+        graphs['party_affiliation_graph'] = party_affiliation_graph
         
         #election participation graph
-        elections = ['v20state','v21town','v21primary','v22general', 'v23town']
-        election_counts = {}
-        for field in elections: #make a dict of the counts 
-            count = voters.filter(**{field: True}).count()
-            election_counts[field] = count
+        election_counts = snapshot.election_counts(mask)
         
         figure3 = go.Bar(x=list(election_counts.keys()), y=list(election_counts.values())) #make the graph 
 
@@ -209,8 +146,151 @@ class GraphsView(ListView):
                                          "layout_title_text": title3,
                                          }, 
                                          auto_open=False, 
+                                         include_plotlyjs=False, #the template loads plotly.js once
                                          output_type="div")
-        # send div as template context variable
-        context['election_participation_graph'] = election_participation_graph
-        #return with all the graphs in the updated context
-        return context
\ No newline at end of file
+        graphs['election_participation_graph'] = election_participation_graph
+        return graphs
+
+
+@method_decorator(cache_control(public=True, max_age=60 * 60 * 24 * 365, immutable=True), name='dispatch')
+class PlotlyJSView(View):
+    '''Serves the plotly.js bundle as one long-cached asset instead of inlining it in every chart.
+    The URL includes the plotly version, so upgrading plotly changes the URL.'''
+
+    def get(self, request, version):
+        '''Returns the plotly.js bundle that ships with the installed plotly package, if that is the version asked for.'''
+        if version != plotly.__version__: #an old URL must not be cached forever with a different bundle
+            raise Http404(f'plotly.js {version} is not available')
+        return HttpResponse(get_plotlyjs(), content_type='text/javascript')
+
+
+class CrossTabView(View):
+    '''JSON cross-tab of voter counts, e.g. ?rows=party&columns=decade&v22general=on'''
+
+    def get(self, request):
+        '''Counts the voters matching the search parameters, grouped by the rows (and optional columns) dimension.'''
+        dimensions = [request.GET.get('rows', 'party')]
+        if request.GET.get('columns'):
+            dimensions.append(request.GET['columns'])
+
+        snapshot = get_snapshot()
+        try:
+            labels, counts = snapshot.count_by(dimensions, snapshot.mask(VoterFilter(request.GET)))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        return JsonResponse({
+            'dimensions': dimensions,
+            'labels': labels, #one list of labels per dimension
+            'counts': counts.tolist(), #nested lists indexed [row][column]
+            'total': int(counts.sum()),
+        })
+
+
+
+class PrecinctDashboardView(ListView):
+    '''View to see turnout and party mix per precinct, read only from the precomputed PrecinctSummary table'''
+    model = PrecinctSummary
+    template_name = 'voter_analytics/precincts.html'
+    context_object_name = 'summaries'
+
+    def get_context_data(self, **kwargs):
+        '''Combines the per-party summary rows into one row per precinct'''
+        context = super().get_context_data(**kwargs)
+        precincts = {}
+        for summary in self.object_list: #one row per precinct and party, ordered by precinct
+            precinct = precincts.setdefault(summary.precinct_number, {
+                'number': summary.precinct_number, 'voters': 0, 'parties': [], 'scores': [],
+                'elections': {field: 0 for field in ELECTIONS},
+            })
+            precinct['voters'] += summary.voters
+            precinct['parties'] += [(summary.party_affiliation or 'none', summary.voters)]
+            for field in ELECTIONS:
+                precinct['elections'][field] += getattr(summary, field)
+            for score, count in enumerate(summary.score_histogram): #add up the histograms of each party
+                if score == len(precinct['scores']):
+                    precinct['scores'] += [0]
+                precinct['scores'][score] += count
+
+        for precinct in precincts.values():
+            precinct['parties'].sort(key=lambda party: -party[1]) #biggest party first
+            precinct['turnout'] = [ #percent of the precinct that voted in each election
+                round(100 * precinct['elections'][field] / precinct['voters']) if precinct['voters'] else 0
+                for field in ELECTIONS
+            ]
+        context['precincts'] = list(precincts.values())
+        context['elections'] = ELECTIONS
+        return context
+
+
+class VoterSearchView(View):
+    '''JSON name and address search, e.g. ?q=smi walnut or ?q=smiht&fuzzy=1'''
+
+    def get(self, request):
+        '''Returns the best matching voters from the full-text index.'''
+        limit = max(1, min(parse_int(request.GET.get('limit')) or 20, 100))
+        voters = search_voters(request.GET.get('q', ''), limit=limit, fuzzy=bool(request.GET.get('fuzzy')))
+        return JsonResponse({'results': [
+            {
+                'id': voter.pk,
+                'name': f'{voter.first_name} {voter.last_name}',
+                'address': f'{voter.residence_address_street_number} {voter.residence_address_street_name}',
+                'zip': voter.residence_address_zip,
+                'url': reverse('voter', kwargs={'pk': voter.pk}),
+            }
+            for voter in voters
+        ]})
+
+class VoterAPIPagination(PageNumberPagination):
+    '''Pages of 100 voters, like the HTML list, with ?page_size= up to 1000.'''
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class VoterListAPIView(generics.ListAPIView):
+    """An API view to return a filtered listing of Voters, using the same parameters as the voter list."""
+    serializer_class = VoterSerializer
+    pagination_class = VoterAPIPagination
+
+    def get_queryset(self):
+        """Filters the Voters by the search parameters"""
+        return VoterFilter(self.request.GET).filter(Voter.objects.all()).order_by(*VOTER_ORDERING)
+
+
+class VoterDetailAPIView(generics.RetrieveAPIView):
+    """An API view to return a single Voter."""
+    queryset = Voter.objects.all()
+    serializer_class = VoterSerializer
+
+
+class Echo:
+    '''Pseudo-buffer for csv.writer that hands back each line instead of storing it.'''
+    def write(self, value):
+        return value
+
+
+class VoterExportView(View):
+    '''Streams every Voter matching the search parameters as CSV (default) or NDJSON (?format=ndjson).'''
+    chunk_size = 2000
+
+    def get(self, request):
+        '''Starts streaming right away, reading rows as tuples in chunks so memory stays constant.'''
+        voters = VoterFilter(request.GET).filter(Voter.objects.all())
+        rows = voters.order_by('id').values_list(*VOTER_FIELDS).iterator(chunk_size=self.chunk_size) #rowid order, no sort needed
+
+        if request.GET.get('format') == 'ndjson':
+            lines = (json.dumps(dict(zip(VOTER_FIELDS, row)), default=str) + '\n' for row in rows) #dates as ISO strings
+            response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+            response['Content-Disposition'] = 'attachment; filename="voters.ndjson"'
+        else:
+            writer = csv.writer(Echo())
+            lines = (writer.writerow(row) for row in rows)
+            response = StreamingHttpResponse(self.with_header(writer, lines), content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="voters.csv"'
+        return response
+
+    def with_header(self, writer, lines):
+        '''Yields the CSV header line followed by the data lines.'''
+        yield writer.writerow(VOTER_FIELDS)
+        yield from lines